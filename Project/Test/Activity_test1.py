@@ -3,6 +3,9 @@ import subprocess
 import json
 import os
 import glob
+import sys
+from Test.golden_reference import load_reference
+from Test.log_pipeline import NullEventStream
 ## @class Activitytest1
 #  @brief Test example to compare the output of the 'nvme id-ctrl' command with reference data.
 #
@@ -11,9 +14,24 @@ import glob
 #  to validate that there are no discrepancies.
 
 class Activitytest1:
-    def __init__(self, nvme_interface=None, logger=None):
+    TEST_METADATA = {
+        "key": "1",
+        "name": "Activity test1",
+        "destructive": False,
+        "requires_passthru": False,
+        "features": [],
+        "estimated_duration": 2,
+        "options": ["reference"],
+    }
+
+    def __init__(self, nvme_interface=None, logger=None, device=None, reference=None, events=None):
         self.nvme_interface = nvme_interface
         self.logger = logger or print
+        self.device = device or getattr(nvme_interface, "device_path", None) or "/dev/nvme0"
+        self.result = "NOT RUN"
+        self.events = events or NullEventStream()
+        # Reference JSON (or .bin golden image); None asks the user, or uses the good one when headless
+        self.reference = reference
         self.ignore_fields = {"sn", "fguid", "unvmcap", "subnqn"}
 
     def run(self):
@@ -21,63 +39,85 @@ class Activitytest1:
         # Step 1: Get id-ctrl data
         if self.nvme_interface:
             self.logger.debug("Collecting id-ctrl data via Admin Passthru...")
-            output = self.nvme_interface.send_passthru_cmd(opcode='0x06', data_len=4096)
-            raise NotImplementedError("Binary parsing for passthru not yet implemented")
+            # Step 2: Lazy binary view; fields are decoded only when compared
+            current_data = self.nvme_interface.identify_controller(copy=False)
+            if current_data is None:
+                self.logger.error("Identify Controller via Admin Passthru failed")
+                self.result = "FAILED"
+                return
         else:
             self.logger.debug("Collecting id-ctrl data via NVMe CLI...")
-            output = subprocess.check_output(['nvme', 'id-ctrl', '/dev/nvme0', '--output-format=json'], text=True)
-        # Step 2: Parse to JSON
-        try:
-            current_data = json.loads(output)
-        except json.JSONDecodeError:
-            self.logger.error("Failed to parse nvme id-ctrl output as JSON")
-            return
+            output = subprocess.check_output(['nvme', 'id-ctrl', self.device, '--output-format=json'], text=True)
+            # Step 2: Parse to JSON
+            try:
+                current_data = json.loads(output)
+            except json.JSONDecodeError:
+                self.logger.error("Failed to parse nvme id-ctrl output as JSON")
+                self.result = "FAILED"
+                return
 
-        # Step 3: Ask user which reference JSON to use
+        # Step 3: Reference JSON given by the test plan, else ask the user
         BASE_DIR = os.environ.get("NVME_PROJECT_DIR") or os.path.dirname(os.path.abspath(__file__))
         if os.path.basename(BASE_DIR) == "Test":
             REF_DIR = BASE_DIR
         else:
             REF_DIR = os.path.join(BASE_DIR, "Test")
 
-        json_options = glob.glob(os.path.join(REF_DIR, "id-ctrl-main_*.json"))
+        default_file = os.path.join(REF_DIR, "id-ctrl-main_good.json")
+        if self.reference:
+            selected_file = self.reference
+            if not os.path.isabs(selected_file) and not os.path.exists(selected_file):
+                selected_file = os.path.join(REF_DIR, selected_file)
+        elif not sys.stdin.isatty():
+            # Unattended run: nobody to answer the prompt
+            self.logger.info(f"No reference file given, using default: {default_file}")
+            selected_file = default_file
+        else:
+            json_options = glob.glob(os.path.join(REF_DIR, "id-ctrl-main_*.json"))
 
-        if not json_options:
-            self.logger.error(f"No reference JSON files found in {REF_DIR}")
-            return
+            if not json_options:
+                self.logger.error(f"No reference JSON files found in {REF_DIR}")
+                self.result = "FAILED"
+                return
 
-        self.logger.info("Available reference JSON files:")
-        for i, fname in enumerate(json_options, start=1):
-            print(f"{i}) {fname}")
+            self.logger.info("Available reference JSON files:")
+            for i, fname in enumerate(json_options, start=1):
+                print(f"{i}) {fname}")
 
-        choice = input("Select reference file [1/2]: ").strip()
-        try:
-           selected_file = json_options[int(choice) - 1]
-        except (ValueError, IndexError):
-            self.logger.error("Invalid selection. Using default: id-ctrl-main_good.json")
-            selected_file = json_options[0]
+            choice = input("Select reference file [1/2]: ").strip()
+            try:
+               selected_file = json_options[int(choice) - 1]
+            except (ValueError, IndexError):
+                self.logger.error("Invalid selection. Using default: id-ctrl-main_good.json")
+                selected_file = default_file
 
         if not os.path.exists(selected_file):
             self.logger.error(f"Reference file not found: {selected_file}")
+            self.result = "FAILED"
             return
-        
-        with open(selected_file, 'r') as f:
-            reference_data = json.load(f)
+        self.logger.info(f"Reference file: {selected_file}")
 
         # Step 4: Compare
-        errors = 0
-        for key, expected_value in reference_data.items():
-            if key in self.ignore_fields:
-                continue
-            current_value = current_data.get(key)
-            if current_value != expected_value:
-                self.logger.error(f"Mismatch in '{key}': Expected {expected_value}, Found {current_value}")
-                errors += 1
-            else:
-                self.logger.debug(f"Match in '{key}': {expected_value}")
+        if self.nvme_interface:
+            # One masked comparison against the compiled (and cached) golden image;
+            # the per-field diff only runs on a mismatch
+            golden = load_reference(selected_file, self.ignore_fields)
+            mismatches = golden.compare(current_data.raw)
+        else:
+            with open(selected_file, 'r') as f:
+                reference_data = json.load(f)
+            mismatches = [(key, expected_value, current_data.get(key))
+                          for key, expected_value in reference_data.items()
+                          if key not in self.ignore_fields and current_data.get(key) != expected_value]
+        for key, expected_value, current_value in mismatches:
+            self.logger.error("Mismatch in '%s': Expected %s, Found %s", key, expected_value, current_value)
+            self.events.emit("mismatch", field=key, expected=expected_value, found=current_value)
+        errors = len(mismatches)
 
         # Step 5: Final result
         if errors == 0:
+            self.result = "PASSED"
             self.logger.info("Test PASSED - All fields match.")
         else:
+            self.result = "FAILED"
             self.logger.warning(f"Test FAILED - {errors} mismatches found.")
@@ -1,29 +1,57 @@
 #!/bin/env python3.9
-import subprocess
-import json
 import os
 import random
+import asyncio
+from Test.io_passthru_wrapper import NVME_CMD_READ
+from Test.log_pipeline import LazyJson, NullEventStream
+from Test.nvme_geometry import namespace_geometry
+from Test.smart_store import SmartSnapshotStore
+from Test.trace import CommandTrace, replay
+from Test.workload import IntegrityWorkload
 ## @class ActivityTest2
 #  @brief Test to validate that the NVMe SMART log is working as expected.
 #
 #  This test uses Admin Passthru to collect SMART log data and validate multiple health parameters.
 #  It also executes read/write operations to confirm that counters increment correctly.
-nvme_id_ns = subprocess.run(
-    ["nvme", "id-ns", "/dev/nvme0n1", "-o", "json"],
-    capture_output=True, text=True, check=True
-)
-ns_info = json.loads(nvme_id_ns.stdout)
-max_blocks = ns_info["nsze"]  # total LBA del namespace
 
 class Activitytest2:
-    def __init__(self, nvme_interface=None, logger=None):
+    # Writes random LBAs of namespace 1 and changes the temperature threshold
+    TEST_METADATA = {
+        "key": "2",
+        "name": "Activity test2",
+        "destructive": True,
+        "requires_passthru": True,
+        "features": [],
+        "estimated_duration": 30,
+        "options": ["queue_depth", "seed", "trace"],
+    }
+
+    ## @param seed  Seed of N and of the command sequence (default: random, logged).
+    #  @param trace Where to save the issued command trace (Test/trace.py); by default
+    #               io_trace_<device>_<seed>.nvtr in the results directory, "" to not save it.
+    def __init__(self, nvme_interface=None, logger=None, io_engine=None, queue_depth=32, device=None, events=None,
+                 seed=None, trace=None):
         self.nvme_interface = nvme_interface
+        self.device = device or getattr(nvme_interface, "device_path", None) or "/dev/nvme0"
+        self.result = "NOT RUN"
+        self.io_engine = io_engine
+        self.queue_depth = queue_depth
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.trace_path = trace
         self.logger = logger or print
+        self.events = events or NullEventStream()
+        # Background SmartSampler set by TestManager (--smart-interval), if any
+        self.smart_sampler = None
+        # Per-device results directory set by TestManager (None: current directory)
+        self.results_dir = None
+        # Every SMART log this test reads, as columns (Test/smart_store.py)
+        self.smart_store = SmartSnapshotStore()
         self.initial_temp_threshold = None
 
     def run(self):
         if not self.nvme_interface:
             self.logger.error("AdminPassthruWrapper is required for this test.")
+            self.result = "FAILED"
             return
 
         self.logger.info("=== Starting SMART Log Validation Test ===")
@@ -31,8 +59,8 @@ class Activitytest2:
 
         # Step 1: Initial SMART log snapshot
         smart_log_start = self._get_smart_log()
-        pretty_log = json.dumps(smart_log_start, indent=4, sort_keys=True)
-        self.logger.debug(f"Initial SMART log:\n{pretty_log}")
+        self.logger.debug("Initial SMART log:\n%s", LazyJson(smart_log_start))
+        self.events.emit("smart_log", stage="start", data=smart_log_start)
 
         # Step 2: Check media errors
         if smart_log_start.get("media_errors", 0) != 0:
@@ -55,41 +83,39 @@ class Activitytest2:
            self.initial_temp_threshold = 100  # fallback
 
         # Step 5: Percentage used
-        if smart_log_start.get("percentage_used", 0) >= 100:
+        if smart_log_start.get("percent_used", 0) >= 100:
             errors.append("Percentage used is >= 100%")
 
-        # Step 6: Generate random N reads/writes
-        N = random.randint(10, 1000)
-        self.logger.info(f"Performing {N} read and {N} write commands...")
-        
-        read_file = "/tmp/nvme_read_data"
-        with open(read_file, "wb") as f:
-            f.write(b"\x00"*4096)
-        write_file = "/tmp/nvme_write_data"
-        with open(write_file, "wb") as f:
-            f.write(b"\x00"*4096)
+        # Step 6: Generate random N reads/writes (reproducible with seed=...)
+        rng = random.Random(self.seed)
+        N = rng.randint(10, 1000)
+        self.logger.info("Performing %d read and %d write commands (seed %d)...", N, N, self.seed)
 
-        try:
-           for _ in range(N):
-               blk = random.randint(10, max_blocks-2)
-               subprocess.run([
-                   "nvme", "read", "/dev/nvme0n1",
-                   f"--start-block={blk}",
-                   "--block-count=1",
-                   "--data-size=4096",
-                   f"--data={read_file}"
-               ], check=True) # stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
-           for _ in range(N):
-               blk = random.randint(10, max_blocks-2)
-               subprocess.run([
-                   "nvme", "write", "/dev/nvme0n1",
-                   f"--start-block={blk}",
-                   "--block-count=1",
-                   "--data-size=4096",
-                   f"--data={write_file}"
-               ], check=True) #stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
-        except Exception as e:
-           errors.append(f"Failed executing NVMe read/write commands: {e}")
+        # Namespace geometry is read on first use and shared (cached) between tests
+        geometry = namespace_geometry(self.nvme_interface, self.device, nsid=1)
+        if geometry is None:
+            errors.append("Could not read the geometry of namespace 1")
+        else:
+            self.logger.debug("Namespace 1 geometry: %s", geometry)
+            # Reads/writes are issued in batches through the async I/O engine
+            # (io_uring passthrough or ioctl thread pool), queue_depth at a time
+            engine = None
+            try:
+               engine = self.io_engine or self.nvme_interface.open_io_engine(
+                   nsid=1, queue_depth=self.queue_depth, block_size=geometry.lba_size)
+               read_status, write_status, integrity = asyncio.run(self._run_io(engine, N, geometry.nsze))
+               failed = sum(1 for status in read_status + write_status if status)
+               if failed:
+                   errors.append(f"{failed} NVMe read/write commands completed with an error status")
+               self.events.emit("integrity", **integrity)
+               if integrity["corrupted_blocks"]:
+                   errors.append(f"{integrity['corrupted_blocks']} blocks read back corrupted "
+                                 f"(seed {integrity['seed']}), LBAs {integrity['corrupted_lbas'][:20]}")
+            except Exception as e:
+               errors.append(f"Failed executing NVMe read/write commands: {e}")
+            finally:
+               if engine is not None and engine is not self.io_engine:
+                   engine.close()
 
         # Step 7: Set temperature threshold
         try:
@@ -106,12 +132,12 @@ class Activitytest2:
 
         # Step 8: Final SMART log
         smart_log_end = self._get_smart_log()
-        pretty_log_end = json.dumps(smart_log_end, indent=4, sort_keys=True)
-        self.logger.debug(f"Final SMART log:\n{pretty_log_end}")
+        self.logger.debug("Final SMART log:\n%s", LazyJson(smart_log_end))
+        self.events.emit("smart_log", stage="end", data=smart_log_end)
 
-        # Step 9: Validate read/write counters
-        read_diff = smart_log_end.get("host_read_commands", 0) - smart_log_start.get("host_read_commands", 0)
-        write_diff = smart_log_end.get("host_write_commands", 0) - smart_log_start.get("host_write_commands", 0)
+        # Step 9: Validate read/write counters (final minus initial snapshot)
+        read_diff = self.smart_store.delta(self.device, "host_read_commands")
+        write_diff = self.smart_store.delta(self.device, "host_write_commands")
         if read_diff != N:
             errors.append(f"Read counter mismatch! Expected +{N}, got {read_diff}")
         if write_diff != N:
@@ -119,7 +145,15 @@ class Activitytest2:
 
         # Step 10: Validate critical warning changed
         smart_log_after_set = self._get_smart_log()
-        if smart_log_start.get("critical_warning") == smart_log_after_set.get("critical_warning"):
+        changed = smart_log_start.get("critical_warning") != smart_log_after_set.get("critical_warning")
+        if self.smart_sampler is not None:
+            # The sampled series also catches a warning that toggled between the snapshots
+            transitions = self.smart_sampler.buffer.transitions("critical_warning")
+            changed = changed or bool(transitions)
+            self.logger.info("SMART samples: %d, critical_warning transitions: %s, temperature max: %s",
+                             len(self.smart_sampler.buffer), transitions,
+                             max(self.smart_sampler.buffer.column("temperature"), default=None))
+        if not changed:
             self.logger.warning(
                 "Critical warning did not change after threshold adjustment; "
                 "this drive may not support changing the temp threshold."
@@ -135,37 +169,56 @@ class Activitytest2:
         if errors:
             for e in errors:
                 self.logger.error(e)
+            self.result = "FAILED"
             self.logger.warning("Test FAILED - see above errors")
         else:
+            self.result = "PASSED"
             self.logger.info("Test PASSED - SMART log behaves as expected.")
 
+    async def _run_io(self, engine, N, max_blocks):
+        # N LBA-stamped writes, then the same N LBAs read back and verified; the
+        # whole sequence is drawn from the seed before the first command
+        trace = CommandTrace.generate(self.seed, N, 10, max_blocks - 1, verify_writes=True,
+                                      meta={"test": "Activity test2", "device": self.device})
+        with IntegrityWorkload(engine, seed=self.seed, logger=self.logger) as workload:
+            await replay(engine, trace, workload)
+            integrity = workload.report()
+        trace_path = self._trace_path()
+        if trace_path:
+            trace.save(trace_path)
+            self.logger.debug("Command trace saved to %s", trace_path)
+        # One event per command, emitted once the batches are done
+        emit = self.events.emit
+        for opcode, slba, nlb, status in zip(trace.opcodes, trace.slbas, trace.nlbs, trace.statuses):
+            emit("io", op="read" if opcode == NVME_CMD_READ else "write", slba=slba, nlb=nlb, status=status)
+        write_status = list(trace.statuses[:N])
+        read_status = list(trace.statuses[N:])
+        return read_status, write_status, dict(integrity, trace=trace_path)
+
+    def _trace_path(self):
+        if self.trace_path is not None:
+            return self.trace_path
+        name = f"io_trace_{os.path.basename(self.device)}_{self.seed}.nvtr"
+        return os.path.join(self.results_dir or os.curdir, name)
+
     def _get_smart_log(self):
-        try:
-           output = subprocess.check_output(
-               ["nvme", "smart-log", "/dev/nvme0", "-o", "json"],
-               text=True
-           )
-           return json.loads(output)
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"Failed to execute nvme smart-log: {e}")
-            return {}
-        except json.JSONDecodeError:
-            self.logger.error("Failed to parse SMART log output as JSON")
-            return {}
+        # Get Log Page (LID 02h) via Admin Passthru; the SmartLog view decodes
+        # only the counters the test reads, 128-bit ones as exact ints
+        smart_log = self.nvme_interface.get_smart_log()
+        if smart_log is None:
+            self.logger.error("Failed to get SMART log via Admin Passthru")
+            smart_log = {}
+        self.smart_store.append(self.device, smart_log)
+        return smart_log
 
     def _get_temperature_threshold(self):
-        try:
-           output = subprocess.check_output(
-               ["nvme", "get-feature", "/dev/nvme0n1", "--feature-id=0x4"], text=True)
-           for line in output.splitlines():
-                if "value" in line.lower():
-                    return int(line.split(":")[-1].strip(), 0)  # admite hex o decimal
-        except Exception as e:
-            self.logger.error(f"Failed to get temperature threshold: {e}")
-        return 85  # fallback seguro
+        # Get Features (FID 04h) via Admin Passthru: the threshold is the completion DW0
+        threshold = self.nvme_interface.get_temperature_threshold()
+        if threshold is None:
+            self.logger.error("Failed to get temperature threshold via Admin Passthru")
+            return 85  # fallback seguro
+        return threshold
 
     def _set_temperature_threshold(self, new_temp):
-        try:
-           subprocess.run(["nvme", "set-feature", "/dev/nvme0n1", "--feature-id=0x4", f"--value={new_temp}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
-        except Exception as e:
-            self.logger.error(f"Failed to set temperature threshold: {e}")
+        if not self.nvme_interface.set_temperature_threshold(new_temp):
+            self.logger.error(f"Failed to set temperature threshold to {new_temp}")
@@ -1,41 +1,66 @@
 #!/bin/env python3.9
-import struct
+import asyncio
 import json
-import subprocess
-import tempfile
 import os
-from datetime import datetime
-from Test.admin_passthru_wrapper import AdminPassthruWrapper
+from Test.admin_passthru_wrapper import NVME_NSID_ALL
+from Test.nvme_geometry import namespace_geometry
+from Test.nvme_identify import IdentifyNamespace
+from Test.io_passthru_wrapper import NvmeIOError
+from Test.workload import IntegrityWorkload
+from Test.log_pipeline import NullEventStream
 
 class Activitytest3:
-    def __init__(self, nvme_interface, logger):
+    # Deletes, recreates and formats namespace 1
+    TEST_METADATA = {
+        "key": "3",
+        "name": "Activity test3",
+        "destructive": True,
+        "requires_passthru": True,
+        "features": ["ns_mgmt", "format"],
+        "estimated_duration": 120,
+        "options": [],
+    }
+
+    def __init__(self, nvme_interface, logger, device=None, events=None):
         self.nvme_interface = nvme_interface
         self.logger = logger
+        self.device = device or getattr(nvme_interface, "device_path", None) or "/dev/nvme0"
         self.result = "NOT RUN"
+        self.events = events or NullEventStream()
+        # Directory for the ID-NS and SMART snapshots, set by TestManager (None: current directory)
+        self.results_dir = None
+
+    def _artifact(self, name):
+        return os.path.join(self.results_dir or os.curdir, name)
 
     def parse_identify_namespace(self, data_bytes):
-        """Parses Identify Namespace data structure from NVMe spec."""
-        nsize = struct.unpack_from("<Q", data_bytes, 0)[0]    # bytes 0-7
-        ncap = struct.unpack_from("<Q", data_bytes, 8)[0]     # bytes 8-15
-        nuse = struct.unpack_from("<Q", data_bytes, 16)[0]    # bytes 16-23
-        flbas = data_bytes[26]                                # byte 26
-        dps = data_bytes[30]                                  # byte 30
-        lbaf = flbas & 0x0F                                   # bits 0-3 de flbas
-        return {
-            "nsize": nsize,
-            "ncap": ncap,
-            "nuse": nuse,
-            "flbas": flbas,
-            "lbaf": lbaf,
-            "dps": dps
-        }
+        """Parses Identify Namespace data structure from NVMe spec.
+
+        Returns a lazy IdentifyNamespace view (nvme-cli field names plus
+        `lbaf`, the active format index from flbas bits 3:0).
+        """
+        return IdentifyNamespace(data_bytes)
+
+    def _save_smart_log(self, path):
+        """Snapshot the SMART log via Get Log Page passthru and save it as JSON."""
+        smart_log = self.nvme_interface.get_smart_log()
+        if smart_log is None:
+            self.logger.error("Failed to get SMART log via Admin Passthru")
+            return False
+        with open(path, "w") as f:
+            json.dump(smart_log.to_dict(), f, indent=4)
+        self.events.emit("smart_log", stage=os.path.splitext(os.path.basename(path))[0], data=smart_log)
+        return True
+
+    def _fail(self, reason):
+        self.logger.error(reason)
+        self.result = "FAILED"
 
     def run(self):
         self.logger.info("Starting Activitytest3 with Admin Passthru...")
 
-        drive = "/dev/nvme0"
-        ns_id = "1"  # namespace ID
-        delete_all = "0xFFFFFFFF"
+        drive = self.device
+        ns_id = 1  # namespace ID
         # Definiciones esperadas
         nsize_expected = 4096  # en LBAs
         ncap_expected = 4096
@@ -48,69 +73,75 @@ class Activitytest3:
             id_ns_before_bytes = self.nvme_interface.send_passthru_cmd(
                 opcode='0x06',
                 data_len=4096,
-                nsid=int(ns_id)
+                nsid=ns_id
             )
-            with open("id_ns_before.bin", "wb") as f:
+            with open(self._artifact("id_ns_before.bin"), "wb") as f:
                 f.write(id_ns_before_bytes)
             id_ns_before = self.parse_identify_namespace(id_ns_before_bytes)
-            self.logger.info(f"Initial ID-NS: {id_ns_before}")
+            self.logger.info("Initial ID-NS: %s", id_ns_before)
+            self.events.emit("id_ns", stage="before", data=id_ns_before)
         except Exception as e:
             self.logger.exception(f"Error getting initial ID-NS: {e}")
             self.result = "FAILED"
             return
 
         # --- Paso 2: Smart-log inicial ---
-        status_before = "statusAntes.json"
+        status_before = self._artifact("statusAntes.json")
         self.logger.info("[Paso 2] Smart-log inicial")
-        subprocess.run(["nvme", "smart-log", drive, "-o", "json"], stdout=open(status_before, "w"), check=True)
-
-        # --- Paso 3: Eliminar namespace ---
-        self.logger.info("[Paso 3] Eliminando namespace")
-        subprocess.run(["nvme", "delete-ns", drive, "-n", delete_all], check=True)
-
-        # --- Paso 4: Crear namespace ---
-        self.logger.info("[Paso 4] Creando namespace")
-        subprocess.run([
-            "nvme", "create-ns", drive,
-            "-s", str(nsize_expected),
-            "-c", str(ncap_expected),
-            "-f", str(lbaf_expected)
-        ], check=True)
-
-        # --- Paso 5: Adjuntar namespace ---
-        self.logger.info("[Paso 5] Adjuntando namespace")
-        subprocess.run(["nvme", "attach-ns", drive, "-n", ns_id, "-c", "0"], check=True)
-
-        # --- Paso 6: Cambiar block size (Format) ---
-        self.logger.info("[Paso 6] Cambiando block size con nvme format")
-        subprocess.run([
-            "nvme", "format", f"{drive}n{ns_id}",
-            "-l", str(lbaf_expected),
-            "-f", "0"
-        ], check=True)
-
-        # --- Paso 7: Ejecutar escritura para cambiar nuse ---
-        self.logger.info("[Paso 7] Ejecutando nvme write para modificar nuse")
-        
-        tmp = tempfile.NamedTemporaryFile(delete=False)
+        if not self._save_smart_log(status_before):
+            self.result = "FAILED"
+            return
+
+        # Pasos 3-7 por Admin/IO Passthru; each waits until the kernel has caught up
+        # (sysfs / udev) instead of sleeping
         try:
-           tmp.write(b'\x00' * 8192)  # 8 KiB de ceros
-           tmp.flush()
-           tmp.close()  # cerrar antes de pasar al comando
-           subprocess.run([
-               "nvme", "write", f"{drive}n{ns_id}",
-               "-s", "0",                # primer bloque
-               "-c", "2",                # escribir 1 bloque de 4KiB
-               "-d", tmp.name,
-               "-z", "8192"
-           ], check=True)
-        finally:
-           os.unlink(tmp.name)
+            # --- Paso 3: Eliminar namespace ---
+            self.logger.info("[Paso 3] Eliminando namespace")
+            if not self.nvme_interface.delete_namespace(NVME_NSID_ALL):
+                return self._fail("Namespace Management delete failed")
+            self.nvme_interface.wait_namespace(ns_id, present=False)
+
+            # --- Paso 4: Crear namespace ---
+            self.logger.info("[Paso 4] Creando namespace")
+            ns_id = self.nvme_interface.create_namespace(nsize_expected, ncap_expected, flbas=lbaf_expected)
+            if ns_id is None:
+                return self._fail("Namespace Management create failed")
+            self.logger.debug("Created namespace %d", ns_id)
+
+            # --- Paso 5: Adjuntar namespace ---
+            self.logger.info("[Paso 5] Adjuntando namespace")
+            if not self.nvme_interface.attach_namespace(ns_id):
+                return self._fail(f"Namespace Attachment of namespace {ns_id} failed")
+            self.nvme_interface.wait_namespace(ns_id)
+
+            # --- Paso 6: Cambiar block size (Format) ---
+            self.logger.info("[Paso 6] Cambiando block size con Format NVM")
+            if not self.nvme_interface.format_nvm(ns_id, lbaf=lbaf_expected):
+                return self._fail(f"Format NVM of namespace {ns_id} failed")
+            geometry = namespace_geometry(self.nvme_interface, drive, ns_id)
+            if geometry is None:
+                return self._fail(f"Identify Namespace {ns_id} failed after format")
+            self.nvme_interface.wait_namespace(ns_id, lba_size=geometry.lba_size)
+
+            # --- Paso 7: Ejecutar escritura para cambiar nuse ---
+            self.logger.info("[Paso 7] Escribiendo 8 KiB para modificar nuse (y verificando)")
+            nlb = max(1, 8192 // geometry.lba_size)
+            with self.nvme_interface.open_io_engine(nsid=ns_id, queue_depth=1, block_size=geometry.lba_size,
+                                                    max_blocks=nlb) as engine, \
+                    IntegrityWorkload(engine, seed=ns_id, logger=self.logger) as workload:
+                if asyncio.run(workload.write(0, nlb)) or asyncio.run(workload.verify(0, nlb)):
+                    return self._fail("Write / read back of the new namespace failed")
+                if workload.corruptions:
+                    return self._fail(f"Data read back from namespace {ns_id} is corrupted: {workload.corruptions}")
+        except (OSError, TimeoutError, NvmeIOError) as e:
+            return self._fail(str(e))
 
         # --- Paso 8: Smart-log final ---
-        status_after = "statusDespues.json"
+        status_after = self._artifact("statusDespues.json")
         self.logger.info("[Paso 8] Smart-log final")
-        subprocess.run(["nvme", "smart-log", drive, "-o", "json"], stdout=open(status_after, "w"), check=True)
+        if not self._save_smart_log(status_after):
+            self.result = "FAILED"
+            return
 
         # --- Paso 9: ID-NS final vía Admin Passthru ---
         try:
@@ -118,12 +149,13 @@ class Activitytest3:
             id_ns_after_bytes = self.nvme_interface.send_passthru_cmd(
                 opcode='0x06',
                 data_len=4096,
-                nsid=int(ns_id)
+                nsid=ns_id
             )
-            with open("id_ns_after.bin", "wb") as f:
+            with open(self._artifact("id_ns_after.bin"), "wb") as f:
                 f.write(id_ns_after_bytes)
             id_ns_after = self.parse_identify_namespace(id_ns_after_bytes)
-            self.logger.info(f"Final ID-NS: {id_ns_after}")
+            self.logger.info("Final ID-NS: %s", id_ns_after)
+            self.events.emit("id_ns", stage="after", data=id_ns_after)
         except Exception as e:
             self.logger.exception(f"Error getting final ID-NS: {e}")
             self.result = "FAILED"
@@ -142,7 +174,7 @@ class Activitytest3:
         nuse_ok = id_ns_after["nuse"] > id_ns_before["nuse"]
 
         # Validación nsize y ncap
-        nsize_ok = id_ns_after["nsize"] == nsize_expected
+        nsize_ok = id_ns_after["nsze"] == nsize_expected
         ncap_ok = id_ns_after["ncap"] == ncap_expected
 
         if blocksize_ok and nuse_ok and nsize_ok and ncap_ok:
@@ -1,91 +1,510 @@
 #!/bin/env python3.9
+import abc
+import ctypes
 import fcntl
+import mmap
 import struct
 import os
 import logging
+import threading
+import time
+from Test.latency import metrics
+from Test.nvme_identify import (
+    IdentifyController, IdentifyNamespace, NVME_ADMIN_IDENTIFY, NVME_ID_CNS_CTRL, NVME_ID_CNS_NS,
+    NVME_IDENTIFY_DATA_SIZE
+)
+from Test.nvme_log import NVME_ADMIN_GET_LOG_PAGE, NVME_LOG_SMART, NVME_SMART_LOG_SIZE, SmartLog
+from Test.nvme_topology import (
+    NAMESPACE_CHANGING_OPCODES, NVME_ADMIN_FORMAT_NVM, NVME_ADMIN_NS_ATTACH, NVME_ADMIN_NS_MGMT, namespace_changed,
+    namespace_path, wait_for_namespace
+)
 
 # Constants for NVMe Admin Passthru
 NVME_IOCTL_ADMIN_CMD = 0xC0484E41  # IOCTL code for admin commands (from nvme-cli headers)
-## @class AdminPassthruWrapper
-#  This class provides a Python interface for sending NVMe administration commands
-#  directly to the device using ioctl calls, replicating the behavior of the
-#  "nvme_admin_cmd" structure from the nvme-cli package.
-class AdminPassthruWrapper:
-    def __init__(self, device_path, logger=None):
-        self.device_path = device_path
+NVME_IOCTL_RESCAN = 0x4E46         # _IO('N', 0x46): rescan the namespaces of a controller
+
+# NVMe passthru struct from the Linux uapi (linux/nvme_ioctl.h), shared by the
+# admin and I/O ioctls:
+# struct nvme_passthru_cmd {
+#   __u8  opcode;
+#   __u8  flags;
+#   __u16 rsvd1;
+#   __u32 nsid;
+#   __u32 cdw2;
+#   __u32 cdw3;
+#   __u64 metadata;
+#   __u64 addr;
+#   __u32 metadata_len;
+#   __u32 data_len;
+#   __u32 cdw10;
+#   __u32 cdw11;
+#   __u32 cdw12;
+#   __u32 cdw13;
+#   __u32 cdw14;
+#   __u32 cdw15;
+#   __u32 timeout_ms;
+#   __u32 result;
+# };
+#! Precompiled once at import; its size (72 bytes) is encoded in the ioctl number (0x48).
+NVME_PASSTHRU_CMD = struct.Struct('<BBHIIIQQIIIIIIIIII')
+NVME_PASSTHRU_RESULT = struct.Struct('<I')  # completion DW0, written back at offset 68
+NVME_PASSTHRU_RESULT_OFFSET = 68
+
+
+## @brief Returns the virtual address of a writable buffer (bytearray or mmap).
+#  @note The buffer must stay alive and must not be resized while the address is in use.
+def buffer_address(buf):
+    return ctypes.addressof(ctypes.c_char.from_buffer(buf))
+
+
+## @class DeviceHandlePool
+#  Keeps one file descriptor open per NVMe device node for the life of the pool,
+#  so repeated commands do not pay an open/close pair each time.
+class DeviceHandlePool:
+    def __init__(self, flags=os.O_RDWR, logger=None):
+        self.flags = flags
         self.logger = logger or logging.getLogger(__name__)
-## @brief Send an NVMe Admin Passthru command to the specified device.
+        self._fds = {}
+
+    def get(self, device_path):
+        """Return the cached fd for `device_path`, opening it on first use."""
+        fd = self._fds.get(device_path)
+        if fd is None:
+            self.logger.debug("Opening device %s", device_path)
+            fd = os.open(device_path, self.flags)
+            self._fds[device_path] = fd
+        return fd
+
+    def release(self, device_path):
+        """Close the fd for `device_path` (e.g. after the node disappeared)."""
+        fd = self._fds.pop(device_path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def close(self):
+        for device_path in list(self._fds):
+            self.release(device_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+## @class BufferPool
+#  Recycles page-aligned data buffers (anonymous mmaps) keyed by size. The
+#  address of each buffer is resolved once, when the buffer is created.
+class BufferPool:
+    def __init__(self):
+        self._free = {}
+
+    def acquire(self, size):
+        """Return a `(buffer, address)` pair of at least `size` bytes."""
+        free = self._free.get(size)
+        if free:
+            return free.pop()
+        buf = mmap.mmap(-1, max(size, mmap.PAGESIZE))
+        return buf, buffer_address(buf)
+
+    def release(self, size, entry):
+        self._free.setdefault(size, []).append(entry)
+
+    def close(self):
+        for entries in self._free.values():
+            for buf, _ in entries:
+                try:
+                    buf.close()
+                except BufferError:
+                    pass  # still referenced by a caller's memoryview; freed with it
+        self._free.clear()
+
+
+NVME_NSID_ALL = 0xFFFFFFFF
+
+# Namespace Management / Attachment select (CDW10 bits 3:0)
+NVME_NS_MGMT_SEL_CREATE = 0
+NVME_NS_MGMT_SEL_DELETE = 1
+NVME_NS_ATTACH_SEL_ATTACH = 0
+NVME_NS_ATTACH_SEL_DETACH = 1
+# Format NVM secure erase settings (CDW10 bits 11:9)
+NVME_FORMAT_SES_NONE = 0
+NVME_FORMAT_SES_USER_DATA = 1
+NVME_FORMAT_SES_CRYPTO = 2
+
+NS_MGMT_SIZES = struct.Struct('<QQ')  # nsze, ncap at the start of the Identify Namespace layout
+NVME_CTRL_LIST = struct.Struct('<H')
+
+NVME_ADMIN_SET_FEATURES = 0x09
+NVME_ADMIN_GET_FEATURES = 0x0A
+
+NVME_FEAT_TEMP_THRESH = 0x04
+
+# Get Features select (CDW10 bits 10:8)
+NVME_FEATURES_SEL_CURRENT = 0
+NVME_FEATURES_SEL_DEFAULT = 1
+NVME_FEATURES_SEL_SAVED = 2
+NVME_FEATURES_SEL_SUPPORTED = 3
+
+# Temperature threshold (FID 04h) CDW11: TMPTH 15:0, TMPSEL 19:16, THSEL 21:20
+NVME_TEMP_THRESH_OVER = 0
+NVME_TEMP_THRESH_UNDER = 1
+
+
+## @class AdminCommand
+#  One Admin command with every field of the passthru struct: all command
+#  dwords, a data buffer (`data` sent to the controller and/or `data_len`
+#  bytes returned), a metadata buffer and a timeout (0: the driver default).
+#  Build it directly or with the typed constructors, send it with `execute()`.
+class AdminCommand:
+    __slots__ = ("opcode", "flags", "nsid", "cdw2", "cdw3", "cdw10", "cdw11", "cdw12", "cdw13", "cdw14", "cdw15",
+                 "data", "data_len", "metadata", "metadata_len", "timeout_ms")
+
+    def __init__(self, opcode, nsid=0, cdw10=0, cdw11=0, cdw12=0, cdw13=0, cdw14=0, cdw15=0, data=None,
+                 data_len=None, cdw2=0, cdw3=0, metadata=None, metadata_len=None, timeout_ms=0, flags=0):
+        self.opcode = opcode
+        self.flags = flags
+        self.nsid = nsid
+        self.cdw2, self.cdw3 = cdw2, cdw3
+        self.cdw10, self.cdw11, self.cdw12, self.cdw13, self.cdw14, self.cdw15 = cdw10, cdw11, cdw12, cdw13, cdw14, cdw15
+        self.data = data
+        self.data_len = data_len if data_len is not None else (len(data) if data is not None else 0)
+        self.metadata = metadata
+        self.metadata_len = metadata_len if metadata_len is not None else (len(metadata) if metadata is not None else 0)
+        self.timeout_ms = timeout_ms
+        # The controller only transfers data_len / metadata_len bytes: a longer payload would be cut silently
+        if data is not None and len(data) > self.data_len:
+            raise ValueError(f"data of {len(data)} bytes exceeds data_len {self.data_len}")
+        if metadata is not None and len(metadata) > self.metadata_len:
+            raise ValueError(f"metadata of {len(metadata)} bytes exceeds metadata_len {self.metadata_len}")
+
+    ## @brief Identify (opcode 06h) of structure `cns`.
+    @classmethod
+    def identify(cls, cns, nsid=0, cntid=0, data_len=NVME_IDENTIFY_DATA_SIZE, **kwargs):
+        return cls(NVME_ADMIN_IDENTIFY, nsid, cdw10=cns | (cntid << 16), data_len=data_len, **kwargs)
+
+    ## @brief Get Log Page (opcode 02h).
+    #  @param data_len Bytes to transfer (multiple of 4).
+    #  @param offset   Byte offset inside the log page (LPOL/LPOU).
+    #  @param lsp      Log specific field, @param rae retain asynchronous event.
+    @classmethod
+    def get_log_page(cls, lid, data_len, nsid=NVME_NSID_ALL, offset=0, lsp=0, rae=False, **kwargs):
+        numd = data_len // 4 - 1  # 0-based dword count split into NUMDL/NUMDU
+        return cls(NVME_ADMIN_GET_LOG_PAGE, nsid,
+                   cdw10=lid | (lsp & 0x7F) << 8 | int(rae) << 15 | (numd & 0xFFFF) << 16,
+                   cdw11=numd >> 16, cdw12=offset & 0xFFFFFFFF, cdw13=offset >> 32, data_len=data_len, **kwargs)
+
+    ## @brief Get Features (opcode 0Ah) of `fid`; the value comes back in DW0.
+    #  @param sel NVME_FEATURES_SEL_*, @param cdw11 feature specific (e.g. threshold select).
+    @classmethod
+    def get_features(cls, fid, sel=NVME_FEATURES_SEL_CURRENT, cdw11=0, nsid=0, data_len=0, **kwargs):
+        return cls(NVME_ADMIN_GET_FEATURES, nsid, cdw10=fid | (sel & 7) << 8, cdw11=cdw11, data_len=data_len,
+                   **kwargs)
+
+    ## @brief Set Features (opcode 09h) of `fid` to `cdw11`; `save` keeps it across resets.
+    @classmethod
+    def set_features(cls, fid, cdw11=0, save=False, nsid=0, **kwargs):
+        return cls(NVME_ADMIN_SET_FEATURES, nsid, cdw10=fid | int(save) << 31, cdw11=cdw11, **kwargs)
+
+    def __repr__(self):
+        return (f"AdminCommand(opcode={self.opcode:#04x}, nsid={self.nsid:#x}, cdw10={self.cdw10:#x}, "
+                f"cdw11={self.cdw11:#x}, data_len={self.data_len})")
+
+
+## @class AdminCompletion
+#  Outcome of one AdminCommand: NVMe status (0 = success), completion DW0
+#  and the data / metadata buffers after the command.
+class AdminCompletion:
+    __slots__ = ("status", "result", "data", "metadata")
+
+    def __init__(self, status, result=0, data=None, metadata=None):
+        self.status = status
+        self.result = result
+        self.data = data
+        self.metadata = metadata
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+    def __repr__(self):
+        return f"AdminCompletion(status={self.status:#x}, result={self.result:#x})"
+
+
+def _temperature_cdw11(threshold, tmpsel, thsel):
+    return (threshold & 0xFFFF) | (tmpsel & 0xF) << 16 | (thsel & 3) << 20
+
+
+## @class AdminCommandSet
+#  Typed admin commands built on `execute()`. Shared by AdminPassthruWrapper
+#  and the simulated controller, which both provide `execute(command, copy)`
+#  returning an AdminCompletion (and set `last_status`/`last_result`).
+class AdminCommandSet(abc.ABC):
+    @abc.abstractmethod
+    def execute(self, command, copy=True):
+        """Send `command`; returns its AdminCompletion."""
+
+    ## @brief Send an NVMe Admin command given as opcode and dwords.
     #
     #  @details
-    #  This function packs the parameters into the `nvme_admin_cmd` structure according to
-    #  the C format expected by the NVMe driver in Linux and then sends it via `ioctl`.
-    #
     #  The command can be used for operations such as:
     #  - Identify Controller (`opcode = 0x06`)
     #  - Identify Namespace
     #  - Other supported NVMe administrative commands
- 
-    def send_passthru_cmd(self, opcode, data_len=4096, nsid=0):
+    #
+    #  `cdw10`..`cdw15` carry the command specific dwords and `data`, when given,
+    #  is sent to the controller (host-to-controller transfer). A non-zero NVMe
+    #  status is logged and returned as None; see `last_status`/`last_result`.
+    #  For cdw2/cdw3, metadata, timeouts or the completion DW0 of this very
+    #  command, build an AdminCommand and `execute()` it.
+    #
+    #  With `copy=False` the returned memoryview aliases a recycled buffer and
+    #  is only valid until the next command on this interface.
+    def send_passthru_cmd(self, opcode, data_len=4096, nsid=0, copy=True,
+                          cdw10=0, cdw11=0, cdw12=0, cdw13=0, cdw14=0, cdw15=0, data=None):
         """
         Enviar comando NVMe Admin Passthru al dispositivo.
         """
         if isinstance(opcode, str):
             opcode = int(opcode, 16)
+        command = AdminCommand(opcode, nsid, cdw10, cdw11, cdw12, cdw13, cdw14, cdw15, data=data, data_len=data_len)
+        try:
+            completion = self.execute(command, copy)
+        except Exception as e:
+            self.logger.error(f"Admin passthru command failed: {e}")
+            return None
+        if completion.status:
+            self.logger.error(f"Admin passthru command opcode={opcode:#x} failed: NVMe status {completion.status:#x}")
+            return None
+        return completion.data
+
+    def identify_controller(self, copy=True):
+        """Identify Controller (CNS 01h) as a lazy IdentifyController view, or None."""
+        data = self.send_passthru_cmd(NVME_ADMIN_IDENTIFY, NVME_IDENTIFY_DATA_SIZE,
+                                      cdw10=NVME_ID_CNS_CTRL, copy=copy)
+        return IdentifyController(data) if data is not None else None
+
+    def identify_namespace(self, nsid, copy=True):
+        """Identify Namespace (CNS 00h) as a lazy IdentifyNamespace view, or None."""
+        data = self.send_passthru_cmd(NVME_ADMIN_IDENTIFY, NVME_IDENTIFY_DATA_SIZE, nsid=nsid,
+                                      cdw10=NVME_ID_CNS_NS, copy=copy)
+        return IdentifyNamespace(data) if data is not None else None
+
+    ## @brief Get Log Page (opcode 02h).
+    #  @param lid     Log page identifier.
+    #  @param data_len Bytes to transfer (multiple of 4).
+    #  @param offset  Byte offset inside the log page (LPOL/LPOU).
+    def get_log_page(self, lid, data_len, nsid=NVME_NSID_ALL, offset=0, copy=True):
+        command = AdminCommand.get_log_page(lid, data_len, nsid, offset)
+        return self.send_passthru_cmd(command.opcode, data_len, nsid=nsid, copy=copy, cdw10=command.cdw10,
+                                      cdw11=command.cdw11, cdw12=command.cdw12, cdw13=command.cdw13)
+
+    def get_smart_log(self, nsid=NVME_NSID_ALL):
+        """SMART / Health log (LID 02h) as a SmartLog view, or None on failure."""
+        data = self.get_log_page(NVME_LOG_SMART, NVME_SMART_LOG_SIZE, nsid=nsid)
+        return SmartLog(data) if data is not None else None
+
+    ## @brief Get Features (opcode 0Ah): the feature value (completion DW0), or None on failure.
+    def get_feature(self, fid, sel=NVME_FEATURES_SEL_CURRENT, cdw11=0, nsid=0):
+        completion = self._execute_logged(AdminCommand.get_features(fid, sel, cdw11, nsid))
+        return completion.result if completion is not None else None
+
+    ## @brief Set Features (opcode 09h); True on success.
+    def set_feature(self, fid, cdw11, save=False, nsid=0):
+        return self._execute_logged(AdminCommand.set_features(fid, cdw11, save, nsid)) is not None
+
+    ## @brief Temperature threshold (FID 04h) in Kelvin, or None.
+    #  @param tmpsel Sensor (0 = composite), @param thsel NVME_TEMP_THRESH_OVER / _UNDER.
+    def get_temperature_threshold(self, tmpsel=0, thsel=NVME_TEMP_THRESH_OVER):
+        value = self.get_feature(NVME_FEAT_TEMP_THRESH, cdw11=_temperature_cdw11(0, tmpsel, thsel))
+        return value & 0xFFFF if value is not None else None
+
+    def set_temperature_threshold(self, kelvin, tmpsel=0, thsel=NVME_TEMP_THRESH_OVER):
+        return self.set_feature(NVME_FEAT_TEMP_THRESH, _temperature_cdw11(kelvin, tmpsel, thsel))
+
+    def _execute_logged(self, command):
+        # Completion of `command`, or None (logged) when it failed
+        try:
+            completion = self.execute(command)
+        except OSError as e:
+            self.logger.error(f"Admin command {command!r} failed: {e}")
+            return None
+        if completion.status:
+            self.logger.error(f"Admin command opcode={command.opcode:#x} failed: NVMe status {completion.status:#x}")
+            return None
+        return completion
+
+    ## @brief Namespace Management, create (opcode 0Dh, SEL 0).
+    #  @param flbas LBA format index (bits 3:0, bits 6:5 above 16 formats) and metadata settings.
+    #  @return The NSID of the new namespace, or None on failure.
+    def create_namespace(self, nsze, ncap=None, flbas=0, dps=0, nmic=0):
+        data = bytearray(NVME_IDENTIFY_DATA_SIZE)
+        NS_MGMT_SIZES.pack_into(data, 0, nsze, nsze if ncap is None else ncap)
+        data[26], data[29], data[30] = flbas, dps, nmic
+        completion = self._execute_logged(AdminCommand(NVME_ADMIN_NS_MGMT, cdw10=NVME_NS_MGMT_SEL_CREATE, data=data))
+        return completion.result if completion is not None else None
+
+    ## @brief Namespace Management, delete (SEL 1); NVME_NSID_ALL deletes every namespace.
+    def delete_namespace(self, nsid):
+        return self.send_passthru_cmd(NVME_ADMIN_NS_MGMT, 0, nsid=nsid, cdw10=NVME_NS_MGMT_SEL_DELETE) is not None
+
+    def _namespace_attachment(self, nsid, sel, controllers):
+        if controllers is None:
+            idc = self.identify_controller()
+            if idc is None:
+                return False
+            controllers = [idc.cntlid]
+        # Controller list: number of identifiers, then the identifiers (16 bits each)
+        data = bytearray(NVME_IDENTIFY_DATA_SIZE)
+        for i, cntlid in enumerate([len(controllers), *controllers]):
+            NVME_CTRL_LIST.pack_into(data, 2 * i, cntlid)
+        return self.send_passthru_cmd(NVME_ADMIN_NS_ATTACH, len(data), nsid=nsid, cdw10=sel, data=data) is not None
+
+    ## @brief Namespace Attachment, attach (opcode 15h, SEL 0).
+    #  @param controllers Controller IDs; default: this controller (id-ctrl cntlid).
+    def attach_namespace(self, nsid, controllers=None):
+        return self._namespace_attachment(nsid, NVME_NS_ATTACH_SEL_ATTACH, controllers)
+
+    def detach_namespace(self, nsid, controllers=None):
+        return self._namespace_attachment(nsid, NVME_NS_ATTACH_SEL_DETACH, controllers)
+
+    ## @brief Format NVM (opcode 80h) of `nsid` (NVME_NSID_ALL: every namespace).
+    #  @param lbaf LBA format index (0..63), @param ses secure erase (NVME_FORMAT_SES_*),
+    #  @param pi protection type, @param pil PI location, @param mset metadata settings.
+    def format_nvm(self, nsid, lbaf=0, ses=NVME_FORMAT_SES_NONE, pi=0, pil=0, mset=0):
+        cdw10 = (lbaf & 0x0F) | (mset & 1) << 4 | (pi & 7) << 5 | (pil & 1) << 8 | (ses & 7) << 9 | \
+            ((lbaf >> 4) & 3) << 12
+        return self.send_passthru_cmd(NVME_ADMIN_FORMAT_NVM, 0, nsid=nsid, cdw10=cdw10) is not None
+
+    ## @brief Ask the kernel to rescan the namespaces now (no-op where not supported).
+    def rescan(self):
+        pass
+
+    ## @brief Block until the host sees namespace `nsid` (see nvme_topology.wait_for_namespace):
+    #  present with its block device (and `lba_size`, after a format) or, with
+    #  present=False, gone. Returns the NvmeNamespace, or None if not tracked in sysfs.
+    def wait_namespace(self, nsid, present=True, lba_size=None, timeout=30.0):
+        self.rescan()
+        return wait_for_namespace(self.device_path, nsid, present, lba_size, timeout)
+
+
+## @class AdminPassthruWrapper
+#  This class provides a Python interface for sending NVMe administration commands
+#  directly to the device using ioctl calls, replicating the behavior of the
+#  "nvme_admin_cmd" structure from the nvme-cli package.
+#
+#  The device fd stays open for the life of the wrapper; use it as a context
+#  manager (or call close()) to release it.
+class AdminPassthruWrapper(AdminCommandSet):
+    def __init__(self, device_path, logger=None, handle_pool=None):
+        self.device_path = device_path
+        self.logger = logger or logging.getLogger(__name__)
+        self._owns_pool = handle_pool is None
+        self.handle_pool = handle_pool or DeviceHandlePool(logger=self.logger)
+        self.buffer_pool = BufferPool()
+        self._cmd_buf = bytearray(NVME_PASSTHRU_CMD.size)
+        # Serializes commands from several threads (e.g. a SMART sampler next to the test)
+        self._lock = threading.RLock()
+        self.last_status = 0   # NVMe status of the last command (0 = success)
+        self.last_result = 0   # completion DW0 of the last command
+
+    def close(self):
+        if self._owns_pool:
+            self.handle_pool.close()
+        self.buffer_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def rescan(self):
+        try:
+            fcntl.ioctl(self.handle_pool.get(self.device_path), NVME_IOCTL_RESCAN)
+        except OSError as e:
+            self.logger.debug("Namespace rescan of %s failed: %s", self.device_path, e)
+
+    ## @brief Open an async I/O engine on namespace `nsid` of this controller.
+    def open_io_engine(self, nsid=1, queue_depth=32, block_size=4096, max_blocks=1):
+        from Test.io_engine import open_io_engine
+        return open_io_engine(namespace_path(self.device_path, nsid), queue_depth, block_size, max_blocks,
+                              logger=self.logger, handle_pool=self.handle_pool)
+
+## @brief Send one AdminCommand to the device; returns its AdminCompletion.
+    #
+    #  @details
+    #  Packs every field of the command into the `nvme_admin_cmd` structure
+    #  according to the C layout expected by the NVMe driver in Linux and sends
+    #  it via `ioctl`; the NVMe status is the ioctl return value and DW0 is read
+    #  back from the struct. Raises OSError when the ioctl itself fails.
+    #
+    #  The command struct and the data / metadata buffers are reused between
+    #  calls, so a repeated command costs a single ioctl. With `copy=False` the
+    #  returned memoryviews alias the recycled buffers and are only valid until
+    #  the next command on this wrapper.
+    def execute(self, command, copy=True):
+        with self._lock:
+            return self._execute(command, copy)
+
+    def _execute(self, command, copy):
+        opcode, data_len, metadata_len = command.opcode, command.data_len, command.metadata_len
+        fd = self.handle_pool.get(self.device_path)
+
+        #! Data and metadata buffers (recycled between calls)
+        entry = self.buffer_pool.acquire(data_len)
+        data_buf, addr = entry
+        if command.data is not None:
+            data = command.data
+            data_buf[:len(data)] = data
+            data_buf[len(data):data_len] = bytes(data_len - len(data))
+        meta_entry = self.buffer_pool.acquire(metadata_len) if metadata_len else None
+        if meta_entry is not None and command.metadata is not None:
+            meta_entry[0][:metadata_len] = bytes(command.metadata).ljust(metadata_len, b"\x00")
 
-        self.logger.debug(f"Opening device {self.device_path} for passthru command...")
-        fd = os.open(self.device_path, os.O_RDWR)
-
-        # Allocate buffer
-        #! Data buffer to receive the command response
-        # Buffer de datos
-        data_buf = bytearray(data_len)
-
-        # NVMe passthru struct from nvme-cli:
-        # struct nvme_admin_cmd {
-        #   __u8 opcode;
-        #   __u8 flags;
-        #   __u16 rsvd1;
-        #   __u32 nsid;
-        #   __u64 cdw2;
-        #   __u64 cdw3;
-        #   __u64 metadata;
-        #   __u64 addr;
-        #   __u32 metadata_len;
-        #   __u32 data_len;
-        #   __u32 cdw10;
-        #   __u32 cdw11;
-        #   __u32 cdw12;
-        #   __u32 cdw13;
-        #   __u32 cdw14;
-        #   __u32 cdw15;
-        #   __u32 timeout_ms;
-        #   __u32 result;
-        # };
-        # This must be packed according to C struct layout for ioctl.
-        #! NVMe Admin Passthru structure based on nvme-cli
         #! @note The structure must be aligned according to the C layout for ioctl.
-        fmt = 'B B H I Q Q Q Q I I I I I I I I I I I'
-        cmd_struct = struct.pack(
-            fmt,
-            opcode,        # opcode
-            0,             # flags
-            0,             # rsvd1
-            nsid,          # nsid
-            0, 0, 0,       # cdw2, cdw3, metadata
-            id(data_buf),  # addr
-            0,             # metadata_len
-            data_len,      # data_len
-            0, 0, 0, 0, 0, 0, 0,  # cdw10..cdw15
-            0,             # timeout_ms
-            0              # result
+        NVME_PASSTHRU_CMD.pack_into(
+            self._cmd_buf, 0,
+            opcode,                 # opcode
+            command.flags,          # flags
+            0,                      # rsvd1
+            command.nsid,           # nsid
+            command.cdw2, command.cdw3,
+            meta_entry[1] if meta_entry is not None else 0,  # metadata
+            addr if data_len else 0,  # addr
+            metadata_len,           # metadata_len
+            data_len,               # data_len
+            command.cdw10, command.cdw11, command.cdw12, command.cdw13, command.cdw14, command.cdw15,
+            command.timeout_ms,     # timeout_ms
+            0                       # result
         )
 
-        self.logger.debug(f"Sending passthru command opcode={opcode:#x} data_len={data_len} nsid={nsid}")
+        self.logger.debug("Sending passthru command opcode=%#x data_len=%d nsid=%d", opcode, data_len, command.nsid)
+        started = time.perf_counter_ns()
         try:
-            fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, cmd_struct)
-            os.close(fd)
-            return bytes(data_buf)
-        except Exception as e:
-            self.logger.error(f"Admin passthru command failed: {e}")
-            os.close(fd)
-            return None
\ No newline at end of file
+            try:
+                status = fcntl.ioctl(fd, NVME_IOCTL_ADMIN_CMD, self._cmd_buf, True)
+            except OSError:
+                metrics.record(self.device_path, "admin", opcode, time.perf_counter_ns() - started, error=True)
+                raise
+            metrics.record(self.device_path, "admin", opcode, time.perf_counter_ns() - started, data_len, status != 0)
+            result = NVME_PASSTHRU_RESULT.unpack_from(self._cmd_buf, NVME_PASSTHRU_RESULT_OFFSET)[0]
+            self.last_status = status
+            self.last_result = result
+            if status:
+                return AdminCompletion(status, result)
+            if opcode in NAMESPACE_CHANGING_OPCODES:
+                # Cached topology / namespace data of this controller is stale now
+                namespace_changed(self.device_path)
+            data = memoryview(data_buf)[:data_len]
+            metadata = memoryview(meta_entry[0])[:metadata_len] if meta_entry is not None else None
+            if copy:
+                data = bytes(data)
+                metadata = bytes(metadata) if metadata is not None else None
+            return AdminCompletion(status, result, data, metadata)
+        finally:
+            self.buffer_pool.release(data_len, entry)
+            if meta_entry is not None:
+                self.buffer_pool.release(metadata_len, meta_entry)
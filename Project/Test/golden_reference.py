@@ -0,0 +1,124 @@
+#!/bin/env python3.9
+import functools
+import json
+import os
+from Test.nvme_identify import ID_CTRL_LAYOUT
+from Test.nvme_layouts import Array
+
+## @file golden_reference.py
+#  Masked binary comparison of identify data against a golden image.
+#
+#  A golden reference is a raw identify image plus a bit mask covering the
+#  fields the reference defines, minus the ignored ones (serial number, GUIDs,
+#  ...). Whether a drive matches is decided by one masked comparison of the
+#  whole 4 KiB buffer; the per-field diff only runs when that comparison fails.
+
+
+def _plain(value):
+    return [item.to_dict() for item in value] if isinstance(value, list) else value
+
+
+def _field_mask(field, base):
+    if field.bits:
+        shift, width = field.bits
+        return (((1 << width) - 1) << shift) << (8 * (base + field.offset))
+    return ((1 << (8 * field.size)) - 1) << (8 * (base + field.offset))
+
+
+## @class GoldenReference
+#  Golden identify image with its comparison mask. `field_names` restricts the
+#  compared fields (default: every visible field of the layout).
+class GoldenReference:
+    def __init__(self, image, ignore_fields=(), layout=ID_CTRL_LAYOUT, field_names=None, unencodable=None):
+        self.layout = layout
+        self.image = bytes(image[:layout.size])
+        self.ignore_fields = frozenset(ignore_fields)
+        names = field_names if field_names is not None else layout.keys
+        self.field_names = [n for n in names if n in layout.index and n not in self.ignore_fields]
+        # Reference values no drive can report (e.g. null): they always mismatch
+        self.unencodable = {n: v for n, v in (unencodable or {}).items() if n not in self.ignore_fields}
+
+        reference = layout.view(self.image)
+        self._field_masks = []
+        mask = 0
+        for name in self.field_names:
+            f = layout.index[name]
+            if isinstance(f, Array):
+                # Only the elements the reference actually describes (e.g. npss+1 PSDs)
+                fmask = 0
+                for i in range(len(getattr(reference, name))):
+                    base = f.offset + i * f.stride
+                    for sub in f.layout.fields:
+                        fmask |= _field_mask(sub, base)
+            else:
+                fmask = _field_mask(f, 0)
+            self._field_masks.append((name, fmask))
+            mask |= fmask
+        self.mask = mask
+        self._masked_image = int.from_bytes(self.image, 'little') & mask
+
+    @classmethod
+    def from_json(cls, path, ignore_fields=(), layout=ID_CTRL_LAYOUT):
+        """Compile an nvme-cli JSON reference (e.g. id-ctrl-main_good.json) into an image."""
+        with open(path, 'r') as f:
+            reference = json.load(f)
+        image = bytearray(layout.size)
+        unencodable = {}
+        for name, value in reference.items():
+            try:
+                layout.pack({name: value}, image)
+            except (AttributeError, TypeError, ValueError, OverflowError):
+                unencodable[name] = value
+        names = [n for n in reference if n not in unencodable]
+        return cls(image, ignore_fields, layout, field_names=names, unencodable=unencodable)
+
+    @classmethod
+    def from_image(cls, path, ignore_fields=(), layout=ID_CTRL_LAYOUT):
+        """Load a raw identify image captured from a golden drive."""
+        with open(path, 'rb') as f:
+            return cls(f.read(), ignore_fields, layout)
+
+    def save_image(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.image)
+
+    def matches(self, data):
+        """Single masked comparison of `data` (bytes-like) against the image."""
+        return int.from_bytes(data[:self.layout.size], 'little') & self.mask == self._masked_image
+
+    def diff(self, data):
+        """Per-field differences as `(name, expected, found)`, located through the mask."""
+        differing = (int.from_bytes(data[:self.layout.size], 'little') & self.mask) ^ self._masked_image
+        found = self.layout.view(data)
+        mismatches = [(name, value, _plain(found.get(name))) for name, value in self.unencodable.items()]
+        if not differing:
+            return mismatches
+        expected = self.layout.view(self.image)
+        for name, fmask in self._field_masks:
+            if differing & fmask:
+                exp, cur = _plain(expected[name]), _plain(found[name])
+                # Bytes beyond a string's NUL can differ without the field differing
+                if exp != cur:
+                    mismatches.append((name, exp, cur))
+        return mismatches
+
+    def compare(self, data):
+        """[] when `data` matches the reference, else the field-level diff."""
+        if not self.unencodable and self.matches(data):
+            return []
+        return self.diff(data)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_reference(path, mtime_ns, ignore_fields):
+    if path.endswith('.json'):
+        return GoldenReference.from_json(path, ignore_fields)
+    return GoldenReference.from_image(path, ignore_fields)
+
+
+## @brief Load (and cache for the rest of the process) a compiled golden reference.
+#  `path` is an nvme-cli JSON reference or a raw .bin identify image; the
+#  cache is keyed on the file's mtime, so an edited reference is recompiled.
+def load_reference(path, ignore_fields=()):
+    path = os.path.abspath(path)
+    return _load_reference(path, os.stat(path).st_mtime_ns, frozenset(ignore_fields))
@@ -0,0 +1,420 @@
+#!/bin/env python3.9
+import asyncio
+import ctypes
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from Test.admin_passthru_wrapper import DeviceHandlePool, buffer_address
+from Test.latency import metrics
+from Test.io_passthru_wrapper import (
+    IOPassthruWrapper, NvmeIOError, NVME_CMD_READ, NVME_CMD_WRITE, NVME_IOCTL_ID, pack_io_cmd
+)
+
+## @file io_engine.py
+#  Queue-depth aware asynchronous NVMe I/O engines.
+#
+#  Both engines expose the same asyncio interface (submit/read/write/submit_batch)
+#  and keep up to `queue_depth` commands in flight:
+#  - UringIOEngine: io_uring NVMe passthrough (IORING_OP_URING_CMD) on the
+#    namespace generic char device (/dev/ngXnY). Needs Linux >= 5.19.
+#  - ThreadPoolIOEngine: blocking NVME_IOCTL_IO_CMD ioctls on a thread pool.
+#  open_io_engine() picks io_uring when the kernel supports it.
+
+# io_uring uapi constants (linux/io_uring.h); syscall numbers are shared by all arches
+SYS_IO_URING_SETUP = 425
+SYS_IO_URING_ENTER = 426
+IORING_SETUP_SQE128 = 1 << 10
+IORING_SETUP_CQE32 = 1 << 11
+IORING_FEAT_SINGLE_MMAP = 1 << 0
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+IORING_OP_NOP = 0
+IORING_OP_URING_CMD = 46
+NVME_URING_CMD_IO = 0xC0484E80  # _IOWR('N', 0x80, struct nvme_uring_cmd)
+MAP_POPULATE = getattr(mmap, "MAP_POPULATE", 0x8000)
+
+# struct io_uring_params: 10 x u32, then io_sqring_offsets and io_cqring_offsets
+IO_URING_PARAMS = struct.Struct('<IIIIII4x12x' + 'IIIIIIIIQ' + 'IIIIIIIIQ')
+# struct io_uring_sqe (SQE128): 48-byte header, then the 80-byte uring_cmd area
+IO_URING_SQE_HDR = struct.Struct('<BBHiIIQIIQHHI')
+IO_URING_SQE_SIZE = 128
+IO_URING_CQE = struct.Struct('<QiIQ')  # user_data, res, flags, big_cqe[0] (CQE32)
+IO_URING_CQE_SIZE = 32
+U32 = struct.Struct('<I')
+
+WAKE_USER_DATA = 0xFFFFFFFFFFFFFFFF
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+## @brief Map a namespace block device (/dev/nvme0n1) to its generic char device (/dev/ng0n1).
+def generic_char_device(ns_path):
+    match = re.match(r'^(.*/)nvme(\d+)n(\d+)$', ns_path)
+    if not match:
+        return None
+    return f"{match.group(1)}ng{match.group(2)}n{match.group(3)}"
+
+
+def _check_status(opcode, slba, status):
+    if status:
+        raise NvmeIOError("read" if opcode == NVME_CMD_READ else "write", slba, status)
+
+
+## @class _BaseIOEngine
+#  Common asyncio surface; subclasses implement submit().
+class _BaseIOEngine:
+    backend = None
+
+    def __init__(self, ns_path, queue_depth, block_size, max_blocks, logger):
+        # Commands are accounted to the namespace in the latency metrics
+        self.ns_path = ns_path
+        self.queue_depth = queue_depth
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.logger = logger or logging.getLogger(__name__)
+
+    ## @brief Issue one NVM command; returns `(status, result)` once it completes.
+    #  @param data Payload copied into the command's buffer before a write.
+    #  @param out  Writable buffer that receives the data of a read.
+    #  @param buf  Writable buffer the command transfers to / from directly,
+    #              without the engine's own buffers (no copy, no max_blocks
+    #              limit); it must stay alive and unresized until completion.
+    async def submit(self, opcode, slba, nlb=1, data=None, out=None, buf=None):
+        raise NotImplementedError
+
+    def _check_buf(self, buf, nlb):
+        # The controller transfers nlb blocks whatever the buffer holds
+        if len(buf) < nlb * self.block_size:
+            raise ValueError(f"buffer of {len(buf)} bytes too small for {nlb} blocks")
+
+    async def read(self, slba, nlb=1, out=None):
+        status, _ = await self.submit(NVME_CMD_READ, slba, nlb, out=out)
+        _check_status(NVME_CMD_READ, slba, status)
+
+    async def write(self, slba, nlb=1, data=None):
+        status, _ = await self.submit(NVME_CMD_WRITE, slba, nlb, data=data)
+        _check_status(NVME_CMD_WRITE, slba, status)
+
+    async def submit_batch(self, commands):
+        """Submit `(opcode, slba, nlb)` tuples, keeping up to queue_depth in flight.
+
+        Returns the NVMe status of every command, in order.
+        """
+        results = await asyncio.gather(*(self.submit(*cmd) for cmd in commands))
+        return [status for status, _ in results]
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+## @class ThreadPoolIOEngine
+#  Fallback engine: `queue_depth` IOPassthruWrapper instances (each with its own
+#  command struct and buffers) driven by a thread pool of blocking ioctls.
+#  `io_factory` builds those per-slot wrappers; any object with read()/write()
+#  like IOPassthruWrapper works.
+class ThreadPoolIOEngine(_BaseIOEngine):
+    backend = "threadpool"
+
+    def __init__(self, ns_path, queue_depth=32, block_size=4096, max_blocks=1, logger=None,
+                 handle_pool=None, io_factory=None):
+        super().__init__(ns_path, queue_depth, block_size, max_blocks, logger)
+        self._owns_pool = handle_pool is None and io_factory is None
+        self.handle_pool = handle_pool or DeviceHandlePool(logger=self.logger)
+        if io_factory is None:
+            # Open the shared fd up front so worker threads never race on the pool
+            self.handle_pool.get(ns_path)
+
+            def io_factory():
+                return IOPassthruWrapper(ns_path, block_size, max_blocks, self.logger, self.handle_pool)
+        self._wrappers = [io_factory() for _ in range(queue_depth)]
+        self._executor = ThreadPoolExecutor(max_workers=queue_depth, thread_name_prefix="nvme-io")
+        self._free = None
+        self._loop = None
+
+    def _run(self, wrapper, opcode, slba, nlb, data, out, buf=None):
+        started = time.perf_counter_ns()
+        try:
+            if buf is not None and hasattr(wrapper, "send_io_cmd"):
+                # The ioctl points straight at the caller's buffer
+                status = wrapper.send_io_cmd(opcode, slba, nlb, buffer_address(buf), nlb * self.block_size)
+                if status:
+                    raise NvmeIOError("read" if opcode == NVME_CMD_READ else "write", slba, status)
+            elif buf is not None:
+                # Wrappers without raw commands (e.g. simulated) copy instead
+                if opcode == NVME_CMD_READ:
+                    view = wrapper.read(slba, nlb)
+                    buf[:len(view)] = view
+                else:
+                    wrapper.write(slba, nlb, buf[:nlb * self.block_size])
+            elif opcode == NVME_CMD_READ:
+                view = wrapper.read(slba, nlb)
+                if out is not None:
+                    out[:len(view)] = view
+            else:
+                wrapper.write(slba, nlb, data)
+        except NvmeIOError as e:
+            metrics.record(self.ns_path, "io", opcode, time.perf_counter_ns() - started, error=True)
+            # Hand the NVMe status back instead of failing the whole batch
+            return e.status, 0
+        metrics.record(self.ns_path, "io", opcode, time.perf_counter_ns() - started, nlb * self.block_size)
+        return 0, 0
+
+    async def submit(self, opcode, slba, nlb=1, data=None, out=None, buf=None):
+        if buf is not None:
+            self._check_buf(buf, nlb)
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Free-slot queue belongs to the loop that is driving this engine
+            self._loop = loop
+            self._free = asyncio.Queue()
+            for wrapper in self._wrappers:
+                self._free.put_nowait(wrapper)
+        wrapper = await self._free.get()
+        try:
+            return await loop.run_in_executor(self._executor, self._run, wrapper, opcode, slba, nlb, data, out, buf)
+        finally:
+            self._free.put_nowait(wrapper)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for wrapper in self._wrappers:
+            wrapper.close()
+        if self._owns_pool:
+            self.handle_pool.close()
+
+
+## @class _IoUring
+#  Minimal io_uring instance (SQE128/CQE32, as NVMe passthrough requires)
+#  driven through ctypes and mmap'ed rings.
+class _IoUring:
+    def __init__(self, entries):
+        params = bytearray(IO_URING_PARAMS.size)
+        struct.pack_into('<I', params, 8, IORING_SETUP_SQE128 | IORING_SETUP_CQE32)
+        fd = _libc.syscall(SYS_IO_URING_SETUP, entries, (ctypes.c_char * len(params)).from_buffer(params))
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"io_uring_setup: {os.strerror(errno)}")
+        self.fd = fd
+        (sq_entries, cq_entries, _flags, _cpu, _idle, features,
+         _sq_head, sq_tail, sq_mask, _sq_ring_entries, _sq_flags, _dropped, sq_array, _r1, _ua1,
+         cq_head, cq_tail, cq_mask, _cq_ring_entries, _overflow, cqes, _cq_flags, _r2, _ua2
+         ) = IO_URING_PARAMS.unpack(params)
+        self.sq_entries = sq_entries
+        sq_size = sq_array + sq_entries * 4
+        cq_size = cqes + cq_entries * IO_URING_CQE_SIZE
+        prot = mmap.PROT_READ | mmap.PROT_WRITE
+        flags = mmap.MAP_SHARED | MAP_POPULATE
+        if features & IORING_FEAT_SINGLE_MMAP:
+            self.sq_ring = mmap.mmap(fd, max(sq_size, cq_size), flags, prot, offset=IORING_OFF_SQ_RING)
+            self.cq_ring = self.sq_ring
+        else:
+            self.sq_ring = mmap.mmap(fd, sq_size, flags, prot, offset=IORING_OFF_SQ_RING)
+            self.cq_ring = mmap.mmap(fd, cq_size, flags, prot, offset=IORING_OFF_CQ_RING)
+        self.sqes = mmap.mmap(fd, sq_entries * IO_URING_SQE_SIZE, flags, prot, offset=IORING_OFF_SQES)
+        self.sq_tail_off = sq_tail
+        self.sq_mask = U32.unpack_from(self.sq_ring, sq_mask)[0]
+        self.sq_array_off = sq_array
+        self.cq_head_off = cq_head
+        self.cq_tail_off = cq_tail
+        self.cq_mask = U32.unpack_from(self.cq_ring, cq_mask)[0]
+        self.cqes_off = cqes
+        self.sq_tail = U32.unpack_from(self.sq_ring, sq_tail)[0]
+        # Identity SQ index array: slot i of the ring always points at SQE i
+        for i in range(sq_entries):
+            U32.pack_into(self.sq_ring, sq_array + 4 * i, i)
+
+    def next_sqe_offset(self):
+        """Offset of the SQE to fill next; publish it with advance()."""
+        return (self.sq_tail & self.sq_mask) * IO_URING_SQE_SIZE
+
+    def advance(self):
+        self.sq_tail = (self.sq_tail + 1) & 0xFFFFFFFF
+        U32.pack_into(self.sq_ring, self.sq_tail_off, self.sq_tail)
+
+    def enter(self, to_submit, min_complete, flags=0):
+        while True:
+            ret = _libc.syscall(SYS_IO_URING_ENTER, self.fd, to_submit, min_complete, flags, None, 0)
+            if ret >= 0:
+                return ret
+            errno = ctypes.get_errno()
+            if errno != 4:  # EINTR
+                raise OSError(errno, f"io_uring_enter: {os.strerror(errno)}")
+
+    def reap(self):
+        """Yield `(user_data, res, result)` for every posted completion."""
+        ring = self.cq_ring
+        head = U32.unpack_from(ring, self.cq_head_off)[0]
+        tail = U32.unpack_from(ring, self.cq_tail_off)[0]
+        while head != tail:
+            user_data, res, _flags, result = IO_URING_CQE.unpack_from(
+                ring, self.cqes_off + (head & self.cq_mask) * IO_URING_CQE_SIZE)
+            head = (head + 1) & 0xFFFFFFFF
+            U32.pack_into(ring, self.cq_head_off, head)
+            yield user_data, res, result & 0xFFFFFFFF
+
+    def close(self):
+        self.sqes.close()
+        if self.cq_ring is not self.sq_ring:
+            self.cq_ring.close()
+        self.sq_ring.close()
+        os.close(self.fd)
+
+
+## @class UringIOEngine
+#  io_uring NVMe passthrough engine. Each in-flight slot owns a slice of one
+#  page-aligned buffer; SQEs queued during one event-loop iteration are
+#  published with a single io_uring_enter, and a reaper thread resolves the
+#  asyncio futures as completions arrive.
+class UringIOEngine(_BaseIOEngine):
+    backend = "io_uring"
+
+    def __init__(self, ns_path, queue_depth=32, block_size=4096, max_blocks=1, logger=None):
+        super().__init__(ns_path, queue_depth, block_size, max_blocks, logger)
+        self.char_path = generic_char_device(ns_path)
+        if self.char_path is None or not os.path.exists(self.char_path):
+            raise OSError(f"No NVMe generic char device for {ns_path}")
+        self.ring = _IoUring(queue_depth)
+        try:
+            self.fd = os.open(self.char_path, os.O_RDONLY)
+        except OSError:
+            self.ring.close()
+            raise
+        self.nsid = fcntl.ioctl(self.fd, NVME_IOCTL_ID)
+        self.xfer_len = block_size * max_blocks
+        self.data = mmap.mmap(-1, self.xfer_len * queue_depth)
+        self._data_addr = buffer_address(self.data)
+        self._futures = [None] * queue_depth
+        self._free = None
+        self._loop = None
+        self._pending = 0
+        self._closing = False
+        self._reaper = threading.Thread(target=self._reap_loop, name="nvme-uring-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            self.ring.enter(0, 1, IORING_ENTER_GETEVENTS)
+            for user_data, res, result in self.ring.reap():
+                if user_data == WAKE_USER_DATA:
+                    return
+                future = self._futures[user_data]
+                self._futures[user_data] = None
+                self._loop.call_soon_threadsafe(self._complete, future, res, result)
+
+    @staticmethod
+    def _complete(future, res, result):
+        if future.cancelled():
+            return
+        if res < 0:
+            future.set_exception(OSError(-res, os.strerror(-res)))
+        else:
+            future.set_result((res, result))
+
+    def _flush(self):
+        pending, self._pending = self._pending, 0
+        if pending:
+            self.ring.enter(pending, 0)
+
+    def _queue(self, slot, opcode, slba, nlb, addr=None):
+        off = self.ring.next_sqe_offset()
+        data_len = nlb * self.block_size
+        if addr is None:
+            addr = self._data_addr + slot * self.xfer_len
+        IO_URING_SQE_HDR.pack_into(
+            self.ring.sqes, off,
+            IORING_OP_URING_CMD, 0, 0, self.fd,
+            NVME_URING_CMD_IO, 0,  # cmd_op, pad
+            0, 0, 0,               # addr, len, uring_cmd_flags
+            slot,                  # user_data
+            0, 0, 0
+        )
+        pack_io_cmd(self.ring.sqes, opcode, self.nsid, slba, nlb, addr, data_len, offset=off + IO_URING_SQE_HDR.size)
+        self.ring.advance()
+        if not self._pending:
+            self._loop.call_soon(self._flush)
+        self._pending += 1
+
+    async def submit(self, opcode, slba, nlb=1, data=None, out=None, buf=None):
+        if buf is not None:
+            self._check_buf(buf, nlb)
+        elif nlb > self.max_blocks:
+            raise ValueError(f"nlb={nlb} outside the preallocated buffer (1..{self.max_blocks} blocks)")
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._free = asyncio.Queue()
+            for slot in range(self.queue_depth):
+                self._free.put_nowait(slot)
+        slot = await self._free.get()
+        base = slot * self.xfer_len
+        try:
+            if data is not None:
+                self.data[base:base + len(data)] = data
+            future = self._loop.create_future()
+            self._futures[slot] = future
+            started = time.perf_counter_ns()
+            self._queue(slot, opcode, slba, nlb, buffer_address(buf) if buf is not None else None)
+            try:
+                status, result = await future
+            except OSError:
+                metrics.record(self.ns_path, "io", opcode, time.perf_counter_ns() - started, error=True)
+                raise
+            metrics.record(self.ns_path, "io", opcode, time.perf_counter_ns() - started, nlb * self.block_size,
+                           status != 0)
+            if out is not None and opcode == NVME_CMD_READ:
+                data_len = nlb * self.block_size
+                out[:data_len] = self.data[base:base + data_len]
+            return status, result
+        finally:
+            self._free.put_nowait(slot)
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        off = self.ring.next_sqe_offset()
+        IO_URING_SQE_HDR.pack_into(self.ring.sqes, off, IORING_OP_NOP, 0, 0, -1, 0, 0, 0, 0, 0,
+                                   WAKE_USER_DATA, 0, 0, 0)
+        self.ring.advance()
+        self.ring.enter(1, 0)
+        self._reaper.join()
+        self.ring.close()
+        os.close(self.fd)
+        self.data.close()
+
+
+## @brief Create the fastest available I/O engine for `ns_path`.
+#  Tries io_uring passthrough first and falls back to the ioctl thread pool.
+def open_io_engine(ns_path, queue_depth=32, block_size=4096, max_blocks=1, logger=None,
+                   handle_pool=None, prefer_uring=True):
+    logger = logger or logging.getLogger(__name__)
+    if prefer_uring:
+        try:
+            engine = UringIOEngine(ns_path, queue_depth, block_size, max_blocks, logger)
+            logger.debug("Using io_uring passthrough on %s (QD=%d)", engine.char_path, queue_depth)
+            return engine
+        except OSError as e:
+            logger.debug("io_uring passthrough unavailable (%s); falling back to thread pool", e)
+    return ThreadPoolIOEngine(ns_path, queue_depth, block_size, max_blocks, logger, handle_pool)
@@ -0,0 +1,110 @@
+#!/bin/env python3.9
+import fcntl
+import mmap
+import logging
+from Test.admin_passthru_wrapper import NVME_PASSTHRU_CMD, DeviceHandlePool, buffer_address
+
+# Constants for NVMe I/O Passthru (from linux/nvme_ioctl.h)
+NVME_IOCTL_ID = 0x4E40          # _IO('N', 0x40): returns the namespace ID of the fd
+NVME_IOCTL_IO_CMD = 0xC0484E43  # _IOWR('N', 0x43, struct nvme_passthru_cmd)
+
+NVME_CMD_WRITE = 0x01
+NVME_CMD_READ = 0x02
+
+
+## @class NvmeIOError
+#  Raised when an NVM command completes with a non-zero NVMe status.
+class NvmeIOError(RuntimeError):
+    def __init__(self, op, slba, status):
+        super().__init__(f"NVMe {op} failed at LBA {slba}: status {status:#x}")
+        self.status = status
+
+
+## @brief Pack an NVM Read/Write command into `cmd_buf` (a 72-byte nvme_passthru_cmd).
+#  @param slba Starting LBA (split into cdw10/cdw11).
+#  @param nlb  Number of logical blocks (sent 0-based in cdw12).
+def pack_io_cmd(cmd_buf, opcode, nsid, slba, nlb, addr, data_len, offset=0):
+    NVME_PASSTHRU_CMD.pack_into(
+        cmd_buf, offset,
+        opcode, 0, 0, nsid,
+        0, 0,                   # cdw2, cdw3
+        0, addr,                # metadata, addr
+        0, data_len,            # metadata_len, data_len
+        slba & 0xFFFFFFFF,      # cdw10: SLBA low
+        slba >> 32,             # cdw11: SLBA high
+        (nlb - 1) & 0xFFFF,     # cdw12: NLB (0-based)
+        0, 0, 0,                # cdw13..cdw15
+        0, 0                    # timeout_ms, result
+    )
+
+
+## @class IOPassthruWrapper
+#  Sends NVM command set Read/Write commands to a namespace block device
+#  (e.g. /dev/nvme0n1) through NVME_IOCTL_IO_CMD.
+#
+#  The namespace fd and the read/write data buffers are allocated once, so every
+#  block read or written costs one ioctl and no process spawn.
+class IOPassthruWrapper:
+    def __init__(self, ns_path, block_size=4096, max_blocks=1, logger=None, handle_pool=None):
+        self.ns_path = ns_path
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.logger = logger or logging.getLogger(__name__)
+        self._owns_pool = handle_pool is None
+        self.handle_pool = handle_pool or DeviceHandlePool(logger=self.logger)
+        self._nsid = None
+        self._cmd_buf = bytearray(NVME_PASSTHRU_CMD.size)
+        buf_len = block_size * max_blocks
+        #! Page-aligned, zero-filled buffers reused by every command
+        self.read_buf = mmap.mmap(-1, buf_len)
+        self.write_buf = mmap.mmap(-1, buf_len)
+        self._read_addr = buffer_address(self.read_buf)
+        self._write_addr = buffer_address(self.write_buf)
+
+    @property
+    def nsid(self):
+        """Namespace ID behind `ns_path`, asked to the driver once."""
+        if self._nsid is None:
+            self._nsid = fcntl.ioctl(self.handle_pool.get(self.ns_path), NVME_IOCTL_ID)
+        return self._nsid
+
+    def close(self):
+        if self._owns_pool:
+            self.handle_pool.close()
+        self.read_buf.close()
+        self.write_buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    ## @brief Send one NVM I/O command and return the NVMe status (0 on success).
+    def send_io_cmd(self, opcode, slba, nlb, addr, data_len):
+        pack_io_cmd(self._cmd_buf, opcode, self.nsid, slba, nlb, addr, data_len)
+        return fcntl.ioctl(self.handle_pool.get(self.ns_path), NVME_IOCTL_IO_CMD, self._cmd_buf, True)
+
+    def _check_nlb(self, nlb):
+        if not 0 < nlb <= self.max_blocks:
+            raise ValueError(f"nlb={nlb} outside the preallocated buffer (1..{self.max_blocks} blocks)")
+
+    def read(self, slba, nlb=1):
+        """Read `nlb` blocks at `slba`; returns a memoryview valid until the next read."""
+        self._check_nlb(nlb)
+        data_len = nlb * self.block_size
+        status = self.send_io_cmd(NVME_CMD_READ, slba, nlb, self._read_addr, data_len)
+        if status:
+            raise NvmeIOError("read", slba, status)
+        return memoryview(self.read_buf)[:data_len]
+
+    def write(self, slba, nlb=1, data=None):
+        """Write `nlb` blocks at `slba` from `data`, or from the current write buffer contents."""
+        self._check_nlb(nlb)
+        data_len = nlb * self.block_size
+        if data is not None:
+            self.write_buf[:len(data)] = data
+        status = self.send_io_cmd(NVME_CMD_WRITE, slba, nlb, self._write_addr, data_len)
+        if status:
+            raise NvmeIOError("write", slba, status)
@@ -0,0 +1,201 @@
+#!/bin/env python3.9
+import os
+import threading
+from array import array
+
+## @file latency.py
+#  Always-on command instrumentation: HDR-style latency histograms plus byte
+#  and error counters per (device, opcode).
+#
+#  A histogram is a fixed array of log-linear buckets: values below
+#  2**SIGNIFICANT_BITS nanoseconds get one bucket each, every larger power of
+#  two is split in 2**(SIGNIFICANT_BITS - 1) buckets, so any percentile is
+#  exact to about 3% from nanoseconds to minutes. Recording is an integer
+#  bucket computation and one array increment; nothing is allocated per command.
+#
+#  The passthru wrapper, the simulator and the I/O engines record into the
+#  process-wide `metrics`; TestManager reports the activity of each test
+#  (count, bytes, errors, p50/p99/p999) with `metrics.snapshot()` / `since()`.
+#  Set NVME_PROJECT_METRICS=0 to turn collection off.
+
+SIGNIFICANT_BITS = 6
+_HALF = 1 << (SIGNIFICANT_BITS - 1)
+MAX_VALUE_NS = 1 << 40  # ~18 minutes; slower commands land in the last bucket
+BUCKETS = (MAX_VALUE_NS.bit_length() - SIGNIFICANT_BITS + 2) * _HALF
+
+ADMIN_OPCODES = {
+    0x02: "get_log_page", 0x06: "identify", 0x09: "set_features", 0x0A: "get_features",
+    0x0D: "ns_mgmt", 0x10: "fw_commit", 0x11: "fw_download", 0x14: "device_self_test", 0x15: "ns_attach",
+    0x80: "format_nvm", 0x84: "sanitize",
+}
+IO_OPCODES = {0x00: "flush", 0x01: "write", 0x02: "read", 0x05: "compare", 0x08: "write_zeroes", 0x09: "dsm"}
+
+
+def bucket_index(value):
+    if value >= MAX_VALUE_NS:
+        return BUCKETS - 1
+    shift = value.bit_length() - SIGNIFICANT_BITS
+    if shift <= 0:
+        return value if value > 0 else 0
+    return shift * _HALF + (value >> shift)
+
+
+## @brief Lowest value that falls in bucket `index`.
+def bucket_value(index):
+    if index < 2 * _HALF:
+        return index
+    shift = index // _HALF - 1
+    return (index - shift * _HALF) << shift
+
+
+## @class LatencyHistogram
+#  Log-bucketed histogram of nanosecond latencies.
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def copy(self):
+        other = LatencyHistogram()
+        other.counts = array('Q', self.counts)
+        other.count, other.total, other.min, other.max = self.count, self.total, self.min, self.max
+        return other
+
+    def merge(self, other):
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    ## @brief Histogram of what was recorded after `earlier` (a copy of this one).
+    #  min/max are those of the whole histogram, bounded by the buckets in use.
+    def minus(self, earlier):
+        out = LatencyHistogram()
+        out.counts = array('Q', (a - b for a, b in zip(self.counts, earlier.counts)))
+        out.count = self.count - earlier.count
+        out.total = self.total - earlier.total
+        used = [i for i, n in enumerate(out.counts) if n]
+        if used:
+            out.min = max(self.min, bucket_value(used[0]))
+            out.max = min(self.max, bucket_value(used[-1] + 1) - 1)
+        return out
+
+    ## @brief Value at quantile `q` (0..1): the upper end of its bucket, capped at max.
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_value(i + 1) - 1, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        """Count, mean, min, max and p50/p90/p99/p999 in microseconds."""
+        us = 1e3
+        out = {"count": self.count, "mean_us": round(self.mean / us, 2),
+               "min_us": round((self.min or 0) / us, 2), "max_us": round(self.max / us, 2)}
+        for name, q in (("p50_us", 0.5), ("p90_us", 0.9), ("p99_us", 0.99), ("p999_us", 0.999)):
+            out[name] = round(self.percentile(q) / us, 2)
+        return out
+
+
+## @class OpStats
+#  Latencies, bytes moved and errors of one opcode on one device.
+class OpStats:
+    __slots__ = ("histogram", "bytes", "errors")
+
+    def __init__(self, histogram=None, nbytes=0, errors=0):
+        self.histogram = histogram or LatencyHistogram()
+        self.bytes = nbytes
+        self.errors = errors
+
+    def copy(self):
+        return OpStats(self.histogram.copy(), self.bytes, self.errors)
+
+    def summary(self):
+        return dict(self.histogram.summary(), bytes=self.bytes, errors=self.errors)
+
+
+def op_name(kind, opcode):
+    names = ADMIN_OPCODES if kind == "admin" else IO_OPCODES
+    return f"{kind}:{names.get(opcode, f'{opcode:#04x}')}"
+
+
+## @class CommandMetrics
+#  OpStats by (device, "admin:identify" / "io:read" ...), thread safe.
+class CommandMetrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    ## @brief Account one completed command.
+    #  @param latency_ns Submission to completion time (time.perf_counter_ns() difference).
+    def record(self, device, kind, opcode, latency_ns, nbytes=0, error=False):
+        if not self.enabled:
+            return
+        key = (device, kind, opcode)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = OpStats()
+            stats.histogram.record(latency_ns)
+            if error:
+                stats.errors += 1
+            else:
+                stats.bytes += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            return {key: stats.copy() for key, stats in self._stats.items()}
+
+    ## @brief Per device and opcode summaries of the commands since `snapshot`
+    #  (everything when None): `{device: {"io:read": {count, bytes, errors, p50_us, ...}}}`.
+    def since(self, snapshot=None):
+        snapshot = snapshot or {}
+        out = {}
+        with self._lock:
+            items = list(self._stats.items())
+            for key, stats in items:
+                before = snapshot.get(key)
+                if before is not None:
+                    if stats.histogram.count == before.histogram.count:
+                        continue
+                    stats = OpStats(stats.histogram.minus(before.histogram), stats.bytes - before.bytes,
+                                    stats.errors - before.errors)
+                device, kind, opcode = key
+                out.setdefault(device, {})[op_name(kind, opcode)] = stats.summary()
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+metrics = CommandMetrics(enabled=os.environ.get("NVME_PROJECT_METRICS", "1") != "0")
@@ -0,0 +1,253 @@
+#!/bin/env python3.9
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+## @file log_pipeline.py
+#  Asynchronous logging for the test manager and the tests.
+#
+#  Callers only build a LogRecord and put it on a queue; a QueueListener thread
+#  formats it and writes the human log (file + console). Message arguments are
+#  formatted in that thread, so `logger.debug("SMART log:\n%s", LazyJson(log))`
+#  costs nothing when DEBUG is filtered out and little when it is not.
+#  Arguments must not change after the call (pass copies, not recycled buffers).
+#
+#  Alongside the human log every test gets a JSONL event stream
+#  (`<log file>_<test>.jsonl`): test start/end, structured events emitted by
+#  the test (e.g. one per NVMe command) and the log records of that test.
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+## @brief Default log file: <base_dir>/<date>/test_manager[_tag]_<time>.log
+#  (base_dir defaults to $NVME_PROJECT_RESULT_DIR or ~/NVME_RESULTS).
+def results_log_file(base_dir=None, tag=None):
+    if base_dir is None:
+        base_dir = os.environ.get("NVME_PROJECT_RESULT_DIR") or os.path.join(os.path.expanduser("~"), "NVME_RESULTS")
+    #Create folder with date
+    log_dir = os.path.join(base_dir, datetime.now().strftime('%Y-%m-%d'))
+    # tag (e.g. the device name) keeps parallel workers from sharing a file
+    prefix = f'test_manager_{tag}' if tag else 'test_manager'
+    return os.path.join(log_dir, f'{prefix}_{datetime.now().strftime("%H-%M-%S")}.log')
+
+
+## @brief Working directory of the tests on one drive: <base_dir>/<date>/<device name>,
+#  next to the log files, so workers running at once never share their artifacts.
+def device_results_dir(base_dir=None, device=None):
+    log_dir = os.path.dirname(results_log_file(base_dir))
+    return os.path.join(log_dir, os.path.basename(device or "/dev/nvme0"))
+
+
+def _json_default(value):
+    # Layout records (IdentifyController, SmartLog, ...) and other odd values
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+## @class LazyJson
+#  Defers `json.dumps` of a value (dict or layout record) until the record is
+#  actually written; a filtered-out debug line never serializes anything.
+class LazyJson:
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value, indent=4):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        return json.dumps(self.value if self.value is not None else {}, indent=self.indent,
+                          sort_keys=True, default=_json_default)
+
+
+## @class NullEventStream
+#  Event stream that drops everything; used when a test runs without a pipeline.
+class NullEventStream:
+    current = None
+
+    def start_test(self, name):
+        pass
+
+    def end_test(self, **fields):
+        pass
+
+    def emit(self, event, **fields):
+        pass
+
+    def close(self):
+        pass
+
+
+## @class EventStream
+#  Per-test JSONL event files written by a background thread. `emit` only
+#  timestamps the event and puts it on a SimpleQueue, so tests can log one
+#  event per command without slowing their I/O.
+class EventStream(NullEventStream):
+    def __init__(self, path_prefix):
+        self.path_prefix = path_prefix
+        self.current = None
+        self._started = {}
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="event-writer", daemon=True)
+        self._writer.start()
+
+    def path(self, test):
+        return f"{self.path_prefix}_{re.sub(r'[^A-Za-z0-9.-]+', '_', test)}.jsonl"
+
+    def start_test(self, name):
+        self.current = name
+        self._started[name] = time.monotonic()
+        self.emit("test_start")
+
+    def end_test(self, **fields):
+        name, self.current = self.current, None
+        if name is None:
+            return
+        started = self._started.pop(name, None)
+        if started is not None:
+            fields.setdefault("duration_s", round(time.monotonic() - started, 6))
+        self._queue.put((time.time(), name, "test_end", fields))
+        self._queue.put((None, name, None, None))  # close that test's file
+
+    def emit(self, event, **fields):
+        self._queue.put((time.time(), self.current, event, fields))
+
+    def _write_loop(self):
+        files = {}
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                # Drain whatever else is queued and write it in one go
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = False
+                for ts, test, event, fields in batch:
+                    if ts is None:
+                        if event is None and test is None:
+                            stop = True
+                        elif test in files:
+                            files.pop(test).close()
+                        continue
+                    if test is None:
+                        continue  # nothing running: no stream to write to
+                    f = files.get(test)
+                    if f is None:
+                        f = files[test] = open(self.path(test), 'a')
+                    line = {"ts": round(ts, 6), "test": test, "event": event}
+                    line.update(fields)
+                    f.write(json.dumps(line, default=_json_default) + "\n")
+                for f in files.values():
+                    f.flush()
+                if stop:
+                    return
+        finally:
+            for f in files.values():
+                f.close()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put((None, None, None, None))
+            self._writer.join()
+
+
+## @class _LazyQueueHandler
+#  QueueHandler that leaves formatting to the listener thread (records never
+#  leave the process, so they do not need to be flattened for pickling).
+class _LazyQueueHandler(QueueHandler):
+    def __init__(self, log_queue, events):
+        super().__init__(log_queue)
+        self.events = events
+
+    def prepare(self, record):
+        record.test = self.events.current
+        return record
+
+
+## @class _EventLogHandler
+#  Listener-side handler copying log records into the JSONL stream of the test
+#  that was running when they were logged.
+class _EventLogHandler(logging.Handler):
+    def __init__(self, events, level=logging.INFO):
+        super().__init__(level)
+        self.events = events
+
+    def emit(self, record):
+        test = getattr(record, "test", None)
+        if test is not None:
+            self.events._queue.put((record.created, test, "log",
+                                    {"level": record.levelname, "message": record.getMessage()}))
+
+
+## @class LoggingPipeline
+#  Logger `name` writing through a queue to `log_file` (at `level`) and the
+#  console (at `console_level`), plus the per-test EventStream `events`.
+#  Call close() (or use it as a context manager) to flush everything.
+class LoggingPipeline:
+    def __init__(self, name='test_manager_logger', log_file=None, level=logging.DEBUG,
+                 console=sys.stdout, console_level=logging.INFO, events=True):
+        self.log_file = log_file or results_log_file()
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_file)), exist_ok=True)
+        self.events = EventStream(os.path.splitext(self.log_file)[0]) if events else NullEventStream()
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        if console is not None:
+            # Console Handler
+            ch = logging.StreamHandler(console)
+            ch.setLevel(console_level)
+            handlers.append(ch)
+        # File Handler
+        fh = logging.FileHandler(self.log_file)
+        fh.setLevel(level)
+        handlers.append(fh)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        if events:
+            handlers.append(_EventLogHandler(self.events))
+        self._handlers = handlers
+
+        self._queue = queue.SimpleQueue()
+        self._listener = QueueListener(self._queue, *handlers, respect_handler_level=True)
+        self._listener.start()
+
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        for handler in list(self.logger.handlers):
+            if isinstance(handler, QueueHandler):
+                self.logger.removeHandler(handler)
+        self._queue_handler = _LazyQueueHandler(self._queue, self.events)
+        self.logger.addHandler(self._queue_handler)
+        self._closed = False
+        atexit.register(self.close)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.logger.removeHandler(self._queue_handler)
+        self._listener.stop()
+        self.events.close()
+        for handler in self._handlers:
+            handler.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,106 @@
+#!/bin/env python3.9
+import json
+import subprocess
+import threading
+from Test.nvme_topology import namespace_path, on_namespace_change
+
+## @file nvme_geometry.py
+#  Lazy, shared namespace geometry (size, LBA size, LBA formats).
+#
+#  Nothing is read at import time. The first `namespace_geometry()` call for a
+#  namespace sends one Identify Namespace (passthru, or `nvme id-ns` without
+#  it) and the answer is reused by every later caller until a Format NVM or a
+#  namespace management / attachment command on that controller invalidates it.
+
+
+## @class NamespaceGeometry
+#  Geometry of one namespace. `lbafs` holds `(ms, lbads, rp)` per LBA format
+#  and `lbaf` the index of the one in use.
+class NamespaceGeometry:
+    __slots__ = ("nsid", "nsze", "ncap", "nuse", "flbas", "lbaf", "lbafs", "dps")
+
+    def __init__(self, nsid, nsze, ncap, nuse, flbas, lbafs, dps=0):
+        self.nsid = nsid
+        self.nsze = nsze
+        self.ncap = ncap
+        self.nuse = nuse
+        self.flbas = flbas
+        # flbas bits 3:0, extended by bits 6:5 when there are more than 16 formats
+        self.lbaf = (flbas & 0x0F) | (((flbas >> 5) & 0x03) << 4 if len(lbafs) > 16 else 0)
+        self.lbafs = list(lbafs)
+        self.dps = dps
+
+    ## @brief From Identify Namespace data: an IdentifyNamespace view or `nvme id-ns` JSON.
+    @classmethod
+    def from_identify(cls, nsid, id_ns):
+        lbafs = [(f["ms"], f["ds"], f["rp"]) for f in id_ns["lbafs"]]
+        return cls(nsid, id_ns["nsze"], id_ns["ncap"], id_ns["nuse"], id_ns["flbas"], lbafs, id_ns.get("dps", 0))
+
+    @property
+    def lba_size(self):
+        return 1 << self.lbafs[self.lbaf][1]
+
+    @property
+    def metadata_size(self):
+        return self.lbafs[self.lbaf][0]
+
+    @property
+    def size_bytes(self):
+        return self.nsze * self.lba_size
+
+    def __repr__(self):
+        return f"NamespaceGeometry(nsid={self.nsid}, nsze={self.nsze}, lba_size={self.lba_size}, lbaf={self.lbaf})"
+
+
+## @class GeometryService
+#  Memoizes NamespaceGeometry per (controller, nsid); entries of a controller
+#  are dropped when `nvme_topology.namespace_changed()` reports a change on it.
+class GeometryService:
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+        on_namespace_change(self.invalidate)
+
+    def get(self, nvme_interface=None, device=None, nsid=1):
+        device = device or getattr(nvme_interface, "device_path", None) or "/dev/nvme0"
+        key = (device, nsid)
+        geometry = self._cache.get(key)
+        if geometry is None:
+            geometry = self._fetch(nvme_interface, device, nsid)
+            if geometry is not None:
+                with self._lock:
+                    self._cache[key] = geometry
+        return geometry
+
+    def _fetch(self, nvme_interface, device, nsid):
+        if nvme_interface is not None and hasattr(nvme_interface, "identify_namespace"):
+            id_ns = nvme_interface.identify_namespace(nsid)
+            return NamespaceGeometry.from_identify(nsid, id_ns) if id_ns is not None else None
+        try:
+            output = subprocess.check_output(["nvme", "id-ns", namespace_path(device, nsid), "-o", "json"],
+                                             text=True, stderr=subprocess.DEVNULL)
+            return NamespaceGeometry.from_identify(nsid, json.loads(output))
+        except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+            return None
+
+    ## @brief Forget the cached geometry of `device` (every controller when None).
+    def invalidate(self, device=None):
+        with self._lock:
+            if device is None:
+                self._cache.clear()
+            else:
+                for key in [k for k in self._cache if k[0] == device]:
+                    del self._cache[key]
+
+
+_service = GeometryService()
+
+
+## @brief Geometry of namespace `nsid` of a controller (via `nvme_interface`
+#  when given, else nvme-cli on `device`); cached, None if it cannot be read.
+def namespace_geometry(nvme_interface=None, device=None, nsid=1):
+    return _service.get(nvme_interface, device, nsid)
+
+
+def invalidate_geometry(device=None):
+    _service.invalidate(device)
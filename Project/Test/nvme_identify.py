@@ -0,0 +1,99 @@
+#!/bin/env python3.9
+from Test.nvme_layouts import Array, Field, Layout, fields
+
+## @file nvme_identify.py
+#  Identify Controller (CNS 01h) and Identify Namespace (CNS 00h) layouts,
+#  using the same field names as `nvme id-ctrl` / `nvme id-ns --output-format=json`.
+
+NVME_ADMIN_IDENTIFY = 0x06
+
+# Identify CNS values (cdw10 bits 7:0)
+NVME_ID_CNS_NS = 0x00
+NVME_ID_CNS_CTRL = 0x01
+NVME_ID_CNS_NS_ACTIVE_LIST = 0x02
+
+NVME_IDENTIFY_DATA_SIZE = 4096
+NVME_ID_CTRL_PSD_OFFSET = 2048
+NVME_ID_CTRL_PSD_SIZE = 32
+
+## Power state descriptor (32 bytes), keys as printed by nvme-cli under "psds"
+PSD_LAYOUT = Layout("PowerStateDescriptor", NVME_ID_CTRL_PSD_SIZE, [
+    Field("max_power", 0, 'u16'),
+    Field("max_power_scale", 3, 'u8', bits=(0, 1)),
+    Field("non-operational_state", 3, 'u8', bits=(1, 1)),
+    Field("entry_lat", 4, 'u32'),
+    Field("exit_lat", 8, 'u32'),
+    Field("read_tput", 12, 'u8', bits=(0, 5)),
+    Field("read_lat", 13, 'u8', bits=(0, 5)),
+    Field("write_tput", 14, 'u8', bits=(0, 5)),
+    Field("write_lat", 15, 'u8', bits=(0, 5)),
+    Field("idle_power", 16, 'u16'),
+    Field("idle_scale", 18, 'u8', bits=(6, 2)),
+    Field("active_power", 20, 'u16'),
+    Field("active_power_work", 22, 'u8', bits=(0, 3)),
+    Field("active_scale", 22, 'u8', bits=(6, 2)),
+])
+
+## Identify Controller rows: (json name, byte offset, kind[, size]), in nvme-cli's JSON order.
+_ID_CTRL_ROWS = (
+    ("vid", 0, 'u16'), ("ssvid", 2, 'u16'), ("sn", 4, 'str', 20), ("mn", 24, 'str', 40),
+    ("fr", 64, 'str', 8), ("rab", 72, 'u8'), ("ieee", 73, 'u24'), ("cmic", 76, 'u8'),
+    ("mdts", 77, 'u8'), ("cntlid", 78, 'u16'), ("ver", 80, 'u32'), ("rtd3r", 84, 'u32'),
+    ("rtd3e", 88, 'u32'), ("oaes", 92, 'u32'), ("ctratt", 96, 'u32'), ("rrls", 100, 'u16'),
+    ("cntrltype", 111, 'u8'), ("fguid", 112, 'uuid'), ("crdt1", 128, 'u16'), ("crdt2", 130, 'u16'),
+    ("crdt3", 132, 'u16'), ("nvmsr", 253, 'u8'), ("vwci", 254, 'u8'), ("mec", 255, 'u8'),
+    ("oacs", 256, 'u16'), ("acl", 258, 'u8'), ("aerl", 259, 'u8'), ("frmw", 260, 'u8'),
+    ("lpa", 261, 'u8'), ("elpe", 262, 'u8'), ("npss", 263, 'u8'), ("avscc", 264, 'u8'),
+    ("apsta", 265, 'u8'), ("wctemp", 266, 'u16'), ("cctemp", 268, 'u16'), ("mtfa", 270, 'u16'),
+    ("hmpre", 272, 'u32'), ("hmmin", 276, 'u32'), ("tnvmcap", 280, 'u128'), ("unvmcap", 296, 'u128'),
+    ("rpmbs", 312, 'u32'), ("edstt", 316, 'u16'), ("dsto", 318, 'u8'), ("fwug", 319, 'u8'),
+    ("kas", 320, 'u16'), ("hctma", 322, 'u16'), ("mntmt", 324, 'u16'), ("mxtmt", 326, 'u16'),
+    ("sanicap", 328, 'u32'), ("hmminds", 332, 'u32'), ("hmmaxd", 336, 'u16'), ("nsetidmax", 338, 'u16'),
+    ("endgidmax", 340, 'u16'), ("anatt", 342, 'u8'), ("anacap", 343, 'u8'), ("anagrpmax", 344, 'u32'),
+    ("nanagrpid", 348, 'u32'), ("pels", 352, 'u32'), ("domainid", 356, 'u16'), ("megcap", 368, 'u128'),
+    ("sqes", 512, 'u8'), ("cqes", 513, 'u8'), ("maxcmd", 514, 'u16'), ("nn", 516, 'u32'),
+    ("oncs", 520, 'u16'), ("fuses", 522, 'u16'), ("fna", 524, 'u8'), ("vwc", 525, 'u8'),
+    ("awun", 526, 'u16'), ("awupf", 528, 'u16'), ("icsvscc", 530, 'u8'), ("nwpc", 531, 'u8'),
+    ("acwu", 532, 'u16'), ("ocfs", 534, 'u16'), ("sgls", 536, 'u32'), ("mnan", 540, 'u32'),
+    ("maxdna", 544, 'u128'), ("maxcna", 560, 'u32'), ("oaqd", 564, 'u32'), ("subnqn", 768, 'str', 256),
+    ("ioccsz", 1792, 'u32'), ("iorcsz", 1796, 'u32'), ("icdoff", 1800, 'u16'), ("fcatt", 1802, 'u8'),
+    ("msdbd", 1803, 'u8'), ("ofcs", 1804, 'u16'),
+)
+
+ID_CTRL_LAYOUT = Layout("IdentifyController", NVME_IDENTIFY_DATA_SIZE, fields(_ID_CTRL_ROWS) + [
+    Array("psds", NVME_ID_CTRL_PSD_OFFSET, PSD_LAYOUT, count="npss", count_bias=1, max_count=32),
+])
+
+## LBA format descriptor (4 bytes), keys as printed by nvme-cli under "lbafs"
+LBAF_LAYOUT = Layout("LBAFormat", 4, [
+    Field("ms", 0, 'u16'),
+    Field("ds", 2, 'u8'),
+    Field("rp", 3, 'u8', bits=(0, 2)),
+])
+
+ID_NS_LAYOUT = Layout("IdentifyNamespace", NVME_IDENTIFY_DATA_SIZE, fields((
+    ("nsze", 0, 'u64'), ("ncap", 8, 'u64'), ("nuse", 16, 'u64'), ("nsfeat", 24, 'u8'),
+    ("nlbaf", 25, 'u8'), ("flbas", 26, 'u8'), ("mc", 27, 'u8'), ("dpc", 28, 'u8'),
+    ("dps", 29, 'u8'), ("nmic", 30, 'u8'), ("rescap", 31, 'u8'), ("fpi", 32, 'u8'),
+    ("dlfeat", 33, 'u8'), ("nawun", 34, 'u16'), ("nawupf", 36, 'u16'), ("nacwu", 38, 'u16'),
+    ("nabsn", 40, 'u16'), ("nabo", 42, 'u16'), ("nabspf", 44, 'u16'), ("noiob", 46, 'u16'),
+    ("nvmcap", 48, 'u128'), ("npwg", 64, 'u16'), ("npwa", 66, 'u16'), ("npdg", 68, 'u16'),
+    ("npda", 70, 'u16'), ("nows", 72, 'u16'), ("mssrl", 74, 'u16'), ("mcl", 76, 'u32'),
+    ("msrc", 80, 'u8'), ("anagrpid", 92, 'u32'), ("nsattr", 99, 'u8'), ("nvmsetid", 100, 'u16'),
+    ("endgid", 102, 'u16'), ("nguid", 104, 'hex', 16), ("eui64", 120, 'hex', 8),
+)) + [
+    # Index of the LBA format in use (flbas bits 3:0); not part of nvme-cli's JSON
+    Field("lbaf", 26, 'u8', bits=(0, 4), hidden=True),
+    Array("lbafs", 128, LBAF_LAYOUT, count="nlbaf", count_bias=1, max_count=64),
+])
+
+## @class IdentifyController
+#  Lazy, zero-copy view over an Identify Controller buffer (bytes, bytearray,
+#  mmap or memoryview). Fields are reachable as `idc["mn"]`, `idc.get("mn")` or
+#  `idc.mn`; `psds` holds the npss+1 power state descriptors.
+IdentifyController = ID_CTRL_LAYOUT.record
+
+## @class IdentifyNamespace
+#  Same kind of view over Identify Namespace data; `lbaf` is the active LBA
+#  format index and `lbafs` the nlbaf+1 supported formats.
+IdentifyNamespace = ID_NS_LAYOUT.record
@@ -0,0 +1,227 @@
+#!/bin/env python3.9
+import struct
+
+## @file nvme_layouts.py
+#  Declarative layouts for NVMe data structures.
+#
+#  A Layout lists each field once (offset, kind, optional bitfield, arrays of
+#  sub-structures) and is compiled at import into a record class: one property
+#  per field bound to a precompiled struct.Struct, and `__slots__ = ('_buf',)`.
+#  A record is a zero-copy view over a buffer; a field is decoded only when it
+#  is read, so parsing cost does not grow with the number of fields described.
+#
+#  Field kinds:
+#  - 'u8', 'u16', 'u32', 'u64'      little-endian unsigned integers
+#  - 'u24', 'u128'                   odd-width integers (e.g. IEEE OUI, capacities)
+#  - 'str'  (size)                   ASCII, cut at the first NUL (as nvme-cli prints it)
+#  - 'hex'  (size)                   lowercase hex string (nguid, eui64)
+#  - 'uuid'                          16 bytes as 8-4-4-4-12 hex
+#  - 'bytes' (size)                  raw bytes
+
+_STRUCT_CODES = {'u8': 'B', 'u16': 'H', 'u32': 'I', 'u64': 'Q'}
+_SIZES = {'u8': 1, 'u16': 2, 'u24': 3, 'u32': 4, 'u64': 8, 'u128': 16, 'uuid': 16}
+
+
+## @class Field
+#  One field of a layout. `bits=(shift, width)` makes it a bitfield of the
+#  integer at `offset`; `hidden` fields are decodable but left out of keys().
+class Field:
+    __slots__ = ("name", "offset", "kind", "size", "bits", "hidden")
+
+    def __init__(self, name, offset, kind, size=None, bits=None, hidden=False):
+        self.name = name
+        self.offset = offset
+        self.kind = kind
+        self.size = size if size is not None else _SIZES[kind]
+        self.bits = bits
+        self.hidden = hidden
+
+    def getter(self):
+        off, size = self.offset, self.size
+        kind = self.kind
+        if kind in _STRUCT_CODES:
+            unpack_from = struct.Struct('<' + _STRUCT_CODES[kind]).unpack_from
+            if self.bits:
+                shift, mask = self.bits[0], (1 << self.bits[1]) - 1
+                return lambda rec: (unpack_from(rec._buf, off)[0] >> shift) & mask
+            return lambda rec: unpack_from(rec._buf, off)[0]
+        if kind in ('u24', 'u128'):
+            return lambda rec: int.from_bytes(rec._buf[off:off + size], 'little')
+        if kind == 'str':
+            return lambda rec: bytes(rec._buf[off:off + size]).split(b'\0', 1)[0].decode('ascii', 'replace')
+        if kind == 'hex':
+            return lambda rec: bytes(rec._buf[off:off + size]).hex()
+        if kind == 'uuid':
+            def uuid(rec):
+                h = bytes(rec._buf[off:off + 16]).hex()
+                return f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+            return uuid
+        if kind == 'bytes':
+            return lambda rec: bytes(rec._buf[off:off + size])
+        raise ValueError(f"Unknown field kind {kind!r} for {self.name}")
+
+    def pack_into(self, buf, base, value):
+        off = base + self.offset
+        kind = self.kind
+        if kind in _STRUCT_CODES:
+            st = struct.Struct('<' + _STRUCT_CODES[kind])
+            if self.bits:
+                shift, mask = self.bits[0], (1 << self.bits[1]) - 1
+                current = st.unpack_from(buf, off)[0] & ~(mask << shift)
+                value = current | ((value & mask) << shift)
+            st.pack_into(buf, off, value)
+        elif kind in ('u24', 'u128'):
+            buf[off:off + self.size] = value.to_bytes(self.size, 'little')
+        elif kind == 'str':
+            raw = value.encode('ascii')[:self.size]
+            buf[off:off + self.size] = raw.ljust(self.size, b'\0')
+        elif kind in ('hex', 'uuid'):
+            raw = bytes.fromhex(value.replace('-', '').ljust(self.size * 2, '0'))
+            buf[off:off + self.size] = raw[:self.size]
+        else:
+            buf[off:off + self.size] = bytes(value)[:self.size].ljust(self.size, b'\0')
+
+
+## @class Array
+#  A run of sub-structures (e.g. power state descriptors, LBA formats).
+#  `count` is either a fixed number or the name of a field holding it;
+#  `count_bias` corrects 0-based counts such as npss or nlbaf, and `max_count`
+#  bounds the region a variable-length array may occupy.
+class Array:
+    __slots__ = ("name", "offset", "layout", "count", "stride", "count_bias", "max_count", "hidden")
+
+    def __init__(self, name, offset, layout, count, stride=None, count_bias=0, max_count=None, hidden=False):
+        self.name = name
+        self.offset = offset
+        self.layout = layout
+        self.count = count
+        self.stride = stride or layout.size
+        self.count_bias = count_bias
+        self.max_count = count if isinstance(count, int) else max_count
+        self.hidden = hidden
+
+    @property
+    def max_size(self):
+        return self.stride * (self.max_count or 0)
+
+    def getter(self):
+        off, stride, size = self.offset, self.stride, self.layout.size
+        record = self.layout.record
+        bias = self.count_bias
+        if isinstance(self.count, int):
+            count = self.count
+            return lambda rec: [record(rec._buf[off + i * stride:off + i * stride + size]) for i in range(count)]
+        count_name = self.count
+
+        def items(rec):
+            n = getattr(rec, count_name) + bias
+            return [record(rec._buf[off + i * stride:off + i * stride + size]) for i in range(n)]
+        return items
+
+    def pack_into(self, buf, base, values):
+        for i, value in enumerate(values):
+            self.layout.pack(value, buf, base + self.offset + i * self.stride)
+
+
+## @class Record
+#  Base of every compiled record class: a zero-copy view over one structure.
+class Record:
+    __slots__ = ("_buf",)
+    _layout = None
+
+    def __init__(self, data):
+        buf = memoryview(data)
+        if buf.format != 'B':
+            buf = buf.cast('B')
+        if buf.nbytes < self._layout.size:
+            raise ValueError(f"{self._layout.name} data is {buf.nbytes} bytes, expected {self._layout.size}")
+        self._buf = buf
+
+    def __getitem__(self, name):
+        if name not in self._layout.index:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self._layout.index
+
+    def get(self, name, default=None):
+        if name not in self._layout.index:
+            return default
+        return getattr(self, name)
+
+    def keys(self):
+        return self._layout.keys
+
+    @property
+    def raw(self):
+        """The underlying memoryview (no copy)."""
+        return self._buf
+
+    def to_dict(self):
+        """Decode every visible field; arrays become lists of dicts."""
+        out = {}
+        for name in self._layout.keys:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = [item.to_dict() for item in value]
+            out[name] = value
+        return out
+
+    def __eq__(self, other):
+        # Records compare equal to the nvme-cli JSON dict they decode to
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        if isinstance(other, Record):
+            return self._layout is other._layout and self._buf[:self._layout.size] == other._buf[:other._layout.size]
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self._layout.name}({self.to_dict()})"
+
+
+## @class Layout
+#  Named, fixed-size NVMe structure. Compiling it builds `self.record`, a
+#  Record subclass with one property per field.
+class Layout:
+    def __init__(self, name, size, fields):
+        self.name = name
+        self.size = size
+        self.fields = list(fields)
+        self.index = {f.name: f for f in self.fields}
+        self.keys = [f.name for f in self.fields if not f.hidden]
+        namespace = {"__slots__": (), "_layout": self}
+        for f in self.fields:
+            namespace[f.name.replace('-', '_')] = property(f.getter())
+        self.record = type(name, (Record,), namespace)
+        # Names that are not identifiers (e.g. "non-operational_state") stay reachable via rec[name]
+        for f in self.fields:
+            if f.name != f.name.replace('-', '_'):
+                setattr(self.record, f.name, getattr(self.record, f.name.replace('-', '_')))
+
+    def view(self, data):
+        return self.record(data)
+
+    def span(self, name):
+        """`(offset, size)` of a field inside the structure."""
+        f = self.index[name]
+        if isinstance(f, Array):
+            return f.offset, f.max_size
+        return f.offset, f.size
+
+    def pack(self, values, buf=None, offset=0):
+        """Encode a dict of field values (missing fields stay zero) into `buf`."""
+        if buf is None:
+            buf = bytearray(self.size)
+        for name, value in values.items():
+            f = self.index.get(name)
+            if f is not None:
+                f.pack_into(buf, offset, value)
+        return buf
+
+
+## @brief Build a list of Field objects from compact `(name, offset, kind[, size])` rows.
+def fields(rows):
+    return [Field(*row) for row in rows]
@@ -0,0 +1,45 @@
+#!/bin/env python3.9
+from Test.nvme_layouts import Layout, fields
+
+## @file nvme_log.py
+#  Log page layouts, using the same field names as `nvme smart-log -o json`.
+
+NVME_ADMIN_GET_LOG_PAGE = 0x02
+
+# Log page identifiers (cdw10 bits 7:0)
+NVME_LOG_ERROR = 0x01
+NVME_LOG_SMART = 0x02
+NVME_LOG_FW_SLOT = 0x03
+
+NVME_SMART_LOG_SIZE = 512
+
+## SMART / Health Information (LID 02h). Temperatures are in Kelvin; the
+#  16-byte counters are decoded as exact Python ints.
+SMART_LOG_LAYOUT = Layout("SmartLog", NVME_SMART_LOG_SIZE, fields((
+    ("critical_warning", 0, 'u8'), ("temperature", 1, 'u16'), ("avail_spare", 3, 'u8'),
+    ("spare_thresh", 4, 'u8'), ("percent_used", 5, 'u8'),
+    ("endurance_grp_critical_warning_summary", 6, 'u8'),
+    ("data_units_read", 32, 'u128'), ("data_units_written", 48, 'u128'),
+    ("host_read_commands", 64, 'u128'), ("host_write_commands", 80, 'u128'),
+    ("controller_busy_time", 96, 'u128'), ("power_cycles", 112, 'u128'),
+    ("power_on_hours", 128, 'u128'), ("unsafe_shutdowns", 144, 'u128'),
+    ("media_errors", 160, 'u128'), ("num_err_log_entries", 176, 'u128'),
+    ("warning_temp_time", 192, 'u32'), ("critical_comp_time", 196, 'u32'),
+    ("temperature_sensor_1", 200, 'u16'), ("temperature_sensor_2", 202, 'u16'),
+    ("temperature_sensor_3", 204, 'u16'), ("temperature_sensor_4", 206, 'u16'),
+    ("temperature_sensor_5", 208, 'u16'), ("temperature_sensor_6", 210, 'u16'),
+    ("temperature_sensor_7", 212, 'u16'), ("temperature_sensor_8", 214, 'u16'),
+    ("thm_temp1_trans_count", 216, 'u32'), ("thm_temp2_trans_count", 220, 'u32'),
+    ("thm_temp1_total_time", 224, 'u32'), ("thm_temp2_total_time", 228, 'u32'),
+)))
+
+## @class SmartLog
+#  Lazy, zero-copy view over a 512-byte SMART / Health log page.
+SmartLog = SMART_LOG_LAYOUT.record
+
+## Firmware Slot Information (LID 03h)
+FW_SLOT_LOG_LAYOUT = Layout("FirmwareSlotLog", 512, fields((
+    ("afi", 0, 'u8'),
+    ("frs1", 8, 'str', 8), ("frs2", 16, 'str', 8), ("frs3", 24, 'str', 8), ("frs4", 32, 'str', 8),
+    ("frs5", 40, 'str', 8), ("frs6", 48, 'str', 8), ("frs7", 56, 'str', 8),
+)))
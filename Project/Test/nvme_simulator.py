@@ -0,0 +1,394 @@
+#!/bin/env python3.9
+import os
+import struct
+import threading
+import time
+import logging
+from Test.admin_passthru_wrapper import (
+    AdminCommandSet, AdminCompletion, NVME_ADMIN_GET_FEATURES, NVME_ADMIN_SET_FEATURES, NVME_FEAT_TEMP_THRESH,
+    NVME_NSID_ALL
+)
+from Test.io_engine import ThreadPoolIOEngine
+from Test.latency import metrics
+from Test.io_passthru_wrapper import NvmeIOError, NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_identify import (
+    ID_CTRL_LAYOUT, ID_NS_LAYOUT, NVME_ADMIN_IDENTIFY, NVME_ID_CNS_NS, NVME_ID_CNS_CTRL, NVME_ID_CNS_NS_ACTIVE_LIST
+)
+from Test.nvme_topology import (
+    NAMESPACE_CHANGING_OPCODES, NVME_ADMIN_FORMAT_NVM, NVME_ADMIN_NS_ATTACH, NVME_ADMIN_NS_MGMT, namespace_changed
+)
+from Test.nvme_log import (
+    FW_SLOT_LOG_LAYOUT, NVME_ADMIN_GET_LOG_PAGE, NVME_LOG_ERROR, NVME_LOG_FW_SLOT, NVME_LOG_SMART, SMART_LOG_LAYOUT
+)
+
+## @file nvme_simulator.py
+#  In-process software NVMe controller for hardware-free runs.
+#
+#  SimulatedController answers the same interface as AdminPassthruWrapper
+#  (execute, send_passthru_cmd, open_io_engine, last_status/last_result) and
+#  backs its namespaces with a sparse in-memory LBA store, so the Activity
+#  tests and TestManager can run in CI without /dev/nvme0.
+
+# Status codes as returned by the Linux passthru ioctl ((SCT << 8) | SC)
+NVME_SC_SUCCESS = 0x000
+NVME_SC_INVALID_OPCODE = 0x001
+NVME_SC_INVALID_FIELD = 0x002
+NVME_SC_INVALID_NS = 0x00B
+NVME_SC_LBA_RANGE = 0x080
+NVME_SC_NS_INSUFFICIENT_CAP = 0x115
+NVME_SC_NS_ALREADY_ATTACHED = 0x118
+NVME_SC_NS_NOT_ATTACHED = 0x11A
+NVME_SC_INVALID_FORMAT = 0x10A
+
+KELVIN = 273
+SIMULATED_MDTS = 5  # 128 KiB per command with 4 KiB pages
+
+
+## @class SimulatedNamespace
+#  One namespace: geometry, attachment state and a sparse LBA -> block store.
+class SimulatedNamespace:
+    def __init__(self, nsid, nsze, ncap, flbas=0, dps=0):
+        self.nsid = nsid
+        self.nsze = nsze
+        self.ncap = ncap
+        self.flbas = flbas
+        self.dps = dps
+        self.attached = False
+        self.blocks = {}
+
+    @property
+    def nuse(self):
+        return len(self.blocks)
+
+
+## @class SimulatedNamespaceIO
+#  I/O path of one simulated namespace, with the read()/write() surface of
+#  IOPassthruWrapper so it can back a ThreadPoolIOEngine.
+class SimulatedNamespaceIO:
+    def __init__(self, controller, nsid, max_blocks=1):
+        self.controller = controller
+        self.nsid = nsid
+        self.max_blocks = max_blocks
+
+    def read(self, slba, nlb=1):
+        status, data = self.controller.submit_io(NVME_CMD_READ, self.nsid, slba, nlb)
+        if status:
+            raise NvmeIOError("read", slba, status)
+        return memoryview(data)
+
+    def write(self, slba, nlb=1, data=None):
+        status, _ = self.controller.submit_io(NVME_CMD_WRITE, self.nsid, slba, nlb, data)
+        if status:
+            raise NvmeIOError("write", slba, status)
+
+    def close(self):
+        pass
+
+
+## @class SimulatedController
+#  Software NVMe controller answering Identify, Get Log Page (error, SMART,
+#  firmware slot), Get/Set Features, Namespace Management/Attachment,
+#  Format NVM and NVM Read/Write.
+#
+#  SMART counters follow the spec: data units are thousands of 512-byte units
+#  rounded up, command counters count completed commands, power-on hours run
+#  from `power_on_hours` at creation and temperature rises with I/O load.
+class SimulatedController(AdminCommandSet):
+    def __init__(self, device_path="/dev/nvme0", serial=None, model="NVME SIMULATOR",
+                 firmware="SIM10100", capacity_blocks=1 << 24, lba_formats=((0, 12, 0), (0, 9, 1)),
+                 num_namespaces=1, power_on_hours=0, temperature=35, id_ctrl=None, logger=None):
+        self.device_path = device_path
+        self.logger = logger or logging.getLogger(__name__)
+        # Default serial follows the device name, so simulated drives stay distinguishable
+        self.serial = serial or "SIM" + os.path.basename(device_path).upper()
+        self.model = model
+        self.firmware = firmware
+        self.id_ctrl = dict(id_ctrl or {})  # Identify Controller field overrides (nvme-cli names)
+        self.capacity_blocks = capacity_blocks
+        self.lba_formats = list(lba_formats)  # (ms, lbads, rp) per LBA format
+        self.max_namespaces = 128
+        self.namespaces = {}
+        self.features = {NVME_FEAT_TEMP_THRESH: KELVIN + 85}
+        self.under_temp_threshold = 0
+        self.last_status = 0
+        self.last_result = 0
+        self._lock = threading.RLock()
+        self._created = time.monotonic()
+        self._base_power_on_hours = power_on_hours
+        self._ambient = KELVIN + temperature
+        self._heat = 0.0
+        self._heat_stamp = time.monotonic()
+        self.smart = {
+            "bytes_read": 0, "bytes_written": 0,
+            "host_read_commands": 0, "host_write_commands": 0,
+            "controller_busy_time": 0.0, "power_cycles": 1,
+            "unsafe_shutdowns": 0, "media_errors": 0, "num_err_log_entries": 0,
+            "avail_spare": 100, "spare_thresh": 10, "percent_used": 0,
+        }
+        for nsid in range(1, num_namespaces + 1):
+            ns = SimulatedNamespace(nsid, capacity_blocks // num_namespaces, capacity_blocks // num_namespaces)
+            ns.attached = True
+            self.namespaces[nsid] = ns
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # ------------------------------------------------------------------ admin
+
+    ## @brief Same contract as AdminPassthruWrapper.execute. Metadata is
+    #  returned zeroed and timeouts are not simulated.
+    def execute(self, command, copy=True):
+        opcode, data_len = command.opcode, command.data_len
+        handler = self._ADMIN_HANDLERS.get(opcode)
+        started = time.perf_counter_ns()
+        with self._lock:
+            if handler is None:
+                status, result, payload = NVME_SC_INVALID_OPCODE, 0, b""
+            else:
+                status, result, payload = handler(self, command.nsid, command.cdw10, command.cdw11, command.cdw12,
+                                                  command.cdw13, command.data)
+            self.last_status = status
+            self.last_result = result
+        metrics.record(self.device_path, "admin", opcode, time.perf_counter_ns() - started, data_len, status != 0)
+        if status:
+            return AdminCompletion(status, result)
+        if opcode in NAMESPACE_CHANGING_OPCODES:
+            namespace_changed(self.device_path)
+        out = bytearray(data_len)
+        payload = payload[:data_len]
+        out[:len(payload)] = payload
+        metadata = bytes(command.metadata_len) if command.metadata_len else None
+        return AdminCompletion(status, result, bytes(out) if copy else memoryview(out), metadata)
+
+    ## @brief Simulated namespaces change synchronously: nothing to wait for.
+    def wait_namespace(self, nsid, present=True, lba_size=None, timeout=30.0):
+        return None
+
+    def _identify(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        cns = cdw10 & 0xFF
+        if cns == NVME_ID_CNS_CTRL:
+            return NVME_SC_SUCCESS, 0, self._identify_controller()
+        if cns == NVME_ID_CNS_NS:
+            ns = self.namespaces.get(nsid)
+            if nsid == 0 or (ns is None and nsid != NVME_NSID_ALL and nsid > self.max_namespaces):
+                return NVME_SC_INVALID_NS, 0, b""
+            # Inactive or unallocated namespaces report an all-zero structure
+            return NVME_SC_SUCCESS, 0, self._identify_namespace(ns) if ns and ns.attached else bytes(4096)
+        if cns == NVME_ID_CNS_NS_ACTIVE_LIST:
+            active = sorted(n for n, ns in self.namespaces.items() if ns.attached and n > nsid)[:1024]
+            return NVME_SC_SUCCESS, 0, struct.pack(f"<{len(active)}I", *active)
+        return NVME_SC_INVALID_FIELD, 0, b""
+
+    def _identify_controller(self):
+        capacity = self.capacity_blocks << 12
+        used = sum(ns.nsze for ns in self.namespaces.values()) << 12
+        values = {
+            "vid": 0x1B96, "ssvid": 0x1B96,
+            "sn": self.serial.ljust(20), "mn": self.model.ljust(40), "fr": self.firmware.ljust(8),
+            "mdts": SIMULATED_MDTS, "ver": 0x00010400, "cntrltype": 1,
+            "oacs": 0x0008 | 0x0002,                  # namespace management + format
+            "acl": 3, "aerl": 3, "lpa": 0x0E, "elpe": 63, "npss": 0,
+            "wctemp": KELVIN + 70, "cctemp": KELVIN + 80,
+            "tnvmcap": capacity, "unvmcap": capacity - used,
+            "sqes": 0x66, "cqes": 0x44, "nn": self.max_namespaces, "oncs": 0x0004,
+            "subnqn": f"nqn.2024-01.io.simulator:{self.serial.strip()}",
+            "psds": [{"max_power": 900, "entry_lat": 5, "exit_lat": 5}],
+        }
+        values.update(self.id_ctrl)
+        return ID_CTRL_LAYOUT.pack(values)
+
+    def _identify_namespace(self, ns):
+        lbads = self.lba_formats[ns.flbas & 0x0F][1]
+        return ID_NS_LAYOUT.pack({
+            "nsze": ns.nsze, "ncap": ns.ncap, "nuse": ns.nuse,
+            "nlbaf": len(self.lba_formats) - 1, "flbas": ns.flbas, "dps": ns.dps,
+            "nvmcap": ns.nsze << lbads,
+            "lbafs": [{"ms": ms, "ds": ds, "rp": rp} for ms, ds, rp in self.lba_formats],
+        })
+
+    def _temperature(self):
+        # First-order thermal model: I/O adds heat, which decays with a ~10 s constant
+        now = time.monotonic()
+        self._heat *= 0.5 ** ((now - self._heat_stamp) / 10.0)
+        self._heat_stamp = now
+        return int(self._ambient + min(self._heat, 40.0))
+
+    def _smart_log(self):
+        s = self.smart
+        temperature = self._temperature()
+        critical_warning = 0
+        if s["avail_spare"] < s["spare_thresh"]:
+            critical_warning |= 0x01
+        if temperature >= self.features[NVME_FEAT_TEMP_THRESH] or temperature < self.under_temp_threshold:
+            critical_warning |= 0x02
+        power_on_hours = self._base_power_on_hours + int((time.monotonic() - self._created) // 3600)
+        return SMART_LOG_LAYOUT.pack({
+            "critical_warning": critical_warning,
+            "temperature": temperature,
+            "avail_spare": s["avail_spare"],
+            "spare_thresh": s["spare_thresh"],
+            "percent_used": s["percent_used"],
+            "data_units_read": -(-s["bytes_read"] // 512000),        # thousands of 512 B units, rounded up
+            "data_units_written": -(-s["bytes_written"] // 512000),
+            "host_read_commands": s["host_read_commands"],
+            "host_write_commands": s["host_write_commands"],
+            "controller_busy_time": int(s["controller_busy_time"] // 60),
+            "power_cycles": s["power_cycles"],
+            "power_on_hours": power_on_hours,
+            "unsafe_shutdowns": s["unsafe_shutdowns"],
+            "media_errors": s["media_errors"],
+            "num_err_log_entries": s["num_err_log_entries"],
+            "temperature_sensor_1": temperature,
+        })
+
+    def _get_log_page(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        lid = cdw10 & 0xFF
+        numd = ((cdw10 >> 16) | ((cdw11 & 0xFFFF) << 16)) + 1
+        offset = cdw12 | (cdw13 << 32)
+        if lid == NVME_LOG_SMART:
+            page = self._smart_log()
+        elif lid == NVME_LOG_ERROR:
+            page = bytes(64)
+        elif lid == NVME_LOG_FW_SLOT:
+            page = FW_SLOT_LOG_LAYOUT.pack({"afi": 0x01, "frs1": self.firmware.ljust(8)})
+        else:
+            return NVME_SC_INVALID_FIELD, 0, b""
+        return NVME_SC_SUCCESS, 0, bytes(page[offset:offset + numd * 4])
+
+    def _get_features(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        fid = cdw10 & 0xFF
+        if fid == NVME_FEAT_TEMP_THRESH:
+            under = (cdw11 >> 20) & 0x3 == 1
+            return NVME_SC_SUCCESS, self.under_temp_threshold if under else self.features[fid], b""
+        return NVME_SC_SUCCESS, self.features.get(fid, 0), b""
+
+    def _set_features(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        fid = cdw10 & 0xFF
+        if fid == NVME_FEAT_TEMP_THRESH:
+            thsel = (cdw11 >> 20) & 0x3
+            if thsel > 1:
+                return NVME_SC_INVALID_FIELD, 0, b""
+            if thsel == 1:
+                self.under_temp_threshold = cdw11 & 0xFFFF
+            else:
+                self.features[fid] = cdw11 & 0xFFFF
+            return NVME_SC_SUCCESS, 0, b""
+        self.features[fid] = cdw11
+        return NVME_SC_SUCCESS, 0, b""
+
+    def _ns_mgmt(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        sel = cdw10 & 0xF
+        if sel == 0:                                                     # create
+            if data is None:
+                return NVME_SC_INVALID_FIELD, 0, b""
+            nsze, ncap = struct.unpack_from("<QQ", data, 0)
+            flbas, dps = data[26], data[29]
+            if (flbas & 0x0F) >= len(self.lba_formats):
+                return NVME_SC_INVALID_FORMAT, 0, b""
+            used = sum(ns.nsze for ns in self.namespaces.values())
+            if nsze == 0 or ncap > nsze or used + nsze > self.capacity_blocks:
+                return NVME_SC_NS_INSUFFICIENT_CAP, 0, b""
+            new_id = next(n for n in range(1, self.max_namespaces + 1) if n not in self.namespaces)
+            self.namespaces[new_id] = SimulatedNamespace(new_id, nsze, ncap, flbas, dps)
+            return NVME_SC_SUCCESS, new_id, b""
+        if sel == 1:                                                     # delete
+            if nsid == NVME_NSID_ALL:
+                self.namespaces.clear()
+            elif self.namespaces.pop(nsid, None) is None:
+                return NVME_SC_INVALID_NS, 0, b""
+            return NVME_SC_SUCCESS, 0, b""
+        return NVME_SC_INVALID_FIELD, 0, b""
+
+    def _ns_attach(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        sel = cdw10 & 0xF
+        ns = self.namespaces.get(nsid)
+        if ns is None:
+            return NVME_SC_INVALID_NS, 0, b""
+        if sel == 0:
+            if ns.attached:
+                return NVME_SC_NS_ALREADY_ATTACHED, 0, b""
+            ns.attached = True
+        elif sel == 1:
+            if not ns.attached:
+                return NVME_SC_NS_NOT_ATTACHED, 0, b""
+            ns.attached = False
+        else:
+            return NVME_SC_INVALID_FIELD, 0, b""
+        return NVME_SC_SUCCESS, 0, b""
+
+    def _format_nvm(self, nsid, cdw10, cdw11, cdw12, cdw13, data):
+        lbaf = cdw10 & 0x0F
+        pi = (cdw10 >> 5) & 0x7
+        if lbaf >= len(self.lba_formats):
+            return NVME_SC_INVALID_FORMAT, 0, b""
+        targets = list(self.namespaces.values()) if nsid == NVME_NSID_ALL else [self.namespaces.get(nsid)]
+        if None in targets:
+            return NVME_SC_INVALID_NS, 0, b""
+        for ns in targets:
+            ns.flbas = (ns.flbas & 0xF0) | lbaf
+            ns.dps = pi
+            ns.blocks.clear()
+        return NVME_SC_SUCCESS, 0, b""
+
+    _ADMIN_HANDLERS = {
+        NVME_ADMIN_GET_LOG_PAGE: _get_log_page,
+        NVME_ADMIN_IDENTIFY: _identify,
+        NVME_ADMIN_SET_FEATURES: _set_features,
+        NVME_ADMIN_GET_FEATURES: _get_features,
+        NVME_ADMIN_NS_MGMT: _ns_mgmt,
+        NVME_ADMIN_NS_ATTACH: _ns_attach,
+        NVME_ADMIN_FORMAT_NVM: _format_nvm,
+    }
+
+    # --------------------------------------------------------------------- io
+
+    def block_size(self, nsid):
+        ns = self.namespaces[nsid]
+        return 1 << self.lba_formats[ns.flbas & 0x0F][1]
+
+    ## @brief Execute one NVM Read/Write; returns `(status, data)`.
+    def submit_io(self, opcode, nsid, slba, nlb, data=None):
+        with self._lock:
+            ns = self.namespaces.get(nsid)
+            if ns is None or not ns.attached:
+                return NVME_SC_INVALID_NS, None
+            if slba + nlb > ns.nsze:
+                return NVME_SC_LBA_RANGE, None
+            bs = self.block_size(nsid)
+            mdts = self.id_ctrl.get("mdts", SIMULATED_MDTS)
+            if mdts and nlb * bs > 4096 << mdts:
+                return NVME_SC_INVALID_FIELD, None  # larger than MDTS allows
+            started = time.perf_counter()
+            if opcode == NVME_CMD_READ:
+                zero = bytes(bs)
+                out = b"".join(ns.blocks.get(lba, zero) for lba in range(slba, slba + nlb))
+                self.smart["host_read_commands"] += 1
+                self.smart["bytes_read"] += nlb * bs
+            elif opcode == NVME_CMD_WRITE:
+                payload = bytes(data[:nlb * bs]) if data is not None else b""
+                payload = payload.ljust(nlb * bs, b"\x00")
+                for i in range(nlb):
+                    ns.blocks[slba + i] = payload[i * bs:(i + 1) * bs]
+                out = None
+                self.smart["host_write_commands"] += 1
+                self.smart["bytes_written"] += nlb * bs
+            else:
+                return NVME_SC_INVALID_OPCODE, None
+            self._heat += 0.01 * nlb
+            self.smart["controller_busy_time"] += time.perf_counter() - started
+            return NVME_SC_SUCCESS, out
+
+    def io(self, nsid=1, max_blocks=1):
+        return SimulatedNamespaceIO(self, nsid, max_blocks)
+
+    ## @brief Same contract as AdminPassthruWrapper.open_io_engine.
+    def open_io_engine(self, nsid=1, queue_depth=32, block_size=4096, max_blocks=1):
+        return ThreadPoolIOEngine(f"{self.device_path}n{nsid}", queue_depth, block_size, max_blocks,
+                                  logger=self.logger, io_factory=lambda: self.io(nsid, max_blocks))
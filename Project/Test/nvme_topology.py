@@ -0,0 +1,266 @@
+#!/bin/env python3.9
+import os
+import re
+import threading
+import time
+
+## @file nvme_topology.py
+#  NVMe controller / namespace discovery from sysfs.
+#
+#  One pass over /sys/class/nvme builds a serial -> controller -> namespace
+#  map (no `nvme list` process per lookup). The map is cached for the process
+#  and dropped whenever a namespace is created, deleted, attached, detached or
+#  formatted: the passthru layer calls `namespace_changed()` after such a
+#  command, and other caches (e.g. namespace geometry) can subscribe to the
+#  same notification with `on_namespace_change()`.
+
+SYSFS_NVME = "/sys/class/nvme"
+SYSFS_NVME_SUBSYSTEM = "/sys/class/nvme-subsystem"
+
+# Admin opcodes that change the namespace layout of a controller
+NVME_ADMIN_NS_MGMT = 0x0D
+NVME_ADMIN_NS_ATTACH = 0x15
+NVME_ADMIN_FORMAT_NVM = 0x80
+NAMESPACE_CHANGING_OPCODES = frozenset((NVME_ADMIN_NS_MGMT, NVME_ADMIN_NS_ATTACH, NVME_ADMIN_FORMAT_NVM))
+
+_CTRL_RE = re.compile(r"nvme(\d+)$")
+# nvme0n1, or nvme0c0n1 for a path of a multipath namespace
+_NS_RE = re.compile(r"nvme(\d+)(?:c(\d+))?n(\d+)$")
+
+
+def _read(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+## @class NvmeNamespace
+#  One namespace of a controller as seen by the kernel.
+class NvmeNamespace:
+    __slots__ = ("name", "nsid", "controller", "dev_path", "generic_path", "size_bytes", "lba_size")
+
+    def __init__(self, name, nsid, controller, dev_path, generic_path=None, size_bytes=None, lba_size=None):
+        self.name = name
+        self.nsid = nsid
+        self.controller = controller
+        self.dev_path = dev_path
+        self.generic_path = generic_path
+        self.size_bytes = size_bytes
+        self.lba_size = lba_size
+
+    def __repr__(self):
+        return f"NvmeNamespace({self.dev_path}, nsid={self.nsid}, controller={self.controller})"
+
+
+## @class NvmeController
+#  One controller (/dev/nvmeX) with its identity and namespaces by NSID.
+class NvmeController:
+    __slots__ = ("name", "dev_path", "serial", "model", "firmware", "address", "transport", "state",
+                 "subsystem", "namespaces")
+
+    def __init__(self, name, dev_path, serial=None, model=None, firmware=None, address=None, transport=None,
+                 state=None, subsystem=None):
+        self.name = name
+        self.dev_path = dev_path
+        self.serial = serial
+        self.model = model
+        self.firmware = firmware
+        self.address = address
+        self.transport = transport
+        self.state = state
+        self.subsystem = subsystem
+        self.namespaces = {}
+
+    def namespace(self, nsid=1):
+        return self.namespaces[nsid]
+
+    def __repr__(self):
+        return f"NvmeController({self.dev_path}, serial={self.serial!r}, namespaces={sorted(self.namespaces)})"
+
+
+## @class NvmeTopology
+#  Snapshot of every NVMe controller on the host, indexed by serial and by
+#  controller name. Built by `scan()` from sysfs in a single pass.
+class NvmeTopology:
+    def __init__(self, sysfs_root=SYSFS_NVME, dev_root="/dev", subsystem_root=SYSFS_NVME_SUBSYSTEM):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.subsystem_root = subsystem_root
+        self.by_name = {}
+        self.by_serial = {}
+
+    def _subsystems(self):
+        # Controller name -> subsystem instance (names the multipath head nvme<subsys>n<nsid>)
+        owners = {}
+        try:
+            subsystems = os.listdir(self.subsystem_root)
+        except OSError:
+            return owners
+        for subsys in subsystems:
+            m = re.fullmatch(r"nvme-subsys(\d+)", subsys)
+            if not m:
+                continue
+            try:
+                entries = os.listdir(os.path.join(self.subsystem_root, subsys))
+            except OSError:
+                continue
+            for entry in entries:
+                if _CTRL_RE.match(entry):
+                    owners[entry] = int(m.group(1))
+        return owners
+
+    def scan(self):
+        by_name, by_serial = {}, {}
+        try:
+            names = sorted(os.listdir(self.sysfs_root), key=lambda n: (len(n), n))
+        except OSError:
+            names = []
+        owners = self._subsystems()
+        for name in names:
+            if not _CTRL_RE.match(name):
+                continue
+            base = os.path.join(self.sysfs_root, name)
+            ctrl = NvmeController(
+                name, os.path.join(self.dev_root, name),
+                serial=_read(os.path.join(base, "serial")),
+                model=_read(os.path.join(base, "model")),
+                firmware=_read(os.path.join(base, "firmware_rev")),
+                address=_read(os.path.join(base, "address")),
+                transport=_read(os.path.join(base, "transport")),
+                state=_read(os.path.join(base, "state")),
+                subsystem=owners.get(name),
+            )
+            try:
+                entries = os.listdir(base)
+            except OSError:
+                entries = []
+            for entry in entries:
+                m = _NS_RE.match(entry)
+                if not m:
+                    continue
+                ns_dir = os.path.join(base, entry)
+                nsid = _read(os.path.join(ns_dir, "nsid"))
+                nsid = int(nsid) if nsid else int(m.group(3))
+                if m.group(2) is not None:
+                    # Path of a multipath namespace: I/O goes through the head device
+                    head = f"nvme{ctrl.subsystem if ctrl.subsystem is not None else m.group(1)}n{m.group(3)}"
+                else:
+                    head = entry
+                sectors = _read(os.path.join(ns_dir, "size"))
+                lba_size = _read(os.path.join(ns_dir, "queue", "logical_block_size"))
+                ctrl.namespaces[nsid] = NvmeNamespace(
+                    head, nsid, name, os.path.join(self.dev_root, head),
+                    generic_path=os.path.join(self.dev_root, re.sub(r"^nvme", "ng", head)),
+                    size_bytes=int(sectors) * 512 if sectors else None,
+                    lba_size=int(lba_size) if lba_size else None,
+                )
+            by_name[name] = ctrl
+            if ctrl.serial:
+                # First controller wins for dual-ported drives (same serial twice)
+                by_serial.setdefault(ctrl.serial, ctrl)
+        self.by_name, self.by_serial = by_name, by_serial
+        return self
+
+    def controllers(self):
+        return list(self.by_name.values())
+
+    def controller(self, serial):
+        """Controller of the drive with this serial number (KeyError if absent)."""
+        return self.by_serial[serial]
+
+    def namespace(self, serial, nsid=1):
+        return self.by_serial[serial].namespaces[nsid]
+
+    def find(self, device):
+        """Controller for a path (/dev/nvme0), name (nvme0) or serial; None if unknown."""
+        name = os.path.basename(device)
+        return self.by_name.get(name) or self.by_serial.get(device)
+
+
+_topology = None
+_topology_lock = threading.Lock()
+_listeners = []
+
+
+## @brief Register `callback(device_path)`, called after any namespace change
+#  (`device_path` is the controller, or None when unknown).
+def on_namespace_change(callback):
+    _listeners.append(callback)
+
+
+## @brief Invalidate the cached topology and notify the subscribers.
+def namespace_changed(device_path=None):
+    global _topology
+    with _topology_lock:
+        _topology = None
+    for callback in list(_listeners):
+        callback(device_path)
+
+
+## @brief Cached host topology; scanned on first use and after any namespace change.
+def get_topology(refresh=False):
+    global _topology
+    with _topology_lock:
+        if _topology is None or refresh:
+            _topology = NvmeTopology().scan()
+        return _topology
+
+
+## @brief Controller path for a device spec: a path is returned as is, a
+#  controller name gets /dev/ prepended and anything else is looked up as a
+#  serial number (KeyError if no such drive).
+def resolve_device(spec):
+    spec = str(spec).strip()
+    if spec.startswith(os.sep):
+        return spec
+    if _CTRL_RE.fullmatch(spec) or _NS_RE.fullmatch(spec):
+        return os.path.join("/dev", spec)
+    try:
+        return get_topology().controller(spec).dev_path
+    except KeyError:
+        raise KeyError(f"No NVMe controller with serial {spec!r}") from None
+
+
+## @brief Wait until the host sees namespace `nsid` of a controller the way a
+#  test needs it: listed in sysfs with its block device node created by udev
+#  (and logical block size `lba_size`, when given, e.g. after a Format NVM),
+#  or, with present=False, gone from sysfs. Polls every `interval` seconds so a
+#  create-attach-format cycle continues as soon as the kernel is done.
+#  Returns the NvmeNamespace (None when waiting for removal, or when the
+#  controller is not in sysfs at all, e.g. simulated); TimeoutError after `timeout`.
+def wait_for_namespace(device_path, nsid, present=True, lba_size=None, timeout=30.0, interval=0.02):
+    global _topology
+    name = os.path.basename(device_path)
+    if not os.path.isdir(os.path.join(SYSFS_NVME, name)):
+        return None
+    deadline = time.monotonic() + timeout
+    while True:
+        topology = NvmeTopology().scan()
+        ctrl = topology.by_name.get(name)
+        ns = ctrl.namespaces.get(nsid) if ctrl is not None else None
+        if present:
+            ready = ns is not None and os.path.exists(ns.dev_path) and lba_size in (None, ns.lba_size)
+        else:
+            ready = ns is None
+        if ready:
+            with _topology_lock:
+                _topology = topology
+            return ns
+        if time.monotonic() >= deadline:
+            state = "ready" if present else "removed"
+            raise TimeoutError(f"Namespace {nsid} of {device_path} not {state} after {timeout}s")
+        time.sleep(interval)
+
+
+## @brief Block device of namespace `nsid` of a controller; falls back to
+#  <controller>n<nsid> when the controller is not in sysfs (e.g. simulated).
+def namespace_path(device_path, nsid=1):
+    ctrl = get_topology().find(device_path) if os.path.isdir(SYSFS_NVME) else None
+    if ctrl is not None and nsid not in ctrl.namespaces:
+        # Possibly created behind our back (e.g. by nvme-cli): rescan once
+        ctrl = get_topology(refresh=True).find(device_path)
+    if ctrl is not None and nsid in ctrl.namespaces:
+        return ctrl.namespaces[nsid].dev_path
+    return f"{device_path}n{nsid}"
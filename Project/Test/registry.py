@@ -0,0 +1,225 @@
+#!/bin/env python3.9
+import ast
+import importlib
+import importlib.util
+import os
+import sys
+
+## @file registry.py
+#  Lazy test registry.
+#
+#  Test classes declare a literal `TEST_METADATA` dict. The registry finds them
+#  by parsing the source of the modules in this package (and of modules named
+#  by "nvme_project.tests" entry points) with `ast`, without importing or
+#  running anything; a test module is imported only when its test is loaded.
+#
+#  Metadata keys (all optional except "name"):
+#  - key                 short selector shown in the menu ("1")
+#  - name                display name, also the result key ("Activity test1")
+#  - destructive         destroys data or namespaces (planned after the others)
+#  - requires_passthru   needs an Admin Passthru interface
+#  - features            controller features required, see FEATURE_BITS
+#  - estimated_duration  expected run time in seconds
+#  - options             extra constructor arguments it accepts (e.g. "reference")
+
+ENTRY_POINT_GROUP = "nvme_project.tests"
+METADATA_ATTRIBUTE = "TEST_METADATA"
+
+DEFAULT_METADATA = {
+    "destructive": False,
+    "requires_passthru": False,
+    "features": (),
+    "estimated_duration": 60.0,
+    "options": (),
+}
+
+## Identify Controller bits behind the feature names tests can require: (field, bit)
+FEATURE_BITS = {
+    "security": ("oacs", 0), "format": ("oacs", 1), "firmware": ("oacs", 2), "ns_mgmt": ("oacs", 3),
+    "self_test": ("oacs", 4), "directives": ("oacs", 5), "nvme_mi": ("oacs", 6), "virtualization": ("oacs", 7),
+    "doorbell_buffer": ("oacs", 8), "get_lba_status": ("oacs", 9),
+    "compare": ("oncs", 0), "write_uncorrectable": ("oncs", 1), "dsm": ("oncs", 2), "write_zeroes": ("oncs", 3),
+    "save_select": ("oncs", 4), "reservations": ("oncs", 5), "timestamp": ("oncs", 6), "verify": ("oncs", 7),
+}
+
+
+## @brief Feature names (FEATURE_BITS) a controller supports, from its
+#  Identify Controller data; None when it cannot be read (no passthru).
+def device_features(admin_wrapper):
+    if admin_wrapper is None or not hasattr(admin_wrapper, "identify_controller"):
+        return None
+    idc = admin_wrapper.identify_controller()
+    if idc is None:
+        return None
+    values = {"oacs": idc.oacs, "oncs": idc.oncs}
+    return {name for name, (field, bit) in FEATURE_BITS.items() if values[field] >> bit & 1}
+
+
+## @class TestSpec
+#  A registered test: where it lives and what it declares. `load()` imports
+#  the module and returns the class (once; the import is cached by Python).
+class TestSpec:
+    def __init__(self, module, class_name, metadata, path=None):
+        self.module = module
+        self.class_name = class_name
+        self.path = path
+        self.metadata = dict(DEFAULT_METADATA, **metadata)
+        self.metadata.setdefault("name", class_name)
+
+    @property
+    def name(self):
+        return self.metadata["name"]
+
+    @property
+    def key(self):
+        return self.metadata.get("key")
+
+    def __getattr__(self, item):
+        # destructive, requires_passthru, features, estimated_duration, options
+        try:
+            return self.__dict__["metadata"][item]
+        except KeyError:
+            raise AttributeError(item) from None
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.class_name)
+
+    def __repr__(self):
+        return f"TestSpec({self.module}:{self.class_name}, {self.name!r})"
+
+
+## @brief `TEST_METADATA` of every class in a source file, without importing it.
+def scan_source(path, module):
+    with open(path, 'r') as f:
+        source = f.read()
+    if METADATA_ATTRIBUTE not in source:
+        return []
+    specs = []
+    for node in ast.parse(source, path).body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for stmt in node.body:
+            if (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+                    and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id == METADATA_ATTRIBUTE):
+                specs.append(TestSpec(module, node.name, ast.literal_eval(stmt.value), path))
+    return specs
+
+
+## @brief Metadata of a test class or TestSpec (defaults filled in).
+def metadata_of(test):
+    if isinstance(test, TestSpec):
+        return test.metadata
+    metadata = dict(DEFAULT_METADATA, **getattr(test, METADATA_ATTRIBUTE, {}))
+    metadata.setdefault("name", test.__name__)
+    return metadata
+
+
+# Menu order: numeric keys by value ("2" before "10"), then other keys, then tests without one
+def _menu_order(spec):
+    key = str(spec.key) if spec.key is not None else None
+    if key is None:
+        return 2, 0, "", spec.name
+    if key.isdigit():
+        return 0, int(key), "", spec.name
+    return 1, 0, key, spec.name
+
+
+## @class TestRegistry
+#  Tests found in a package directory and through entry points, in menu order.
+class TestRegistry:
+    def __init__(self, specs=()):
+        self.specs = list(specs)
+
+    @classmethod
+    def scan(cls, package_dir=None, package="Test", entry_points=True):
+        package_dir = package_dir or os.path.dirname(os.path.abspath(__file__))
+        specs = []
+        for filename in sorted(os.listdir(package_dir)):
+            if filename.endswith(".py") and not filename.startswith("_"):
+                specs.extend(scan_source(os.path.join(package_dir, filename), f"{package}.{filename[:-3]}"))
+        if entry_points:
+            specs.extend(cls._entry_point_specs())
+        specs.sort(key=_menu_order)
+        return cls(specs)
+
+    @staticmethod
+    def _entry_point_specs():
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return []
+        eps = entry_points()
+        group = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, "select") else eps.get(ENTRY_POINT_GROUP, [])
+        specs = []
+        for ep in group:
+            module, _, class_name = ep.value.partition(":")
+            try:
+                spec = importlib.util.find_spec(module)
+            except (ImportError, ValueError):
+                spec = None
+            found = []
+            if spec is not None and spec.origin and spec.origin.endswith(".py"):
+                found = [s for s in scan_source(spec.origin, module) if s.class_name == class_name]
+            # Without literal metadata the entry point name is the test name
+            specs.extend(found or [TestSpec(module, class_name, {"name": ep.name})])
+        return specs
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+    ## @brief Find a test by key, display name or class name ("1", "Activity test1", "Activitytest1").
+    def find(self, selector):
+        selector = str(selector).strip()
+        wanted = selector.replace(" ", "").lower()
+        for spec in self.specs:
+            if selector == spec.key or wanted in (spec.name.replace(" ", "").lower(), spec.class_name.lower()):
+                return spec
+        raise KeyError(f"Unknown test {selector!r}; available: " +
+                       ", ".join(f"{spec.key or spec.class_name}={spec.name}" for spec in self.specs))
+
+
+_default = None
+
+
+## @brief Registry of this package (scanned once per process).
+def default_registry():
+    global _default
+    if _default is None:
+        _default = TestRegistry.scan()
+    return _default
+
+
+## @brief Order tests for execution and decide which cannot run here.
+#  `tests` are `(name, test, ...)` tuples (test = class or TestSpec); returns
+#  `(ordered, skipped)` where skipped maps name -> reason. Destructive tests
+#  run after the others; requirements are checked against `features` (None =
+#  unknown, assume present) and whether passthru is available.
+def plan_tests(tests, passthru_available, features=None):
+    ordered, skipped = [], {}
+    for entry in tests:
+        name, metadata = entry[0], metadata_of(entry[1])
+        if metadata["requires_passthru"] and not passthru_available:
+            skipped[name] = "requires Admin Passthru"
+            continue
+        missing = [f for f in metadata["features"] if features is not None and f not in features]
+        if missing:
+            skipped[name] = "controller lacks " + ", ".join(missing)
+            continue
+        ordered.append(entry)
+    ordered.sort(key=lambda entry: bool(metadata_of(entry[1])["destructive"]))
+    return ordered, skipped
+
+
+def _main():
+    for spec in default_registry():
+        m = spec.metadata
+        print(f"{spec.key or '-':>3}  {spec.name:<20} {spec.module}:{spec.class_name}  "
+              f"destructive={m['destructive']} passthru={m['requires_passthru']} "
+              f"features={list(m['features'])} ~{m['estimated_duration']}s")
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,384 @@
+#!/bin/env python3.9
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from Test.log_pipeline import NullEventStream
+
+## @file results_db.py
+#  Indexed results store (SQLite, WAL mode) shared by every run and worker.
+#
+#  One row per run, one per test execution (device, serial, model, firmware,
+#  verdict, timing), plus the identify mismatches, SMART snapshots and
+#  per-opcode command latencies (p50/p99/p999) of each test. Tests are
+#  indexed by serial, firmware, test name and time, so fleet questions
+#  ("which drives failed Activity test1 this week") are one indexed query
+#  instead of a grep over log files.
+#
+#  CLI:  python -m Test.results_db [--db PATH] tests --test "Activity test1" --verdict FAILED --since 7d
+#        python -m Test.results_db failing --since 7d
+#        python -m Test.results_db smart SERIAL --field temperature
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    host TEXT,
+    status TEXT,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs(id),
+    device TEXT,
+    serial TEXT,
+    model TEXT,
+    firmware TEXT,
+    test TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS tests_serial ON tests(serial, started);
+CREATE INDEX IF NOT EXISTS tests_firmware ON tests(firmware, started);
+CREATE INDEX IF NOT EXISTS tests_test ON tests(test, started);
+CREATE INDEX IF NOT EXISTS tests_started ON tests(started);
+CREATE INDEX IF NOT EXISTS tests_run ON tests(run_id);
+CREATE TABLE IF NOT EXISTS mismatches (
+    test_id INTEGER NOT NULL REFERENCES tests(id),
+    field TEXT NOT NULL,
+    expected TEXT,
+    found TEXT
+);
+CREATE INDEX IF NOT EXISTS mismatches_test ON mismatches(test_id);
+CREATE INDEX IF NOT EXISTS mismatches_field ON mismatches(field);
+CREATE TABLE IF NOT EXISTS smart_snapshots (
+    id INTEGER PRIMARY KEY,
+    test_id INTEGER NOT NULL REFERENCES tests(id),
+    serial TEXT,
+    taken REAL NOT NULL,
+    stage TEXT,
+    critical_warning INTEGER,
+    temperature INTEGER,
+    percent_used INTEGER,
+    media_errors TEXT,
+    power_on_hours TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS smart_serial ON smart_snapshots(serial, taken);
+CREATE INDEX IF NOT EXISTS smart_test ON smart_snapshots(test_id);
+CREATE TABLE IF NOT EXISTS latency (
+    test_id INTEGER NOT NULL REFERENCES tests(id),
+    device TEXT,
+    op TEXT NOT NULL,
+    count INTEGER,
+    bytes INTEGER,
+    errors INTEGER,
+    mean_us REAL,
+    p50_us REAL,
+    p99_us REAL,
+    p999_us REAL,
+    max_us REAL
+);
+CREATE INDEX IF NOT EXISTS latency_test ON latency(test_id);
+CREATE INDEX IF NOT EXISTS latency_op ON latency(op, p99_us);
+"""
+
+# SMART fields copied into their own columns; the full log stays in `data`.
+# 128-bit counters are stored as decimal text, SQLite integers are 64-bit.
+SMART_COLUMNS = ("critical_warning", "temperature", "percent_used", "media_errors", "power_on_hours")
+_WIDE_COLUMNS = {"media_errors", "power_on_hours"}
+
+
+## @brief Default database: $NVME_PROJECT_RESULTS_DB, else <results dir>/results.db.
+def default_db_path(base_dir=None):
+    if os.environ.get("NVME_PROJECT_RESULTS_DB"):
+        return os.environ["NVME_PROJECT_RESULTS_DB"]
+    if base_dir is None:
+        base_dir = os.environ.get("NVME_PROJECT_RESULT_DIR") or os.path.join(os.path.expanduser("~"), "NVME_RESULTS")
+    return os.path.join(base_dir, "results.db")
+
+
+## @brief Parse "7d", "12h", "30m", an ISO date/time or a Unix timestamp into a Unix timestamp.
+def parse_since(value, now=None):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw])", value.strip())
+    if m:
+        seconds = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[m.group(2)]
+        return (now or time.time()) - float(m.group(1)) * seconds
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _json(value):
+    return json.dumps(value.to_dict() if hasattr(value, "to_dict") else value, default=str)
+
+
+## @brief Serial / model / firmware of a controller: Identify via passthru when
+#  available, else `nvme id-ctrl` JSON; {} if neither works.
+def device_identity(admin_wrapper=None, device=None):
+    try:
+        if admin_wrapper is not None:
+            idc = admin_wrapper.identify_controller()
+            data = {"sn": idc.sn, "mn": idc.mn, "fr": idc.fr} if idc is not None else {}
+        else:
+            import subprocess
+            output = subprocess.check_output(['nvme', 'id-ctrl', device, '--output-format=json'],
+                                             text=True, stderr=subprocess.DEVNULL)
+            data = json.loads(output)
+    except Exception:
+        return {}
+    return {"serial": str(data.get("sn", "")).strip() or None,
+            "model": str(data.get("mn", "")).strip() or None,
+            "firmware": str(data.get("fr", "")).strip() or None}
+
+
+## @class RecordingEventStream
+#  Passes events through to the real stream while keeping what the results
+#  database stores: identify mismatches and SMART snapshots of the current test.
+class RecordingEventStream(NullEventStream):
+    def __init__(self, inner=None):
+        self.inner = inner or NullEventStream()
+        self.mismatches = []
+        self.smart = []
+
+    @property
+    def current(self):
+        return self.inner.current
+
+    def start_test(self, name):
+        self.mismatches = []
+        self.smart = []
+        self.inner.start_test(name)
+
+    def end_test(self, **fields):
+        self.inner.end_test(**fields)
+
+    def emit(self, event, **fields):
+        if event == "mismatch":
+            self.mismatches.append((fields.get("field"), fields.get("expected"), fields.get("found")))
+        elif event == "smart_log" and fields.get("data"):
+            self.smart.append((time.time(), fields.get("stage"), fields["data"]))
+        self.inner.emit(event, **fields)
+
+    def close(self):
+        self.inner.close()
+
+
+## @class ResultsDB
+#  Connection to the results database. Safe to open from several processes at
+#  once (WAL journal, busy timeout); rows are written one transaction per test.
+class ResultsDB:
+    def __init__(self, path=None, timeout=30.0):
+        self.path = path or default_db_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=timeout)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- Writing ---
+
+    def start_run(self, config=None, started=None):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO runs (started, host, status, config) VALUES (?, ?, 'RUNNING', ?)",
+                (started or time.time(), socket.gethostname(), _json(config) if config is not None else None))
+        return cur.lastrowid
+
+    def finish_run(self, run_id, status, finished=None):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished = ?, status = ? WHERE id = ?",
+                              (finished or time.time(), status, run_id))
+
+    ## @brief Store one test execution with its mismatches `(field, expected, found)`,
+    #  SMART snapshots `(taken, stage, smart_log)` and command latency summaries
+    #  (`{device: {op: summary}}`, see Test/latency.py); returns the test row id.
+    def record_test(self, run_id, test, verdict, device=None, identity=None, started=None, duration=None,
+                    mismatches=(), smart=(), latency=None):
+        identity = identity or {}
+        serial = identity.get("serial")
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO tests (run_id, device, serial, model, firmware, test, verdict, started, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, device, serial, identity.get("model"), identity.get("firmware"), test, verdict,
+                 started or time.time(), duration))
+            test_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO mismatches (test_id, field, expected, found) VALUES (?, ?, ?, ?)",
+                [(test_id, field, _json(expected), _json(found)) for field, expected, found in mismatches])
+            rows = []
+            for taken, stage, log in smart:
+                values = [log.get(name) for name in SMART_COLUMNS]
+                values = [str(v) if name in _WIDE_COLUMNS and v is not None else v
+                          for name, v in zip(SMART_COLUMNS, values)]
+                rows.append((test_id, serial, taken, stage, *values, _json(log)))
+            self.conn.executemany(
+                f"INSERT INTO smart_snapshots (test_id, serial, taken, stage, {', '.join(SMART_COLUMNS)}, data) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' * len(SMART_COLUMNS))}, ?)", rows)
+            self.conn.executemany(
+                "INSERT INTO latency (test_id, device, op, count, bytes, errors, mean_us, p50_us, p99_us, p999_us, "
+                "max_us) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(test_id, dev, op, s["count"], s["bytes"], s["errors"], s["mean_us"], s["p50_us"], s["p99_us"],
+                  s["p999_us"], s["max_us"])
+                 for dev, ops in (latency or {}).items() for op, s in ops.items()])
+        return test_id
+
+    # --- Queries ---
+
+    ## @brief Test executions, newest first, filtered by any of serial, firmware,
+    #  test name, verdict, device, run and time range (`since`/`until` as for parse_since).
+    def tests(self, serial=None, firmware=None, test=None, verdict=None, device=None, run_id=None,
+              since=None, until=None, limit=None):
+        where, args = [], []
+        for column, value in (("serial", serial), ("firmware", firmware), ("test", test),
+                              ("verdict", verdict), ("device", device), ("run_id", run_id)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if since is not None:
+            where.append("started >= ?")
+            args.append(parse_since(since))
+        if until is not None:
+            where.append("started < ?")
+            args.append(parse_since(until))
+        sql = "SELECT * FROM tests"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY started DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    ## @brief Drives with at least one FAILED/ERROR verdict (optionally for one
+    #  test / since a time), with their failure count and last failure time.
+    def failing_drives(self, test=None, since=None):
+        sql = ("SELECT serial, model, firmware, test, COUNT(*) AS failures, MAX(started) AS last_failure "
+               "FROM tests WHERE verdict IN ('FAILED', 'ERROR')")
+        args = []
+        if test is not None:
+            sql += " AND test = ?"
+            args.append(test)
+        if since is not None:
+            sql += " AND started >= ?"
+            args.append(parse_since(since))
+        sql += " GROUP BY serial, model, firmware, test ORDER BY failures DESC, last_failure DESC"
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def mismatches(self, test_id):
+        rows = self.conn.execute("SELECT field, expected, found FROM mismatches WHERE test_id = ?", (test_id,))
+        return [{"field": row["field"], "expected": json.loads(row["expected"]), "found": json.loads(row["found"])}
+                for row in rows]
+
+    ## @brief SMART snapshots of one drive, oldest first; `field` returns
+    #  `(taken, stage, value)` tuples for that field only (exact 128-bit ints).
+    def smart_history(self, serial, field=None, since=None):
+        sql = "SELECT taken, stage, data FROM smart_snapshots WHERE serial = ?"
+        args = [serial]
+        if since is not None:
+            sql += " AND taken >= ?"
+            args.append(parse_since(since))
+        sql += " ORDER BY taken"
+        rows = self.conn.execute(sql, args)
+        if field is None:
+            return [{"taken": row["taken"], "stage": row["stage"], "data": json.loads(row["data"])} for row in rows]
+        return [(row["taken"], row["stage"], json.loads(row["data"]).get(field)) for row in rows]
+
+    def runs(self, limit=20):
+        return [dict(row) for row in self.conn.execute("SELECT * FROM runs ORDER BY started DESC LIMIT ?", (limit,))]
+
+
+def _print_rows(rows, as_json):
+    if as_json:
+        print(json.dumps(rows, indent=2, default=str))
+        return
+    if not rows:
+        print("(no rows)")
+        return
+    rows = [{k: (datetime.fromtimestamp(v).isoformat(timespec="seconds")
+                 if k in ("started", "finished", "taken", "last_failure") and isinstance(v, float) else v)
+             for k, v in row.items()} for row in rows]
+    columns = list(rows[0])
+    widths = [max(len(str(c)), *(len(str(row[c])) for row in rows)) for c in columns]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the NVMe test results database.")
+    parser.add_argument("--db", help="database file (default: %(default)s)", default=default_db_path())
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("tests", help="test executions, newest first")
+    for option in ("serial", "firmware", "test", "verdict", "device"):
+        p.add_argument(f"--{option}")
+    p.add_argument("--run", type=int, dest="run_id")
+    p.add_argument("--since", help="e.g. 7d, 12h, 2026-01-31")
+    p.add_argument("--until")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--mismatches", action="store_true", help="include the mismatching fields")
+
+    p = sub.add_parser("failing", help="drives with FAILED/ERROR verdicts")
+    p.add_argument("--test")
+    p.add_argument("--since")
+
+    p = sub.add_parser("smart", help="SMART snapshots of one drive")
+    p.add_argument("serial")
+    p.add_argument("--field")
+    p.add_argument("--since")
+
+    p = sub.add_parser("runs", help="latest runs")
+    p.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"No results database at {args.db}", file=sys.stderr)
+        return 1
+    with ResultsDB(args.db) as db:
+        if args.command == "tests":
+            rows = db.tests(serial=args.serial, firmware=args.firmware, test=args.test, verdict=args.verdict,
+                            device=args.device, run_id=args.run_id, since=args.since, until=args.until,
+                            limit=args.limit)
+            if args.mismatches:
+                for row in rows:
+                    row["mismatches"] = ", ".join(m["field"] for m in db.mismatches(row["id"]))
+        elif args.command == "failing":
+            rows = db.failing_drives(test=args.test, since=args.since)
+        elif args.command == "smart":
+            rows = db.smart_history(args.serial, field=args.field, since=args.since)
+            if args.field:
+                rows = [{"taken": taken, "stage": stage, args.field: value} for taken, stage, value in rows]
+            elif not args.json:
+                rows = [{"taken": r["taken"], "stage": r["stage"], **{k: r["data"].get(k) for k in SMART_COLUMNS}}
+                        for r in rows]
+        else:
+            rows = db.runs(limit=args.limit)
+    _print_rows(rows, args.json)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
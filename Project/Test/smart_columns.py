@@ -0,0 +1,50 @@
+#!/bin/env python3.9
+import operator
+from Test.nvme_log import SMART_LOG_LAYOUT
+
+## @file smart_columns.py
+#  Column helpers shared by the SMART ring buffer (smart_sampler.py) and the
+#  snapshot store (smart_store.py).
+#
+#  Values are kept in `array('Q')`-sized columns: a 128-bit counter is split
+#  in a low and a high 64-bit part and joined again when read, so it stays
+#  exact. Deltas and rates work on whole series (oldest first) with `map`.
+
+MASK64 = (1 << 64) - 1
+
+## SMART fields wider than 64 bits
+WIDE_FIELDS = frozenset(f.name for f in SMART_LOG_LAYOUT.fields if f.kind == 'u128')
+
+## Counters summarized by default (ring buffer summary, store aggregate)
+DEFAULT_COUNTERS = ("host_read_commands", "host_write_commands", "data_units_read", "data_units_written",
+                    "media_errors", "num_err_log_entries")
+
+
+## @brief `(low, high)` 64-bit halves of `value`.
+def split_u128(value):
+    return value & MASK64, value >> 64
+
+
+def join_u128(high, low):
+    return (high << 64) | low
+
+
+## @brief Exact values from a low column and its high column (None: all zero).
+def join_columns(low, high=None):
+    return list(low) if high is None else list(map(join_u128, high, low))
+
+
+## @brief Change between consecutive values.
+def series_deltas(values):
+    return list(map(operator.sub, values[1:], values[:-1]))
+
+
+## @brief Change per second between consecutive values (0.0 where no time passed).
+def series_rates(values, times):
+    intervals = map(operator.sub, times[1:], times[:-1])
+    return [d / t if t > 0 else 0.0 for d, t in zip(series_deltas(values), intervals)]
+
+
+## @brief Average change per second, 0.0 over no time.
+def average_rate(delta, elapsed):
+    return delta / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,201 @@
+#!/bin/env python3.9
+import logging
+import threading
+import time
+from array import array
+from Test.admin_passthru_wrapper import NVME_NSID_ALL
+from Test.nvme_log import SMART_LOG_LAYOUT
+from Test.smart_columns import (
+    DEFAULT_COUNTERS, WIDE_FIELDS, average_rate, join_columns, join_u128, series_deltas, series_rates, split_u128
+)
+
+## @file smart_sampler.py
+#  Background SMART / Health log sampling into a fixed-size columnar ring buffer.
+#
+#  Every sampled field is one preallocated `array` column (64-bit unsigned;
+#  the 128-bit counters use a low and a high column, so values stay exact),
+#  plus a column of timestamps. Memory does not grow with the run length and
+#  a time series costs one array walk instead of thousands of dicts.
+
+## Fields sampled by default: every field of the SMART log.
+SMART_SAMPLE_FIELDS = tuple(SMART_LOG_LAYOUT.keys)
+
+
+## @class SmartRingBuffer
+#  Holds the last `capacity` samples. Columns and series are returned oldest
+#  first; `delta`/`rate` compare the oldest and newest sample kept.
+class SmartRingBuffer:
+    def __init__(self, capacity=3600, fields=SMART_SAMPLE_FIELDS):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        for name in self.fields:
+            if name not in SMART_LOG_LAYOUT.index:
+                raise KeyError(f"Unknown SMART field {name!r}")
+        self._times = array('d', bytes(8 * capacity))
+        self._lo = {name: array('Q', bytes(8 * capacity)) for name in self.fields}
+        self._hi = {name: array('Q', bytes(8 * capacity)) for name in self.fields if name in WIDE_FIELDS}
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    ## @brief Store one sample (a SmartLog view or a dict with nvme-cli names).
+    def append(self, smart_log, timestamp=None):
+        with self._lock:
+            i = self._next
+            self._times[i] = time.time() if timestamp is None else timestamp
+            for name in self.fields:
+                low, high = split_u128(smart_log.get(name) or 0)
+                self._lo[name][i] = low
+                if name in self._hi:
+                    self._hi[name][i] = high
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def _order(self):
+        # Slices of the ring in chronological order
+        start = (self._next - self._count) % self.capacity
+        if start + self._count <= self.capacity:
+            return [(start, start + self._count)]
+        return [(start, self.capacity), (0, self._next)]
+
+    def _series(self, column):
+        out = []
+        for a, b in self._order():
+            out.extend(column[a:b])
+        return out
+
+    def times(self):
+        with self._lock:
+            return self._series(self._times)
+
+    def column(self, name):
+        """Values of `name`, oldest first (exact ints, also for 128-bit counters)."""
+        with self._lock:
+            hi = self._hi.get(name)
+            return join_columns(self._series(self._lo[name]), self._series(hi) if hi is not None else None)
+
+    def _at(self, name, back):
+        i = (self._next - 1 - back) % self.capacity
+        hi = self._hi.get(name)
+        return self._lo[name][i] if hi is None else join_u128(hi[i], self._lo[name][i])
+
+    def latest(self):
+        with self._lock:
+            if not self._count:
+                return {}
+            return {"time": self._times[(self._next - 1) % self.capacity],
+                    **{name: self._at(name, 0) for name in self.fields}}
+
+    def elapsed(self):
+        with self._lock:
+            if self._count < 2:
+                return 0.0
+            return self._times[(self._next - 1) % self.capacity] - self._times[(self._next - self._count) % self.capacity]
+
+    def delta(self, name):
+        """Newest minus oldest value kept."""
+        with self._lock:
+            if self._count < 2:
+                return 0
+            return self._at(name, 0) - self._at(name, self._count - 1)
+
+    def deltas(self, name):
+        return series_deltas(self.column(name))
+
+    def rate(self, name):
+        """Average change per second over the samples kept."""
+        return average_rate(self.delta(name), self.elapsed())
+
+    def rates(self, name):
+        return series_rates(self.column(name), self.times())
+
+    def transitions(self, name):
+        """`(time, old, new)` for every sample where `name` changed (e.g. a brief critical_warning)."""
+        values, times = self.column(name), self.times()
+        return [(t, a, b) for t, a, b in zip(times[1:], values, values[1:]) if a != b]
+
+    def summary(self, counters=DEFAULT_COUNTERS):
+        """Compact description of the series (for the event stream / results)."""
+        temps = self.column("temperature") if "temperature" in self.fields else []
+        summary = {"samples": len(self), "elapsed_s": round(self.elapsed(), 3)}
+        summary["deltas"] = {name: self.delta(name) for name in counters if name in self.fields}
+        summary["rates"] = {name: round(self.rate(name), 3) for name in counters if name in self.fields}
+        if temps:
+            summary["temperature"] = {"min": min(temps), "max": max(temps)}
+        if "critical_warning" in self.fields:
+            summary["critical_warning_transitions"] = self.transitions("critical_warning")
+        return summary
+
+
+## @class SmartSampler
+#  Thread polling `get_smart_log` every `interval` seconds into a
+#  SmartRingBuffer (`buffer`). Works with AdminPassthruWrapper and the
+#  simulated controller; use it as a context manager around a workload.
+class SmartSampler:
+    def __init__(self, nvme_interface, interval=1.0, capacity=3600, fields=SMART_SAMPLE_FIELDS,
+                 nsid=NVME_NSID_ALL, logger=None):
+        self.nvme_interface = nvme_interface
+        self.interval = interval
+        self.nsid = nsid
+        self.logger = logger or logging.getLogger(__name__)
+        self.buffer = SmartRingBuffer(capacity, fields)
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample_now(self):
+        """Take one sample synchronously; returns False if the log could not be read."""
+        smart_log = self.nvme_interface.get_smart_log(self.nsid)
+        if smart_log is None:
+            self.errors += 1
+            return False
+        self.buffer.append(smart_log)
+        return True
+
+    def _loop(self):
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.sample_now()
+            except Exception as e:
+                self.errors += 1
+                self.logger.debug("SMART sample failed: %s", e)
+            # Fixed schedule: a slow sample does not shift the following ones
+            deadline += self.interval
+            self._stop.wait(max(0.0, deadline - time.monotonic()))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="smart-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            # Closing sample, so the series covers the whole workload
+            try:
+                self.sample_now()
+            except Exception as e:
+                self.errors += 1
+                self.logger.debug("SMART sample failed: %s", e)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
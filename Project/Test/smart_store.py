@@ -0,0 +1,217 @@
+#!/bin/env python3.9
+import operator
+import threading
+import time
+from array import array
+from itertools import compress, repeat
+from Test.nvme_log import SMART_LOG_LAYOUT
+from Test.smart_columns import (
+    DEFAULT_COUNTERS, WIDE_FIELDS, average_rate, join_columns, join_u128, series_deltas, series_rates, split_u128
+)
+from Test.smart_sampler import SMART_SAMPLE_FIELDS
+
+## @file smart_store.py
+#  Columnar store of SMART / Health snapshots of many drives.
+#
+#  Every drive has one `array` column per field, typed as narrow as the field
+#  (u8 -> 'B', u16 -> 'H', u32 -> 'I', u128 -> 'Q'), plus a column of
+#  timestamps. The 128-bit counters keep their low 64 bits in the 'Q' column;
+#  a high column is only allocated for a drive once a value reaches 2**64, so
+#  values stay exact at 8 bytes per counter. Deltas, rates and threshold
+#  checks run over whole columns with `map` / `compress` (no loop per value
+#  in Python code), so a fleet of drives with thousands of snapshots each is
+#  analysed in milliseconds.
+
+_TYPECODES = {'u8': 'B', 'u16': 'H', 'u32': 'I', 'u64': 'Q', 'u128': 'Q'}
+
+## Comparison operators accepted by threshold checks
+THRESHOLD_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+                 "==": operator.eq, "!=": operator.ne}
+
+
+## @class _DriveColumns
+#  The snapshots of one drive, oldest first.
+class _DriveColumns:
+    __slots__ = ("times", "lo", "hi")
+
+    def __init__(self, fields, kinds):
+        self.times = array('d')
+        self.lo = {name: array(_TYPECODES[kinds[name]]) for name in fields}
+        self.hi = {}
+
+    def append(self, smart_log, timestamp, wide):
+        count = len(self.times)
+        self.times.append(timestamp)
+        for name, column in self.lo.items():
+            value = smart_log.get(name) or 0
+            if name in wide:
+                value, high = split_u128(value)
+                hi = self.hi.get(name)
+                if high and hi is None:
+                    hi = self.hi[name] = array('Q', bytes(8 * count))
+                if hi is not None:
+                    hi.append(high)
+            column.append(value)
+
+    def column(self, name):
+        return join_columns(self.lo[name], self.hi.get(name))
+
+    def value(self, name, i):
+        hi = self.hi.get(name)
+        return self.lo[name][i] if hi is None else join_u128(hi[i], self.lo[name][i])
+
+
+## @class SmartSnapshotStore
+#  Append-only snapshots by drive (any hashable id, e.g. device path or
+#  serial). Per drive, columns and series are oldest first; `delta`/`rate`
+#  compare the oldest and newest snapshot.
+class SmartSnapshotStore:
+    def __init__(self, fields=SMART_SAMPLE_FIELDS):
+        self.fields = tuple(fields)
+        for name in self.fields:
+            if name not in SMART_LOG_LAYOUT.index:
+                raise KeyError(f"Unknown SMART field {name!r}")
+        self._kinds = {f.name: f.kind for f in SMART_LOG_LAYOUT.fields}
+        self._wide = WIDE_FIELDS.intersection(self.fields)
+        self._drives = {}
+        self._lock = threading.Lock()
+
+    @property
+    def drives(self):
+        return list(self._drives)
+
+    def __len__(self):
+        return sum(len(d.times) for d in self._drives.values())
+
+    def count(self, drive):
+        columns = self._drives.get(drive)
+        return len(columns.times) if columns is not None else 0
+
+    ## @brief Store one snapshot (a SmartLog view or a dict with nvme-cli names) of `drive`.
+    def append(self, drive, smart_log, timestamp=None):
+        with self._lock:
+            columns = self._drives.get(drive)
+            if columns is None:
+                columns = self._drives[drive] = _DriveColumns(self.fields, self._kinds)
+            columns.append(smart_log, time.time() if timestamp is None else timestamp, self._wide)
+
+    ## @brief Copy the samples of a smart_sampler.SmartRingBuffer into `drive`.
+    def extend(self, drive, ring_buffer):
+        fields = [name for name in self.fields if name in ring_buffer.fields]
+        series = {name: ring_buffer.column(name) for name in fields}
+        for i, timestamp in enumerate(ring_buffer.times()):
+            self.append(drive, {name: values[i] for name, values in series.items()}, timestamp)
+
+    def _columns(self, drive):
+        columns = self._drives.get(drive)
+        if columns is None:
+            raise KeyError(f"No SMART snapshots of {drive!r}")
+        return columns
+
+    def times(self, drive):
+        return list(self._columns(drive).times)
+
+    def column(self, drive, name):
+        """Values of `name`, oldest first (exact ints, also for 128-bit counters)."""
+        return self._columns(drive).column(name)
+
+    def latest(self, drive):
+        columns = self._columns(drive)
+        if not columns.times:
+            return {}
+        return {"time": columns.times[-1], **{name: columns.value(name, -1) for name in self.fields}}
+
+    def elapsed(self, drive):
+        times = self._columns(drive).times
+        return times[-1] - times[0] if len(times) > 1 else 0.0
+
+    def delta(self, drive, name):
+        """Newest minus oldest value."""
+        columns = self._columns(drive)
+        if len(columns.times) < 2:
+            return 0
+        return columns.value(name, -1) - columns.value(name, 0)
+
+    def deltas(self, drive, name):
+        """Change between consecutive snapshots."""
+        return series_deltas(self.column(drive, name))
+
+    def rate(self, drive, name):
+        """Average change per second between the oldest and newest snapshot."""
+        return average_rate(self.delta(drive, name), self.elapsed(drive))
+
+    def rates(self, drive, name):
+        return series_rates(self.column(drive, name), self._columns(drive).times)
+
+    ## @brief Snapshots where `name op limit` holds, as `{drive: [(time, value)]}`
+    #  (drives without any left out).
+    #  @param op One of THRESHOLD_OPS (">", ">=", "<", "<=", "==", "!=").
+    #  @param of "value" to test the values, "delta" / "rate" to test the change
+    #            since the previous snapshot (the time is that of the later one).
+    def exceeds(self, name, op, limit, drives=None, of="value"):
+        compare = THRESHOLD_OPS[op]
+        out = {}
+        for drive in drives if drives is not None else self.drives:
+            times = self._columns(drive).times
+            if of == "value":
+                values = self.column(drive, name)
+            elif of == "delta":
+                values, times = self.deltas(drive, name), times[1:]
+            elif of == "rate":
+                values, times = self.rates(drive, name), times[1:]
+            else:
+                raise ValueError(f"of must be 'value', 'delta' or 'rate', not {of!r}")
+            hits = list(compress(zip(times, values), map(compare, values, repeat(limit))))
+            if hits:
+                out[drive] = hits
+        return out
+
+    ## @brief Run several threshold checks, e.g.
+    #  `{"temperature": (">", 343), "avail_spare": ("<", 10), "media_errors": (">", 0, "delta")}`.
+    #  Returns `[{"drive", "field", "op", "limit", "of", "count", "first", "worst"}]` for every check
+    #  that fired on a drive.
+    def check(self, thresholds, drives=None):
+        violations = []
+        for name, rule in thresholds.items():
+            op, limit = rule[0], rule[1]
+            of = rule[2] if len(rule) > 2 else "value"
+            pick = min if op in ("<", "<=") else max
+            for drive, hits in self.exceeds(name, op, limit, drives, of).items():
+                violations.append({"drive": drive, "field": name, "op": op, "limit": limit, "of": of,
+                                   "count": len(hits), "first": hits[0], "worst": pick(hits, key=lambda h: h[1])})
+        return violations
+
+    ## @brief Per drive and fleet view of `counters`: `{"drives": {drive: {name:
+    #  {"last", "delta", "rate"}}}, "fleet": {name: {"delta", "rate", "max_delta_drive"}}}`.
+    def aggregate(self, counters=DEFAULT_COUNTERS, drives=None):
+        counters = [name for name in counters if name in self.fields]
+        per_drive, fleet = {}, {name: {"delta": 0, "rate": 0.0, "max_delta_drive": None} for name in counters}
+        best = {name: None for name in counters}
+        for drive in drives if drives is not None else self.drives:
+            stats = per_drive[drive] = {}
+            for name in counters:
+                delta = self.delta(drive, name)
+                rate = self.rate(drive, name)
+                stats[name] = {"last": self._columns(drive).value(name, -1), "delta": delta, "rate": round(rate, 3)}
+                total = fleet[name]
+                total["delta"] += delta
+                total["rate"] += rate
+                if best[name] is None or delta > best[name]:
+                    best[name] = delta
+                    total["max_delta_drive"] = drive
+        for total in fleet.values():
+            total["rate"] = round(total["rate"], 3)
+        return {"drives": per_drive, "fleet": fleet}
+
+    ## @brief Bytes held by the columns (array buffers only).
+    def memory_bytes(self):
+        total = 0
+        for columns in self._drives.values():
+            total += columns.times.itemsize * len(columns.times)
+            for column in (*columns.lo.values(), *columns.hi.values()):
+                total += column.itemsize * len(column)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._drives.clear()
@@ -0,0 +1,257 @@
+#!/bin/env python3.9
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+from array import array
+from Test.io_passthru_wrapper import NVME_CMD_READ, NVME_CMD_WRITE
+from Test.latency import LatencyHistogram
+
+## @file trace.py
+#  Seeded I/O command sequences, stored as compact binary traces and replayed
+#  through an I/O engine.
+#
+#  A CommandTrace is a set of columns (`array`s): opcode, slba, nlb and, once
+#  issued, the NVMe status and latency of every command. The whole sequence
+#  is generated up front from one recorded seed (nothing is drawn inside the
+#  I/O loop), so a failing run is reproduced from its seed or its trace file.
+#  `fences` split the sequence in phases: replay waits for every command of a
+#  phase before starting the next (e.g. writes before the reads that check them).
+#
+#  File: header, JSON metadata, then each column as little-endian raw bytes.
+#
+#  CLI:  python -m Test.trace generate --seed 42 --count 100000 --span 0:1048576 -o run.nvtr
+#        python -m Test.trace replay run.nvtr --simulate --queue-depth 32 -o replayed.nvtr
+#        python -m Test.trace show replayed.nvtr
+
+TRACE_MAGIC = b"NVTR"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sHHQII')  # magic, version, reserved, seed, count, metadata length
+# Column name -> array typecode, in file order
+TRACE_COLUMNS = (("opcodes", 'B'), ("slbas", 'Q'), ("nlbs", 'H'), ("statuses", 'H'), ("latencies", 'Q'))
+
+OPCODE_NAMES = {NVME_CMD_READ: "read", NVME_CMD_WRITE: "write"}
+
+
+## @class CommandTrace
+#  One I/O command sequence with its (optional) recorded outcome.
+class CommandTrace:
+    def __init__(self, opcodes, slbas, nlbs, seed=0, fences=(), meta=None, statuses=None, latencies=None):
+        self.opcodes = array('B', opcodes)
+        self.slbas = array('Q', slbas)
+        self.nlbs = array('H', nlbs)
+        count = len(self.opcodes)
+        if not len(self.slbas) == len(self.nlbs) == count:
+            raise ValueError("trace columns differ in length")
+        self.seed = seed
+        self.fences = sorted(set(fences))
+        self.meta = dict(meta or {})
+        self.statuses = array('H', statuses) if statuses is not None else array('H', bytes(2 * count))
+        self.latencies = array('Q', latencies) if latencies is not None else array('Q', bytes(8 * count))
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    ## @brief Random commands on LBAs `first`..`last - 1`, all drawn from `seed`.
+    #  @param read_ratio Share of reads (the rest are writes).
+    #  @param verify_writes `count` writes to distinct LBAs, a fence, then a read of each.
+    @classmethod
+    def generate(cls, seed, count, first, last, read_ratio=0.5, nlb=1, verify_writes=False, meta=None):
+        rng = random.Random(seed)
+        span = (last - first - nlb) // nlb + 1
+        if span <= 0:
+            raise ValueError(f"LBA range {first}..{last} too small for {nlb}-block commands")
+        if verify_writes:
+            # Distinct targets: a read must check the write of its own LBA
+            slbas = array('Q', (first + i * nlb for i in rng.sample(range(span), count)))
+            opcodes = array('B', [NVME_CMD_WRITE]) * count + array('B', [NVME_CMD_READ]) * count
+            slbas = slbas + slbas
+            fences = [count]
+        else:
+            slbas = array('Q', (first + i * nlb for i in rng.choices(range(span), k=count)))
+            opcodes = array('B', (NVME_CMD_READ if r < read_ratio else NVME_CMD_WRITE
+                                  for r in (rng.random() for _ in range(count))))
+            fences = []
+        meta = dict(meta or {}, first=first, last=last, read_ratio=read_ratio, nlb=nlb, verify_writes=verify_writes)
+        return cls(opcodes, slbas, array('H', [nlb]) * len(opcodes), seed, fences, meta)
+
+    def commands(self):
+        """`(opcode, slba, nlb)` of every command, in order."""
+        return zip(self.opcodes, self.slbas, self.nlbs)
+
+    def phases(self):
+        """`(start, end)` index ranges between fences."""
+        bounds = [0, *(f for f in self.fences if 0 < f < len(self)), len(self)]
+        return list(zip(bounds, bounds[1:]))
+
+    def save(self, path):
+        meta = json.dumps(dict(self.meta, fences=self.fences)).encode()
+        with open(path, 'wb') as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0, self.seed, len(self), len(meta)))
+            f.write(meta)
+            for name, _ in TRACE_COLUMNS:
+                column = getattr(self, name)
+                if sys.byteorder == "big":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, version, _, seed, count, meta_len = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+            if magic != TRACE_MAGIC or version != TRACE_VERSION:
+                raise ValueError(f"{path}: not an NVMe command trace (version {TRACE_VERSION})")
+            meta = json.loads(f.read(meta_len))
+            columns = {}
+            for name, typecode in TRACE_COLUMNS:
+                column = array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder == "big":
+                    column.byteswap()
+                columns[name] = column
+        fences = meta.pop("fences", [])
+        return cls(columns["opcodes"], columns["slbas"], columns["nlbs"], seed, fences, meta,
+                   columns["statuses"], columns["latencies"])
+
+    def summary(self):
+        """Command counts, failed commands and latency percentiles per opcode."""
+        out = {"seed": self.seed, "commands": len(self), "phases": len(self.phases()), "ops": {}}
+        for opcode, name in OPCODE_NAMES.items():
+            histogram = LatencyHistogram()
+            failed = 0
+            for op, status, latency in zip(self.opcodes, self.statuses, self.latencies):
+                if op == opcode:
+                    if latency:
+                        histogram.record(latency)
+                    failed += status != 0
+            if histogram.count or failed:
+                out["ops"][name] = dict(histogram.summary(), failed=failed)
+        return out
+
+    ## @brief Indices where `other` (a replay of this trace) got a different status.
+    def diverging(self, other):
+        return [i for i, (a, b) in enumerate(zip(self.statuses, other.statuses)) if a != b]
+
+
+## @brief Issue every command of `trace` through `engine`, `engine.queue_depth`
+#  in flight, storing each status and latency in the trace. With a workload
+#  (Test/workload.IntegrityWorkload) writes carry its LBA-stamped payloads and
+#  reads are verified. Returns the trace.
+async def replay(engine, trace, workload=None):
+    opcodes, slbas, nlbs = trace.opcodes, trace.slbas, trace.nlbs
+    statuses, latencies = trace.statuses, trace.latencies
+    clock = time.perf_counter_ns
+    for start, end in trace.phases():
+        cursor = iter(range(start, end))
+
+        async def worker():
+            # Workers pull the next index: no coroutine per command
+            for i in cursor:
+                opcode = opcodes[i]
+                started = clock()
+                if workload is None:
+                    status, _ = await engine.submit(opcode, slbas[i], nlbs[i])
+                elif opcode == NVME_CMD_WRITE:
+                    status = await workload.write(slbas[i], nlbs[i])
+                else:
+                    status = await workload.verify(slbas[i], nlbs[i])
+                latencies[i] = clock() - started
+                statuses[i] = status
+
+        await asyncio.gather(*(worker() for _ in range(min(engine.queue_depth, end - start))))
+    return trace
+
+
+def _print_summary(summary):
+    print(f"seed {summary['seed']}, {summary['commands']} commands, {summary['phases']} phase(s)")
+    for name, s in summary["ops"].items():
+        print(f"  {name:<6} n={s['count']} failed={s['failed']} p50={s['p50_us']}us p99={s['p99_us']}us "
+              f"p999={s['p999_us']}us max={s['max_us']}us")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate, replay and inspect NVMe I/O command traces.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("generate", help="write a seeded random trace")
+    p.add_argument("--seed", type=int, default=None, help="default: random (printed)")
+    p.add_argument("--count", type=int, required=True)
+    p.add_argument("--span", default="0:65536", help="LBA range FIRST:LAST (default: %(default)s)")
+    p.add_argument("--read-ratio", type=float, default=0.5)
+    p.add_argument("--nlb", type=int, default=1)
+    p.add_argument("--verify-writes", action="store_true", help="writes to distinct LBAs, then reads of each")
+    p.add_argument("-o", "--output", required=True)
+
+    p = sub.add_parser("replay", help="issue a trace against a drive or the simulator")
+    p.add_argument("trace")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("-d", "--device", help="controller (e.g. /dev/nvme0); writes are destructive")
+    target.add_argument("--simulate", action="store_true")
+    p.add_argument("--nsid", type=int, default=1)
+    p.add_argument("--queue-depth", type=int, default=32)
+    p.add_argument("--block-size", type=int, help="default: LBA size of the namespace")
+    p.add_argument("--verify", action="store_true", help="stamp writes and verify reads (verify-writes traces)")
+    p.add_argument("-o", "--output", help="save the replayed trace (statuses, latencies)")
+
+    p = sub.add_parser("show", help="summary of a trace")
+    p.add_argument("trace")
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        seed = args.seed if args.seed is not None else random.getrandbits(32)
+        first, last = (int(x, 0) for x in args.span.split(":"))
+        trace = CommandTrace.generate(seed, args.count, first, last, args.read_ratio, args.nlb, args.verify_writes)
+        trace.save(args.output)
+        print(f"{len(trace)} commands, seed {seed} -> {args.output}")
+        return 0
+    if args.command == "show":
+        _print_summary(CommandTrace.load(args.trace).summary())
+        return 0
+
+    from Test.admin_passthru_wrapper import AdminPassthruWrapper
+    from Test.nvme_geometry import namespace_geometry
+    from Test.nvme_simulator import SimulatedController
+    from Test.workload import IntegrityWorkload
+    recorded = CommandTrace.load(args.trace)
+    trace = CommandTrace(recorded.opcodes, recorded.slbas, recorded.nlbs, recorded.seed, recorded.fences,
+                         recorded.meta)
+    nvme_interface = SimulatedController() if args.simulate else AdminPassthruWrapper(args.device)
+    try:
+        block_size = args.block_size
+        if block_size is None:
+            geometry = namespace_geometry(nvme_interface, nvme_interface.device_path, args.nsid)
+            if geometry is None:
+                print(f"Cannot read the geometry of namespace {args.nsid}", file=sys.stderr)
+                return 1
+            block_size = geometry.lba_size
+        with nvme_interface.open_io_engine(nsid=args.nsid, queue_depth=args.queue_depth, block_size=block_size,
+                                           max_blocks=max(trace.nlbs, default=1)) as engine:
+            workload = IntegrityWorkload(engine, seed=trace.seed) if args.verify else None
+            started = time.perf_counter()
+            asyncio.run(replay(engine, trace, workload))
+            elapsed = time.perf_counter() - started
+    finally:
+        nvme_interface.close()
+    print(f"{len(trace)} commands in {elapsed:.3f}s ({len(trace) / elapsed:.0f} IOPS)")
+    _print_summary(trace.summary())
+    code = 0
+    if any(recorded.latencies):
+        diverging = recorded.diverging(trace)
+        if diverging:
+            print(f"{len(diverging)} commands completed with another status than recorded, first at index "
+                  f"{diverging[0]}")
+            code = 1
+    if workload is not None and workload.corruptions:
+        print(f"{workload.corrupted_blocks} corrupted blocks: {workload.report()['corrupted_lbas'][:20]}")
+        code = 1
+    if args.output:
+        trace.save(args.output)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
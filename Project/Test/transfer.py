@@ -0,0 +1,277 @@
+#!/bin/env python3.9
+import argparse
+import asyncio
+import mmap
+import os
+import sys
+import time
+from Test.io_passthru_wrapper import NvmeIOError, NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_geometry import namespace_geometry
+from Test.nvme_topology import namespace_path
+
+## @file transfer.py
+#  Large sequential transfers at the drive's maximum command size.
+#
+#  The largest command a controller takes is 2**MDTS memory pages (Identify
+#  Controller), further capped by the kernel's max_hw_sectors_kb when sysfs
+#  has it; the LBA size comes from Identify Namespace. A transfer of any
+#  length is split into commands of that size, issued queue_depth at a time
+#  into one page-aligned mmap buffer: every in-flight command owns a slot of
+#  it, addressed through a memoryview slice handed to the engine as-is
+#  (`submit(buf=...)`), so no payload is copied on the way to the ioctl.
+#  Data goes in and out through callbacks that see each slot in place.
+#
+#  CLI:  python -m Test.transfer --simulate --size 1G --mode both
+#        python -m Test.transfer -d /dev/nvme0 --size 4G --mode read --queue-depth 8
+
+# CAP.MPSMIN is a controller register, not reachable through Admin Passthru;
+# Linux runs every NVMe controller with 4 KiB memory pages
+DEFAULT_MPS = 4096
+DEFAULT_MAX_TRANSFER = 1 << 20  # used when MDTS is 0 (no limit reported)
+DEFAULT_BUFFER_SIZE = 64 << 20
+
+_SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+## @class TransferLimits
+#  Command size limits of one namespace.
+class TransferLimits:
+    __slots__ = ("lba_size", "max_bytes", "mdts")
+
+    def __init__(self, lba_size, max_bytes, mdts=0):
+        self.lba_size = lba_size
+        self.mdts = mdts
+        # Whole blocks only
+        self.max_bytes = max(lba_size, max_bytes // lba_size * lba_size)
+
+    @property
+    def max_blocks(self):
+        return self.max_bytes // self.lba_size
+
+    def __repr__(self):
+        return f"TransferLimits(lba_size={self.lba_size}, max_bytes={self.max_bytes}, mdts={self.mdts})"
+
+
+def _max_hw_bytes(device, nsid):
+    path = os.path.join("/sys/block", os.path.basename(namespace_path(device, nsid)), "queue", "max_hw_sectors_kb")
+    try:
+        with open(path, 'r') as f:
+            return int(f.read()) * 1024
+    except (OSError, ValueError):
+        return None
+
+
+_limits = {}
+
+
+## @brief TransferLimits of namespace `nsid`, read once per controller and
+#  LBA size (a format to another LBA size reads them again). None when
+#  Identify Controller or Namespace cannot be read.
+def transfer_limits(nvme_interface, nsid=1):
+    device = nvme_interface.device_path
+    geometry = namespace_geometry(nvme_interface, device, nsid)
+    if geometry is None:
+        return None
+    key = (device, nsid, geometry.lba_size)
+    limits = _limits.get(key)
+    if limits is None:
+        idc = nvme_interface.identify_controller()
+        if idc is None:
+            return None
+        mdts = idc.mdts
+        max_bytes = DEFAULT_MPS << mdts if mdts else DEFAULT_MAX_TRANSFER
+        kernel = _max_hw_bytes(device, nsid)
+        if kernel:
+            max_bytes = min(max_bytes, kernel)
+        limits = _limits[key] = TransferLimits(geometry.lba_size, max_bytes, mdts)
+    return limits
+
+
+## @brief `(slba, nlb)` commands of at most `max_blocks` covering `nblocks` from `slba`.
+def split_extent(slba, nblocks, max_blocks):
+    end = slba + nblocks
+    for lba in range(slba, end, max_blocks):
+        yield lba, min(max_blocks, end - lba)
+
+
+## @class TransferStats
+#  Outcome of one sequential transfer.
+class TransferStats:
+    __slots__ = ("op", "bytes", "commands", "seconds")
+
+    def __init__(self, op, nbytes, commands, seconds):
+        self.op = op
+        self.bytes = nbytes
+        self.commands = commands
+        self.seconds = seconds
+
+    @property
+    def mb_per_s(self):
+        return self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+
+    def to_dict(self):
+        return {"op": self.op, "bytes": self.bytes, "commands": self.commands,
+                "seconds": round(self.seconds, 6), "mb_per_s": round(self.mb_per_s, 1)}
+
+
+## @class SequentialTransfer
+#  Splits reads and writes of any length into commands of `limits.max_blocks`
+#  over one reusable aligned buffer. `engine` is an I/O engine opened with
+#  block_size = limits.lba_size; up to `engine.queue_depth` commands (and at
+#  most as many as buffer slots) are in flight.
+class SequentialTransfer:
+    def __init__(self, engine, limits, buffer_size=DEFAULT_BUFFER_SIZE):
+        if engine.block_size != limits.lba_size:
+            raise ValueError(f"engine block size {engine.block_size} is not the LBA size {limits.lba_size}")
+        self.engine = engine
+        self.limits = limits
+        self.chunk = limits.max_bytes
+        slots = max(1, min(engine.queue_depth, buffer_size // self.chunk))
+        # Anonymous mmap: page aligned, so the kernel maps it for DMA without bouncing
+        self.buf = mmap.mmap(-1, slots * self.chunk)
+        view = memoryview(self.buf)
+        self._slots = [view[i * self.chunk:(i + 1) * self.chunk] for i in range(slots)]
+
+    @property
+    def slots(self):
+        return len(self._slots)
+
+    ## @brief The buffer slots, e.g. to prefill the data of `write()` once.
+    def views(self):
+        return list(self._slots)
+
+    async def _run(self, opcode, slba, nblocks, before=None, after=None):
+        bs = self.limits.lba_size
+        cursor = split_extent(slba, nblocks, self.limits.max_blocks)
+        submit = self.engine.submit
+
+        async def worker(slot):
+            commands = 0
+            for lba, nlb in cursor:
+                view = slot[:nlb * bs]
+                if before is not None:
+                    before(view, lba)
+                status, _ = await submit(opcode, lba, nlb, buf=view)
+                if status:
+                    raise NvmeIOError("read" if opcode == NVME_CMD_READ else "write", lba, status)
+                if after is not None:
+                    after(view, lba)
+                commands += 1
+            return commands
+
+        started = time.perf_counter()
+        commands = await asyncio.gather(*(worker(slot) for slot in self._slots))
+        return TransferStats("read" if opcode == NVME_CMD_READ else "write", nblocks * bs, sum(commands),
+                             time.perf_counter() - started)
+
+    ## @brief Write `nblocks` from `slba`. `fill(view, lba)` stamps the data of
+    #  each command into its slot first; without it the slots are written as
+    #  they are. Raises NvmeIOError on the first failed command.
+    async def write(self, slba, nblocks, fill=None):
+        return await self._run(NVME_CMD_WRITE, slba, nblocks, before=fill)
+
+    ## @brief Read `nblocks` from `slba`, handing each completed command's
+    #  data to `consume(view, lba)` before its slot is reused.
+    async def read(self, slba, nblocks, consume=None):
+        return await self._run(NVME_CMD_READ, slba, nblocks, after=consume)
+
+    ## @brief Write all of `data` (a whole number of blocks) from `slba`.
+    async def write_from(self, slba, data):
+        data = memoryview(data).cast('B')
+        bs = self.limits.lba_size
+        if len(data) % bs:
+            raise ValueError(f"{len(data)} bytes is not a whole number of {bs}-byte blocks")
+
+        def fill(view, lba):
+            offset = (lba - slba) * bs
+            view[:] = data[offset:offset + len(view)]
+        return await self.write(slba, len(data) // bs, fill)
+
+    ## @brief Read `len(out)` bytes (a whole number of blocks) from `slba` into `out`.
+    async def read_into(self, slba, out):
+        out = memoryview(out).cast('B')
+        bs = self.limits.lba_size
+        if len(out) % bs:
+            raise ValueError(f"{len(out)} bytes is not a whole number of {bs}-byte blocks")
+
+        def consume(view, lba):
+            offset = (lba - slba) * bs
+            out[offset:offset + len(view)] = view
+        return await self.read(slba, len(out) // bs, consume)
+
+    def close(self):
+        self._slots = []
+        try:
+            self.buf.close()
+        except BufferError:
+            pass  # a caller still holds a view; freed with it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+## @brief Open an I/O engine on `nsid` sized for sequential transfers;
+#  returns `(engine, SequentialTransfer)`. The caller closes both.
+def open_sequential(nvme_interface, nsid=1, queue_depth=8, buffer_size=DEFAULT_BUFFER_SIZE):
+    limits = transfer_limits(nvme_interface, nsid)
+    if limits is None:
+        raise RuntimeError(f"Cannot read the transfer limits of namespace {nsid}")
+    # Commands go straight to the transfer buffer: the engine's own slots stay one block
+    engine = nvme_interface.open_io_engine(nsid=nsid, queue_depth=queue_depth, block_size=limits.lba_size,
+                                           max_blocks=1)
+    try:
+        return engine, SequentialTransfer(engine, limits, buffer_size)
+    except Exception:
+        engine.close()
+        raise
+
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B").rstrip("I")
+    if text and text[-1] in _SIZE_SUFFIXES:
+        return int(float(text[:-1]) * _SIZE_SUFFIXES[text[-1]])
+    return int(text, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sequential read / write bandwidth at the maximum transfer size.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("-d", "--device", help="controller (e.g. /dev/nvme0); writes are destructive")
+    target.add_argument("--simulate", action="store_true")
+    parser.add_argument("--nsid", type=int, default=1)
+    parser.add_argument("--size", default="256M", help="bytes to transfer, K/M/G suffixes (default: %(default)s)")
+    parser.add_argument("--slba", type=int, default=0)
+    parser.add_argument("--mode", choices=("read", "write", "both"), default="read")
+    parser.add_argument("--queue-depth", type=int, default=8)
+    parser.add_argument("--buffer-size", default="64M", help="transfer buffer (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    from Test.admin_passthru_wrapper import AdminPassthruWrapper
+    from Test.nvme_simulator import SimulatedController
+    nvme_interface = SimulatedController() if args.simulate else AdminPassthruWrapper(args.device)
+    try:
+        engine, transfer = open_sequential(nvme_interface, args.nsid, args.queue_depth, parse_size(args.buffer_size))
+        with engine, transfer:
+            limits = transfer.limits
+            nblocks = max(1, parse_size(args.size) // limits.lba_size)
+            print(f"MDTS {limits.mdts}: {limits.max_bytes // 1024} KiB ({limits.max_blocks} x {limits.lba_size} B) "
+                  f"per command, {transfer.slots} buffer slot(s)")
+            modes = ("write", "read") if args.mode == "both" else (args.mode,)
+            for mode in modes:
+                stats = asyncio.run(getattr(transfer, mode)(args.slba, nblocks))
+                print(f"{mode:<5} {stats.bytes / (1 << 20):.0f} MiB in {stats.commands} commands, "
+                      f"{stats.seconds:.3f}s: {stats.mb_per_s:.1f} MB/s")
+    except (RuntimeError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        nvme_interface.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/bin/env python3.9
+import asyncio
+import logging
+import mmap
+import random
+import struct
+from Test.io_passthru_wrapper import NVME_CMD_READ, NVME_CMD_WRITE
+
+## @file workload.py
+#  Data-integrity workload: LBA-stamped, seeded-pattern payloads written and
+#  read back through an I/O engine, with every read verified.
+#
+#  Every block starts with a header (magic, generation, LBA, seed) followed
+#  by a window of one seeded random pattern, shifted by the LBA, so a block
+#  read from the wrong place, a stale block and flipped bits are all told
+#  apart. Payloads are stamped into buffers preallocated per queue slot
+#  (bytearray, or anonymous mmap) and the expected data is rebuilt in place,
+#  so no command allocates. A read is checked with one memcmp over the whole
+#  transfer; only a mismatching transfer is walked block by block.
+
+WORKLOAD_MAGIC = b"NVWL"
+BLOCK_HEADER = struct.Struct('<4sIQQ')  # magic, generation, lba, seed
+PATTERN_SHIFT = 64  # bytes the pattern window moves per LBA
+
+
+## @class Corruption
+#  One block that did not read back as written.
+#  kind: "unwritten" (no workload header), "misdirected" (header of another
+#  LBA, `found_lba`), "stale" (other seed / generation) or "data" (payload
+#  differs from byte `offset` on).
+class Corruption:
+    __slots__ = ("lba", "kind", "offset", "found_lba")
+
+    def __init__(self, lba, kind, offset=0, found_lba=None):
+        self.lba = lba
+        self.kind = kind
+        self.offset = offset
+        self.found_lba = found_lba
+
+    def to_dict(self):
+        return {"lba": self.lba, "kind": self.kind, "offset": self.offset, "found_lba": self.found_lba}
+
+    def __repr__(self):
+        return f"Corruption(lba={self.lba}, kind={self.kind!r}, offset={self.offset})"
+
+
+## @class LbaPattern
+#  Builds and checks the payload of any LBA for one (seed, generation).
+class LbaPattern:
+    def __init__(self, block_size, seed=0, generation=0):
+        if block_size <= BLOCK_HEADER.size:
+            raise ValueError(f"block size {block_size} too small for the block header")
+        self.block_size = block_size
+        self.seed = seed
+        self.generation = generation
+        # Twice a block, so the window of any LBA is one contiguous slice
+        self._pattern = memoryview(random.Random(seed).randbytes(2 * block_size))
+
+    def _window(self, lba):
+        start = (lba * PATTERN_SHIFT) % self.block_size
+        return self._pattern[start:start + self.block_size]
+
+    ## @brief Stamp the payload of blocks `slba`..`slba + nlb - 1` into `buf` at `offset`.
+    def fill(self, buf, offset, slba, nlb):
+        bs, pack = self.block_size, BLOCK_HEADER.pack_into
+        for i in range(nlb):
+            o = offset + i * bs
+            buf[o:o + bs] = self._window(slba + i)
+            pack(buf, o, WORKLOAD_MAGIC, self.generation, slba + i, self.seed)
+
+    ## @brief Why block `lba` (at `offset` of `data`) is not what `fill` wrote, or None.
+    def check_block(self, data, offset, lba, expected):
+        bs = self.block_size
+        block = data[offset:offset + bs]
+        magic, generation, found_lba, seed = BLOCK_HEADER.unpack_from(block)
+        if magic != WORKLOAD_MAGIC:
+            return Corruption(lba, "unwritten")
+        if found_lba != lba:
+            return Corruption(lba, "misdirected", found_lba=found_lba)
+        if seed != self.seed or generation != self.generation:
+            return Corruption(lba, "stale", found_lba=found_lba)
+        want = expected[offset:offset + bs]
+        if block == want:
+            return None
+        first = next(i for i in range(BLOCK_HEADER.size, bs) if block[i] != want[i])
+        return Corruption(lba, "data", offset=first)
+
+
+## @class SlotBuffers
+#  `slots` preallocated transfer buffers of `slot_size` bytes in one
+#  allocation (anonymous mmap with use_mmap: page aligned, outside the heap).
+class SlotBuffers:
+    def __init__(self, slots, slot_size, use_mmap=False):
+        self.slot_size = slot_size
+        self.use_mmap = use_mmap
+        self.buf = mmap.mmap(-1, slots * slot_size) if use_mmap else bytearray(slots * slot_size)
+        self._views = [memoryview(self.buf)[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+
+    def view(self, slot, nbytes=None):
+        view = self._views[slot]
+        return view if nbytes is None else view[:nbytes]
+
+    ## @brief Whether `nbytes` of `slot` equal the start of `other` (one memcmp, no copy).
+    def equals(self, slot, other, nbytes):
+        start = slot * self.slot_size
+        other = other[:nbytes]
+        if self.use_mmap:
+            return memoryview(self.buf)[start:start + nbytes] == other
+        return self.buf.startswith(other, start)
+
+    def close(self):
+        self._views = []
+        if self.use_mmap:
+            try:
+                self.buf.close()
+            except BufferError:
+                pass  # a caller still holds a view; freed with it
+
+
+## @class IntegrityWorkload
+#  Writes LBA-stamped payloads through an I/O engine and verifies what it
+#  reads back. Up to `engine.queue_depth` commands are in flight, each with
+#  its own preallocated write, read and expected-data buffer slot.
+class IntegrityWorkload:
+    def __init__(self, engine, seed=0, generation=0, use_mmap=False, max_corruptions=1000, logger=None):
+        self.engine = engine
+        self.block_size = engine.block_size
+        self.max_blocks = engine.max_blocks
+        self.pattern = LbaPattern(self.block_size, seed, generation)
+        self.logger = logger or logging.getLogger(__name__)
+        slot_size = self.block_size * self.max_blocks
+        self._write = SlotBuffers(engine.queue_depth, slot_size, use_mmap)
+        self._read = SlotBuffers(engine.queue_depth, slot_size, use_mmap)
+        self._expected = SlotBuffers(engine.queue_depth, slot_size, use_mmap)
+        self.max_corruptions = max_corruptions
+        self.corruptions = []
+        self.corrupted_blocks = 0
+        self.written_blocks = 0
+        self.verified_blocks = 0
+        self.failed_commands = 0
+        self._free = None
+        self._loop = None
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._free = asyncio.Queue()
+            for slot in range(self.engine.queue_depth):
+                self._free.put_nowait(slot)
+        return await self._free.get()
+
+    ## @brief Write the pattern of `nlb` blocks at `slba`; returns the NVMe status.
+    async def write(self, slba, nlb=1):
+        slot = await self._acquire()
+        try:
+            nbytes = nlb * self.block_size
+            self.pattern.fill(self._write.view(slot), 0, slba, nlb)
+            status, _ = await self.engine.submit(NVME_CMD_WRITE, slba, nlb, data=self._write.view(slot, nbytes))
+        finally:
+            self._free.put_nowait(slot)
+        if status:
+            self.failed_commands += 1
+        else:
+            self.written_blocks += nlb
+        return status
+
+    ## @brief Read `nlb` blocks at `slba` and check them against the pattern;
+    #  corrupted blocks are added to `corruptions`. Returns the NVMe status.
+    async def verify(self, slba, nlb=1):
+        slot = await self._acquire()
+        try:
+            nbytes = nlb * self.block_size
+            status, _ = await self.engine.submit(NVME_CMD_READ, slba, nlb, out=self._read.view(slot, nbytes))
+            if status:
+                self.failed_commands += 1
+                return status
+            expected = self._expected.view(slot)
+            self.pattern.fill(expected, 0, slba, nlb)
+            if not self._read.equals(slot, expected, nbytes):
+                self._locate(self._read.view(slot), expected, slba, nlb)
+            self.verified_blocks += nlb
+            return status
+        finally:
+            self._free.put_nowait(slot)
+
+    def _locate(self, data, expected, slba, nlb):
+        for i in range(nlb):
+            corruption = self.pattern.check_block(data, i * self.block_size, slba + i, expected)
+            if corruption is None:
+                continue
+            self.corrupted_blocks += 1
+            if len(self.corruptions) < self.max_corruptions:
+                self.corruptions.append(corruption)
+            self.logger.error("Corrupted LBA %d: %s (offset %d, found LBA %s)", corruption.lba, corruption.kind,
+                              corruption.offset, corruption.found_lba)
+
+    ## @brief write() every `(slba, nlb)` of `extents`, queue_depth at a time; statuses in order.
+    async def write_batch(self, extents):
+        return await asyncio.gather(*(self.write(slba, nlb) for slba, nlb in extents))
+
+    async def verify_batch(self, extents):
+        return await asyncio.gather(*(self.verify(slba, nlb) for slba, nlb in extents))
+
+    def report(self):
+        return {
+            "seed": self.pattern.seed,
+            "generation": self.pattern.generation,
+            "written_blocks": self.written_blocks,
+            "verified_blocks": self.verified_blocks,
+            "failed_commands": self.failed_commands,
+            "corrupted_blocks": self.corrupted_blocks,
+            "corrupted_lbas": sorted({c.lba for c in self.corruptions}),
+            "corruptions": [c.to_dict() for c in self.corruptions],
+        }
+
+    def close(self):
+        for buffers in (self._write, self._read, self._expected):
+            buffers.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,396 @@
+#!/bin/env python3.9
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from Test.admin_passthru_wrapper import AdminPassthruWrapper, NVME_NSID_ALL
+from Test.golden_reference import load_reference
+from Test.io_passthru_wrapper import NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_geometry import namespace_geometry
+from Test.nvme_identify import IdentifyController, NVME_ADMIN_IDENTIFY, NVME_ID_CNS_CTRL, NVME_IDENTIFY_DATA_SIZE
+from Test.nvme_log import SmartLog
+from Test.nvme_simulator import SimulatedController
+from Test.transfer import open_sequential, parse_size
+
+## @file benchmark.py
+#  Micro-benchmarks of the hot paths, against a drive or the simulator:
+#
+#  - passthru_identify / passthru_smart_log: one Admin Passthru command
+#  - decode_identify / decode_smart_log:     full decode of a captured page
+#  - reference_compare:                      golden reference compare of an id-ctrl page
+#  - nvme_cli_id_ctrl:                       the same Identify through `nvme id-ctrl -o json`
+#  - io_{read,write}_qd<N>:                  4 KiB random I/O through the I/O engine at queue depth N
+#  - seq_{read,write}:                       sequential transfer in MDTS-sized commands (time per MiB)
+#
+#  Every benchmark runs `--rounds` rounds; each round's time per operation is
+#  one sample. Results are saved as a JSON baseline (`--save`) and compared
+#  with an earlier one (`--compare`) using a Mann-Whitney U test on the round
+#  samples: a benchmark regresses when it is significantly slower (p < alpha)
+#  by more than `--threshold`. Exit code 1 when something regressed.
+#
+#      python benchmark.py --simulate --save baseline.json
+#      python benchmark.py --simulate --compare baseline.json
+#      python benchmark.py -d /dev/nvme0 --only passthru,decode --compare baseline.json
+#
+#  Writes to a real drive only with --allow-write.
+
+DEFAULT_QUEUE_DEPTHS = (1, 4, 16, 32)
+IO_SPAN_BLOCKS = 1 << 16  # random I/O stays in the first 64Ki LBAs
+SEQ_QUEUE_DEPTH = 8
+
+
+## @class Skip
+#  Raised by a benchmark that cannot run in this setup (reason in the message).
+class Skip(Exception):
+    pass
+
+
+## @class BenchContext
+#  What the benchmarks run against, plus the run parameters.
+class BenchContext:
+    def __init__(self, nvme_interface, device, simulated, queue_depths=DEFAULT_QUEUE_DEPTHS, io_count=256,
+                 allow_write=False, reference=None, seed=0, seq_size=16 << 20):
+        self.nvme_interface = nvme_interface
+        self.device = device
+        self.simulated = simulated
+        self.queue_depths = tuple(queue_depths)
+        self.io_count = io_count
+        self.allow_write = allow_write or simulated
+        self.reference = reference
+        self.seed = seed
+        self.seq_size = seq_size
+
+
+# Each benchmark is a context manager yielding `(op, ops_per_call)`: `op()` is
+# timed, and does `ops_per_call` operations. Setup and cleanup are not timed.
+# A benchmark that counts something else than commands (e.g. MiB) names it in
+# its `unit` attribute.
+
+@contextmanager
+def bench_passthru_identify(ctx):
+    send = ctx.nvme_interface.send_passthru_cmd
+    yield (lambda: send(NVME_ADMIN_IDENTIFY, NVME_IDENTIFY_DATA_SIZE, cdw10=NVME_ID_CNS_CTRL, copy=False)), 1
+
+
+@contextmanager
+def bench_passthru_smart_log(ctx):
+    get_smart_log = ctx.nvme_interface.get_smart_log
+    yield (lambda: get_smart_log(NVME_NSID_ALL)), 1
+
+
+def _identify_page(ctx):
+    data = ctx.nvme_interface.send_passthru_cmd(NVME_ADMIN_IDENTIFY, NVME_IDENTIFY_DATA_SIZE, cdw10=NVME_ID_CNS_CTRL)
+    if data is None:
+        raise Skip("Identify Controller failed")
+    return data
+
+
+@contextmanager
+def bench_decode_identify(ctx):
+    data = _identify_page(ctx)
+    yield (lambda: IdentifyController(data).to_dict()), 1
+
+
+@contextmanager
+def bench_decode_smart_log(ctx):
+    smart_log = ctx.nvme_interface.get_smart_log(NVME_NSID_ALL)
+    if smart_log is None:
+        raise Skip("SMART log not available")
+    data = bytes(smart_log.raw)
+    yield (lambda: SmartLog(data).to_dict()), 1
+
+
+@contextmanager
+def bench_reference_compare(ctx):
+    data = _identify_page(ctx)
+    golden = load_reference(ctx.reference, frozenset({"sn", "fguid", "unvmcap", "subnqn"}))
+    yield (lambda: golden.compare(data)), 1
+
+
+@contextmanager
+def bench_nvme_cli_id_ctrl(ctx):
+    nvme = shutil.which("nvme")
+    if nvme is None:
+        raise Skip("nvme-cli not installed")
+    command = [nvme, "id-ctrl", ctx.device, "-o", "json"]
+
+    def op():
+        json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+
+    try:
+        op()
+    except (subprocess.CalledProcessError, ValueError) as e:
+        raise Skip(f"{' '.join(command)} failed: {e}")
+    yield op, 1
+
+
+def _io_bench(opcode, queue_depth):
+    @contextmanager
+    def bench(ctx):
+        if opcode == NVME_CMD_WRITE and not ctx.allow_write:
+            raise Skip("writes to a real drive need --allow-write")
+        geometry = namespace_geometry(ctx.nvme_interface, ctx.device, nsid=1)
+        if geometry is None:
+            raise Skip("namespace 1 geometry not available")
+        rng = random.Random(ctx.seed)
+        span = min(geometry.nsze, IO_SPAN_BLOCKS)
+        commands = [(opcode, rng.randrange(span), 1) for _ in range(ctx.io_count)]
+        engine = ctx.nvme_interface.open_io_engine(nsid=1, queue_depth=queue_depth, block_size=geometry.lba_size)
+        loop = asyncio.new_event_loop()
+        try:
+            yield (lambda: loop.run_until_complete(engine.submit_batch(commands))), len(commands)
+        finally:
+            engine.close()
+            loop.close()
+    return bench
+
+
+def _seq_bench(opcode):
+    @contextmanager
+    def bench(ctx):
+        if opcode == NVME_CMD_WRITE and not ctx.allow_write:
+            raise Skip("writes to a real drive need --allow-write")
+        try:
+            engine, transfer = open_sequential(ctx.nvme_interface, nsid=1, queue_depth=SEQ_QUEUE_DEPTH)
+        except RuntimeError as e:
+            raise Skip(str(e))
+        nblocks = max(1, ctx.seq_size // transfer.limits.lba_size)
+        run = transfer.read if opcode == NVME_CMD_READ else transfer.write
+        loop = asyncio.new_event_loop()
+        try:
+            yield (lambda: loop.run_until_complete(run(0, nblocks))), nblocks * transfer.limits.lba_size / (1 << 20)
+        finally:
+            transfer.close()
+            engine.close()
+            loop.close()
+    bench.unit = "MiB"
+    return bench
+
+
+## @brief `(name, benchmark)` pairs for this context, in run order.
+def benchmarks(ctx):
+    found = [
+        ("passthru_identify", bench_passthru_identify),
+        ("passthru_smart_log", bench_passthru_smart_log),
+        ("decode_identify", bench_decode_identify),
+        ("decode_smart_log", bench_decode_smart_log),
+        ("reference_compare", bench_reference_compare),
+        ("nvme_cli_id_ctrl", bench_nvme_cli_id_ctrl),
+    ]
+    for queue_depth in ctx.queue_depths:
+        found.append((f"io_read_qd{queue_depth}", _io_bench(NVME_CMD_READ, queue_depth)))
+        found.append((f"io_write_qd{queue_depth}", _io_bench(NVME_CMD_WRITE, queue_depth)))
+    found.append(("seq_read", _seq_bench(NVME_CMD_READ)))
+    found.append(("seq_write", _seq_bench(NVME_CMD_WRITE)))
+    return found
+
+
+## @brief Time `op` for `rounds` rounds of about `min_time` seconds each.
+#  Returns the nanoseconds per operation of every round.
+def measure(op, ops_per_call, rounds=10, min_time=0.1, warmup=3):
+    for _ in range(warmup):
+        op()
+    # Calibrate the calls per round so that each round lasts about min_time
+    calls = 1
+    while True:
+        started = time.perf_counter_ns()
+        for _ in range(calls):
+            op()
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= min_time * 1e9 / 4 or calls >= 1 << 20:
+            break
+        calls *= 2
+    calls = max(1, int(calls * min_time * 1e9 / max(elapsed, 1)))
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        for _ in range(calls):
+            op()
+        samples.append((time.perf_counter_ns() - started) / (calls * ops_per_call))
+    return samples
+
+
+## @brief Statistics of the samples of one benchmark, in ns per `unit`.
+def describe(samples, unit="op"):
+    median = statistics.median(samples)
+    return {
+        "unit": f"ns/{unit}",
+        "samples": [round(s, 1) for s in samples],
+        "median": round(median, 1),
+        "mean": round(statistics.fmean(samples), 1),
+        "stdev": round(statistics.stdev(samples), 1) if len(samples) > 1 else 0.0,
+        "min": round(min(samples), 1),
+        "max": round(max(samples), 1),
+        "ops_per_s": round(1e9 / median, 1) if median else None,
+    }
+
+
+## @brief Run the benchmarks whose name starts with one of `only` (all when empty).
+def run_benchmarks(ctx, only=(), rounds=10, min_time=0.1, logger=None):
+    logger = logger or logging.getLogger(__name__)
+    results, skipped = {}, {}
+    for name, bench in benchmarks(ctx):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        try:
+            with bench(ctx) as (op, ops_per_call):
+                samples = measure(op, ops_per_call, rounds, min_time)
+        except Skip as e:
+            logger.info("%-22s skipped: %s", name, e)
+            skipped[name] = str(e)
+            continue
+        unit = getattr(bench, "unit", "op")
+        results[name] = describe(samples, unit)
+        logger.info("%-22s %12.1f ns/%-4s %12.1f %s/s", name, results[name]["median"], unit,
+                    results[name]["ops_per_s"], unit)
+    return results, skipped
+
+
+## @brief Two-sided Mann-Whitney U test (normal approximation, tie corrected).
+#  Returns the p-value that samples `a` and `b` come from the same distribution.
+def mann_whitney_u(a, b):
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 1.0
+    ranked = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    r1 = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+## @brief Compare current results with a baseline, benchmark by benchmark.
+#  `verdict` is "regression"/"improvement" when the medians differ by more
+#  than `threshold` (relative) and the difference is significant (p < alpha).
+def compare(baseline, current, threshold=0.05, alpha=0.01):
+    comparison = {}
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = now["median"] / before["median"] - 1 if before["median"] else 0.0
+        p_value = mann_whitney_u(before["samples"], now["samples"])
+        verdict = "unchanged"
+        if p_value < alpha and abs(change) > threshold:
+            verdict = "regression" if change > 0 else "improvement"
+        comparison[name] = {"baseline": before["median"], "current": now["median"],
+                            "change": round(change, 4), "p_value": round(p_value, 6), "verdict": verdict}
+    return comparison
+
+
+def print_comparison(comparison, out=sys.stdout):
+    print(f"{'benchmark':<22} {'baseline':>12} {'current':>12} {'change':>8} {'p':>9}  verdict", file=out)
+    for name, c in comparison.items():
+        print(f"{name:<22} {c['baseline']:>12.1f} {c['current']:>12.1f} {c['change']:>+8.1%} {c['p_value']:>9.2g}  "
+              f"{c['verdict']}", file=out)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the passthru, decoding and I/O hot paths.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("-d", "--device", help="controller to benchmark through Admin Passthru (e.g. /dev/nvme0)")
+    target.add_argument("--simulate", action="store_true", help="benchmark against the simulated controller (default)")
+    parser.add_argument("--only", help="comma separated benchmark name prefixes (e.g. passthru,io_read)")
+    parser.add_argument("--rounds", type=int, default=10, help="samples per benchmark (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per round (default: %(default)s)")
+    parser.add_argument("--queue-depths", default=",".join(map(str, DEFAULT_QUEUE_DEPTHS)),
+                        help="I/O queue depths (default: %(default)s)")
+    parser.add_argument("--io-count", type=int, default=256, help="I/O commands per timed batch")
+    parser.add_argument("--seq-size", default="16M", help="bytes per sequential transfer (default: %(default)s)")
+    parser.add_argument("--allow-write", action="store_true", help="run the write benchmarks on a real drive")
+    parser.add_argument("--reference", help="reference for reference_compare (default: id-ctrl-main_good.json)")
+    parser.add_argument("--save", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="relative slowdown that counts as a regression (default: %(default)s)")
+    parser.add_argument("--alpha", type=float, default=0.01, help="significance level (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+    logger = logging.getLogger("benchmark")
+    # The command logging of the hot paths is not what is being measured
+    quiet = logging.getLogger("benchmark.nvme")
+    quiet.setLevel(logging.WARNING)
+
+    if args.device:
+        nvme_interface = AdminPassthruWrapper(args.device, logger=quiet)
+    else:
+        nvme_interface = SimulatedController(logger=quiet)
+    reference = args.reference or os.path.join(os.path.dirname(os.path.abspath(__file__)), "Test",
+                                               "id-ctrl-main_good.json")
+    ctx = BenchContext(nvme_interface, nvme_interface.device_path, simulated=not args.device,
+                       queue_depths=[int(q) for q in args.queue_depths.split(",") if q.strip()],
+                       io_count=args.io_count, allow_write=args.allow_write, reference=reference,
+                       seq_size=parse_size(args.seq_size))
+    only = [p.strip() for p in args.only.split(",") if p.strip()] if args.only else []
+    try:
+        results, skipped = run_benchmarks(ctx, only, args.rounds, args.min_time, logger)
+    finally:
+        nvme_interface.close()
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "target": "simulator" if ctx.simulated else ctx.device,
+            "rounds": args.rounds, "min_time": args.min_time, "io_count": args.io_count,
+        },
+        "benchmarks": results,
+        "skipped": skipped,
+    }
+    if "nvme_cli_id_ctrl" in results and "passthru_identify" in results:
+        report["nvme_cli_vs_ioctl"] = round(results["nvme_cli_id_ctrl"]["median"] /
+                                            results["passthru_identify"]["median"], 1)
+        logger.info("nvme-cli id-ctrl costs %.1fx an ioctl Identify", report["nvme_cli_vs_ioctl"])
+
+    code = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        comparison = compare(baseline["benchmarks"], results, args.threshold, args.alpha)
+        report["comparison"] = {"baseline": args.compare, "results": comparison}
+        print_comparison(comparison)
+        if any(c["verdict"] == "regression" for c in comparison.values()):
+            code = 1
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        logger.info("Results saved to %s", args.save)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,523 @@
+#!/bin/env python3.9
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from test_manager import run_suite_on_device, summarize
+from test_suite_runner import STATUS, build_config, exit_code, write_summary
+from Test.log_pipeline import LoggingPipeline, results_log_file
+from Test.registry import default_registry
+
+## @file coordinator.py
+#  Runs a test plan across many test hosts: one coordinator hands out test
+#  runs to agent processes over TCP or Unix sockets, each agent runs them on
+#  its local drives and streams back every verdict with its command metrics.
+#
+#  A job is one run of one test (a result key: "Activity test1", or
+#  "Activity test1 #2" with repeat) on any drive of any agent. Once enough
+#  agents joined, the jobs are dealt longest-expected-first to the agent with
+#  the least expected work per drive (registry `estimated_duration`, replaced
+#  by the measured mean once a test has completed). An agent with a free drive
+#  takes the next job of its own queue; when that is empty it steals from the
+#  tail of the queue with the most expected work left. Jobs of an agent that
+#  disconnects go back to the pool (a job in flight is retried once). When no
+#  agent is connected for `idle_timeout` seconds while jobs are left, those
+#  jobs end as ERROR and the run stops.
+#
+#  Messages are JSON lines: hello (agent -> coordinator), job, started,
+#  result and shutdown.
+#
+#      python coordinator.py serve --listen tcp://0.0.0.0:7400 --plan plan.json --agents 3
+#      python coordinator.py agent --connect tcp://coordinator:7400 -d /dev/nvme0 -d /dev/nvme1 --passthru
+#
+#  On one machine, against simulated drives:
+#
+#      python coordinator.py serve --listen unix:///tmp/nvme.sock -t 1 -t 2 --repeat 4 --agents 2 &
+#      python coordinator.py agent --connect unix:///tmp/nvme.sock --simulate -d /dev/nvme0 -d /dev/nvme1 &
+#      python coordinator.py agent --connect unix:///tmp/nvme.sock --simulate -d /dev/nvme2
+#
+#  Exit codes of `serve` are those of test_suite_runner.py.
+
+DEFAULT_PORT = 7400
+MAX_MESSAGE = 1 << 24  # bytes per JSON line (results carry latency summaries)
+
+
+## @brief `("tcp", (host, port))` or `("unix", path)` from "tcp://host:port",
+#  "host:port", "unix:///path" or a path.
+def parse_address(address):
+    if address.startswith("unix://"):
+        return "unix", address[len("unix://"):]
+    if address.startswith("tcp://"):
+        address = address[len("tcp://"):]
+    elif os.sep in address:
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port) if port else DEFAULT_PORT)
+
+
+def _send(writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+
+
+async def _recv(reader):
+    # Next message, or None once the peer is gone
+    try:
+        line = await reader.readline()
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        return None
+    return json.loads(line) if line else None
+
+
+## @class Job
+#  One test run to schedule.
+class Job:
+    __slots__ = ("id", "key", "name", "options", "default_estimate", "attempts", "agent", "device", "verdict",
+                 "latency", "duration", "stolen", "error")
+
+    def __init__(self, job_id, key, name, options, default_estimate):
+        self.id = job_id
+        self.key = key
+        self.name = name
+        self.options = options
+        self.default_estimate = default_estimate
+        self.attempts = 0
+        self.agent = None
+        self.device = None
+        self.verdict = None
+        self.latency = None
+        self.duration = None
+        self.stolen = False
+        self.error = None
+
+    def to_dict(self):
+        return {"key": self.key, "agent": self.agent, "device": self.device, "verdict": self.verdict,
+                "duration_s": round(self.duration, 3) if self.duration is not None else None,
+                "attempts": self.attempts, "stolen": self.stolen, "error": self.error}
+
+
+## @brief Jobs of `tests` (`(name, spec, options)` as in test_suite_runner),
+#  with the same result keys as TestManager.result_keys().
+def plan_jobs(tests):
+    runs = Counter()
+    for name, _, options in tests:
+        runs[name] += int(options.get("repeat", 1))
+    jobs, seen, ids = [], Counter(), itertools.count(1)
+    for name, spec, options in tests:
+        extra = {k: v for k, v in options.items() if k != "repeat"}
+        for _ in range(int(options.get("repeat", 1))):
+            seen[name] += 1
+            key = name if runs[name] == 1 else f"{name} #{seen[name]}"
+            jobs.append(Job(next(ids), key, name, extra, float(spec.estimated_duration)))
+    return jobs
+
+
+## @class AgentLink
+#  Coordinator side of one connected agent.
+class AgentLink:
+    def __init__(self, name, writer, devices):
+        self.name = name
+        self.writer = writer
+        self.devices = list(devices)
+        self.queue = deque()   # jobs dealt to this agent, longest expected first
+        self.in_flight = {}    # job id -> Job
+        self.completed = 0
+        self.stolen = 0
+        self.busy = 0.0
+
+    @property
+    def slots(self):
+        return max(1, len(self.devices))
+
+
+## @class Coordinator
+#  Deals `jobs` to the agents that connect and collects their results.
+#  `min_agents` agents must join before the first job is dealt; agents that
+#  join later start by stealing. Without any agent for `idle_timeout`
+#  seconds (None: wait forever) the jobs left end as ERROR.
+class Coordinator:
+    def __init__(self, jobs, min_agents=1, max_attempts=2, idle_timeout=300.0, logger=None):
+        self.jobs = list(jobs)
+        self.min_agents = min_agents
+        self.max_attempts = max_attempts
+        self.idle_timeout = idle_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.agents = {}
+        self.pool = deque(sorted(self.jobs, key=lambda job: job.default_estimate, reverse=True))
+        self.started = False
+        self._durations = {}
+        self._remaining = len(self.jobs)
+        self._done = None
+        self._handlers = set()
+        self._idle = None
+
+    ## @brief Expected seconds of a run of test `name` (measured mean once known).
+    def estimate(self, job):
+        durations = self._durations.get(job.name)
+        return sum(durations) / len(durations) if durations else job.default_estimate
+
+    def backlog(self, link):
+        return sum(self.estimate(job) for job in link.queue)
+
+    def _deal(self):
+        # Longest expected job first, to the agent with the least expected work per drive
+        load = {name: self.backlog(link) for name, link in self.agents.items()}
+        jobs = sorted(self.pool, key=self.estimate, reverse=True)
+        self.pool.clear()
+        for job in jobs:
+            link = min(self.agents.values(), key=lambda a: (load[a.name] / a.slots, a.name))
+            link.queue.append(job)
+            load[link.name] += self.estimate(job)
+        for link in self.agents.values():
+            self.logger.info("Agent %s: %d jobs dealt (about %ds on %d drives)", link.name, len(link.queue),
+                             self.backlog(link), link.slots)
+
+    def _next_job(self, link):
+        if link.queue:
+            return link.queue.popleft()
+        if self.pool:
+            return self.pool.popleft()
+        victims = [a for a in self.agents.values() if a is not link and a.queue]
+        if not victims:
+            return None
+        victim = max(victims, key=self.backlog)
+        job = victim.queue.pop()
+        job.stolen = True
+        link.stolen += 1
+        self.logger.info("Agent %s steals %s from %s (%.1fs left there)", link.name, job.key, victim.name,
+                         self.backlog(victim))
+        return job
+
+    def _fill(self, link):
+        while self.started and len(link.in_flight) < link.slots:
+            job = self._next_job(link)
+            if job is None:
+                return
+            job.attempts += 1
+            job.agent = link.name
+            link.in_flight[job.id] = job
+            _send(link.writer, {"type": "job", "job": job.id, "key": job.key, "test": job.name,
+                                "options": job.options})
+
+    def _fill_all(self):
+        for link in sorted(self.agents.values(), key=lambda a: len(a.in_flight) / a.slots):
+            self._fill(link)
+
+    def _finish(self, job, verdict, link=None):
+        job.verdict = verdict
+        self._remaining -= 1
+        if link is not None:
+            link.completed += 1
+        self.logger.info("[%d/%d] %s on %s:%s: %s%s", len(self.jobs) - self._remaining, len(self.jobs), job.key,
+                         job.agent, job.device, verdict,
+                         f" in {job.duration:.1f}s" if job.duration is not None else "")
+        if not self._remaining:
+            self._done.set()
+
+    def _on_result(self, link, message):
+        job = link.in_flight.pop(message["job"], None)
+        if job is None:
+            return
+        job.device = message.get("device")
+        job.duration = message.get("duration")
+        job.latency = message.get("latency")
+        job.error = message.get("error")
+        if job.duration is not None:
+            link.busy += job.duration
+            self._durations.setdefault(job.name, []).append(job.duration)
+        self._finish(job, message.get("verdict", "ERROR"), link)
+
+    def _lost(self, link):
+        self.agents.pop(link.name, None)
+        self.logger.warning("Agent %s disconnected with %d jobs running and %d queued", link.name,
+                            len(link.in_flight), len(link.queue))
+        for job in link.in_flight.values():
+            if job.attempts >= self.max_attempts:
+                job.error = f"agent {link.name} lost while running it"
+                self._finish(job, "ERROR")
+            else:
+                self.pool.appendleft(job)
+        self.pool.extend(link.queue)
+        link.in_flight.clear()
+        link.queue.clear()
+        self._fill_all()
+        self._arm_idle()
+
+    def _arm_idle(self):
+        if self.idle_timeout is not None and not self.agents and self._remaining and self._idle is None:
+            self._idle = asyncio.get_running_loop().call_later(self.idle_timeout, self._give_up)
+
+    def _give_up(self):
+        self._idle = None
+        if self.agents:
+            return
+        self.logger.error("No agent connected for %.0fs: %d jobs not run", self.idle_timeout, self._remaining)
+        self.pool.clear()
+        for job in self.jobs:
+            if job.verdict is None:
+                job.error = f"no agent connected for {self.idle_timeout:.0f}s"
+                self._finish(job, "ERROR")
+
+    async def _handle(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        try:
+            await self._serve_agent(reader, writer)
+        finally:
+            self._handlers.discard(asyncio.current_task())
+
+    async def _serve_agent(self, reader, writer):
+        hello = await _recv(reader)
+        if not hello or hello.get("type") != "hello":
+            writer.close()
+            return
+        name = hello.get("agent") or "agent"
+        if name in self.agents:
+            name = f"{name}-{len(self.agents)}"
+        link = AgentLink(name, writer, hello.get("devices") or [])
+        self.agents[name] = link
+        if self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
+        self.logger.info("Agent %s joined with %d drives: %s", name, link.slots, ", ".join(link.devices))
+        if not self.started and len(self.agents) >= self.min_agents:
+            self.started = True
+            self._deal()
+            self._fill_all()
+        else:
+            self._fill(link)
+        try:
+            while True:
+                message = await _recv(reader)
+                if message is None:
+                    break
+                if message.get("type") == "started":
+                    job = link.in_flight.get(message["job"])
+                    if job is not None:
+                        job.device = message.get("device")
+                elif message.get("type") == "result":
+                    self._on_result(link, message)
+                    self._fill(link)
+        finally:
+            if self.agents.get(name) is link and not self._done.is_set():
+                self._lost(link)
+
+    async def serve(self, address):
+        """Serve until every job has a verdict; returns the run summary."""
+        self._done = asyncio.Event()
+        if not self.jobs:
+            self._done.set()
+        kind, where = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(where):
+                os.unlink(where)
+            server = await asyncio.start_unix_server(self._handle, where, limit=MAX_MESSAGE)
+        else:
+            server = await asyncio.start_server(self._handle, *where, limit=MAX_MESSAGE)
+        bound = server.sockets[0].getsockname() if server.sockets else where
+        self.logger.info("Coordinator listening on %s for %d jobs (%d agents to start)", bound, len(self.jobs),
+                         self.min_agents)
+        self._arm_idle()
+        try:
+            await self._done.wait()
+        finally:
+            if self._idle is not None:
+                self._idle.cancel()
+                self._idle = None
+            server.close()
+            for link in list(self.agents.values()):
+                _send(link.writer, {"type": "shutdown"})
+            # Agents hang up on shutdown, which ends their handlers
+            if self._handlers:
+                await asyncio.wait(list(self._handlers), timeout=5.0)
+            for link in list(self.agents.values()):
+                link.writer.close()
+            await server.wait_closed()
+            if kind == "unix" and os.path.exists(where):
+                os.unlink(where)
+        return self.summary()
+
+    def summary(self):
+        per_device, latency = {}, {}
+        for job in self.jobs:
+            device = f"{job.agent}:{job.device}" if job.agent else "unassigned"
+            per_device.setdefault(device, {})[job.key] = job.verdict or "NOT RUN"
+            if job.latency is not None:
+                latency.setdefault(device, {})[job.key] = job.latency
+        summary = summarize(per_device, latency)
+        summary["jobs"] = [job.to_dict() for job in self.jobs]
+        summary["agents"] = {}
+        for job in self.jobs:
+            if job.agent:
+                stats = summary["agents"].setdefault(job.agent, {"jobs": 0, "stolen": 0, "busy_s": 0.0})
+                stats["jobs"] += 1
+                stats["stolen"] += job.stolen
+                stats["busy_s"] = round(stats["busy_s"] + (job.duration or 0.0), 3)
+        return summary
+
+
+## @class Agent
+#  Runs the jobs of a coordinator on local drives, one job per drive at a
+#  time, each in a worker process (test_manager.run_suite_on_device).
+class Agent:
+    def __init__(self, devices, name=None, simulate=False, passthru=False, base_dir=None, db_path=None,
+                 smart_interval=None, logger=None):
+        self.devices = list(devices)
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.simulate = simulate
+        self.passthru = passthru
+        self.base_dir = base_dir
+        self.db_path = db_path
+        self.smart_interval = smart_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.completed = 0
+
+    async def _run_job(self, pool, message, device, writer):
+        loop = asyncio.get_running_loop()
+        _send(writer, {"type": "started", "job": message["job"], "device": device})
+        result = {"type": "result", "job": message["job"], "device": device, "latency": None, "error": None}
+        started = time.perf_counter()
+        try:
+            spec = default_registry().find(message["test"])
+            tests = [(spec.name, spec, 1, message.get("options") or {})]
+            outcome = await loop.run_in_executor(pool, run_suite_on_device, device, tests, self.passthru,
+                                                 self.base_dir, self.simulate, self.db_path, None,
+                                                 self.smart_interval)
+            result["verdict"] = outcome["results"].get(spec.name, "ERROR")
+            result["latency"] = outcome["latency"].get(spec.name)
+        except Exception as e:
+            self.logger.error("Job %s on %s failed: %s", message.get("key"), device, e)
+            result["verdict"] = "ERROR"
+            result["error"] = str(e)
+        result["duration"] = time.perf_counter() - started
+        self.completed += 1
+        self.logger.info("%s on %s: %s (%.1fs)", message.get("key"), device, result["verdict"], result["duration"])
+        _send(writer, result)
+        await writer.drain()
+
+    async def run(self, address):
+        """Serve the coordinator at `address` until it shuts the agent down."""
+        kind, where = parse_address(address)
+        if kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(where, limit=MAX_MESSAGE)
+        else:
+            reader, writer = await asyncio.open_connection(*where, limit=MAX_MESSAGE)
+        _send(writer, {"type": "hello", "agent": self.name, "devices": self.devices})
+        self.logger.info("Agent %s connected to %s with %s", self.name, address, ", ".join(self.devices))
+        free = deque(self.devices)
+        running = set()
+        with ProcessPoolExecutor(max_workers=len(self.devices)) as pool:
+            try:
+                while True:
+                    message = await _recv(reader)
+                    if message is None or message.get("type") == "shutdown":
+                        break
+                    if message.get("type") != "job":
+                        continue
+                    if not free:
+                        # The coordinator never sends more jobs than drives
+                        self.logger.error("No free drive for job %s", message.get("key"))
+                        continue
+                    device = free.popleft()
+                    task = asyncio.ensure_future(self._run_job(pool, message, device, writer))
+                    running.add(task)
+                    task.add_done_callback(lambda t, d=device: (running.discard(t), free.append(d)))
+            finally:
+                if running:
+                    await asyncio.gather(*running, return_exceptions=True)
+                writer.close()
+        return self.completed
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run test plans across test hosts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("serve", help="coordinate a test plan")
+    p.add_argument("--listen", default=f"tcp://127.0.0.1:{DEFAULT_PORT}",
+                   help="tcp://HOST:PORT or unix:///PATH (default: %(default)s)")
+    p.add_argument("--agents", type=int, default=1, help="agents to wait for before dealing jobs")
+    p.add_argument("--plan", help="YAML or JSON test plan (its 'tests', 'repeat' and 'reference')")
+    p.add_argument("-t", "--test", action="append", dest="tests", help="test number, name or class (repeatable)")
+    p.add_argument("--repeat", type=int, help="run every test this many times")
+    p.add_argument("--reference", help="reference for Activity test1 (path on the agents)")
+    p.add_argument("--summary", help="write the JSON summary to this file ('-' for stdout)")
+    p.add_argument("--idle-timeout", type=float, default=300.0,
+                   help="seconds without any agent before the jobs left end as ERROR (default: %(default)s)")
+
+    p = sub.add_parser("agent", help="run jobs of a coordinator on local drives")
+    p.add_argument("--connect", default=f"tcp://127.0.0.1:{DEFAULT_PORT}", help="coordinator address")
+    p.add_argument("-d", "--device", action="append", dest="devices", help="drive to run jobs on (repeatable)")
+    p.add_argument("--name", help="agent name (default: host-pid)")
+    p.add_argument("--simulate", action="store_true", help="run against in-process simulated controllers")
+    p.add_argument("--passthru", action="store_true", help="use Admin Passthru")
+    p.add_argument("--results-dir", help="base directory for per-device logs")
+    p.add_argument("--db", help="store the results in this local results database too")
+    p.add_argument("--smart-interval", type=float, help="sample the SMART log every N seconds while each test runs")
+    p.add_argument("--retry", type=float, default=0.0, help="seconds to keep retrying the connection")
+    return parser.parse_args(argv)
+
+
+def _tests(args):
+    # Same test selection and plan handling as test_suite_runner.py
+    runner_args = argparse.Namespace(plan=args.plan, tests=args.tests, repeat=args.repeat, reference=args.reference,
+                                     devices=None, jobs=None, passthru=None, simulate=None, results_dir=None,
+                                     summary=None, smart_interval=None, db=None, no_db=True)
+    return build_config(runner_args)["tests"]
+
+
+async def _connect_and_run(agent, address, retry):
+    deadline = time.monotonic() + retry
+    while True:
+        try:
+            return await agent.run(address)
+        except (ConnectionError, FileNotFoundError):
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    log_file = results_log_file(getattr(args, "results_dir", None), f"coordinator_{args.command}")
+    with LoggingPipeline(name=f"coordinator_{args.command}", log_file=log_file, console=sys.stderr,
+                         events=False) as pipeline:
+        logger = pipeline.logger
+        if args.command == "agent":
+            agent = Agent(args.devices or ["/dev/nvme0"], args.name, args.simulate, args.passthru, args.results_dir,
+                          args.db, args.smart_interval, logger)
+            try:
+                completed = asyncio.run(_connect_and_run(agent, args.connect, args.retry))
+            except OSError as e:
+                logger.error("Cannot reach the coordinator at %s: %s", args.connect, e)
+                return 3
+            logger.info("Agent %s done: %d jobs", agent.name, completed)
+            return 0
+
+        try:
+            tests = _tests(args)
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}. Exiting...", file=sys.stderr)
+            return 2
+        started = time.time()
+        coordinator = Coordinator(plan_jobs(tests), min_agents=args.agents, idle_timeout=args.idle_timeout,
+                                  logger=logger)
+        summary = asyncio.run(coordinator.serve(args.listen))
+        code = exit_code(summary)
+        summary.update({"status": STATUS[code], "exit_code": code,
+                        "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+                        "duration_s": round(time.time() - started, 3)})
+        if args.summary:
+            write_summary(summary, args.summary)
+        logger.info("Run %s (exit code %d)", summary["status"], code)
+        return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,57 +1,244 @@
 #!/bin/env python3.9
 
 import logging
-import sys
 import os
-from datetime import datetime
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from Test.latency import metrics
+from Test.log_pipeline import LoggingPipeline, NullEventStream, device_results_dir, results_log_file
+from Test.results_db import RecordingEventStream, ResultsDB, device_identity
+from Test.smart_sampler import SmartSampler
+from Test.nvme_topology import resolve_device
+from Test.registry import TestSpec, device_features, metadata_of, plan_tests
 
-#def setup_logger(name='test_manager_logger', log_file='test_manager.log', level=logging.DEBUG):
-    
-def setup_logger(name='test_manager_logger', base_dir=None, level=logging.DEBUG):
-    if base_dir is None:
-        base_dir = os.environ.get("NVME_PROJECT_RESULT_DIR") or os.path.join(os.path.expanduser("~"), "NVME_RESULTS")
-    #Create folder with date
-    fecha_hoy = datetime.now().strftime('%Y-%m-%d')
-    log_dir = os.path.join(base_dir, fecha_hoy)
-    os.makedirs(log_dir, exist_ok=True)
+## @brief Process-pool worker: run `tests` against one controller.
+#  Builds its own logging pipeline (one log file per device, plus per-test
+#  JSONL event streams next to it) and, if requested, its own
+#  AdminPassthruWrapper, and returns the per-test verdicts for that device.
+#  With `simulate` the device is an in-process SimulatedController instead;
+#  with `db_path` the results are stored under run `run_id` of that database.
+#  The tests write their files to the device's own directory under `base_dir`
+#  (see log_pipeline.device_results_dir).
+def run_suite_on_device(device, tests, use_passthru=False, base_dir=None, simulate=False, db_path=None, run_id=None,
+                        smart_interval=None):
+    from Test.admin_passthru_wrapper import AdminPassthruWrapper
+    from Test.nvme_simulator import SimulatedController
 
-    # File name with time
-    log_file = os.path.join(log_dir, f'test_manager_{datetime.now().strftime("%H-%M-%S")}.log')
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
+    tag = os.path.basename(device)
+    pipeline = LoggingPipeline(name=f'test_manager_{tag}', log_file=results_log_file(base_dir, tag))
+    logger = pipeline.logger
+    results_db = ResultsDB(db_path) if db_path else None
+    results_dir = device_results_dir(base_dir, device)
+    os.makedirs(results_dir, exist_ok=True)
+    if simulate:
+        admin_wrapper = SimulatedController(device, logger=logger)
+    else:
+        admin_wrapper = AdminPassthruWrapper(device, logger=logger) if use_passthru else None
+    try:
+        tm = TestManager(admin_wrapper=admin_wrapper, logger=logger, device=device, events=pipeline.events,
+                         results_db=results_db, run_id=run_id, smart_interval=smart_interval,
+                         results_dir=results_dir)
+        for name, test_class, repeat, options in tests:
+            tm.add_test(name, test_class, repeat, **options)
+        results = tm.run_all()
+        latency = tm.latency
+    finally:
+        if admin_wrapper:
+            admin_wrapper.close()
+        if results_db:
+            results_db.close()
+        pipeline.close()
+    return {"device": device, "results": results, "latency": latency}
 
-    # Console Handler
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.INFO)
 
-    # File Handler
-    fh = logging.FileHandler(log_file)
-    fh.setLevel(level)
-
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-
-    if not logger.handlers:
-        logger.addHandler(ch)
-        logger.addHandler(fh)
-
-    return logger
+## @brief Per-device verdicts plus, per test, how many devices ended with each verdict.
+#  `latency` (per device, per test; see TestManager.latency) is added when given.
+def summarize(per_device, latency=None):
+    keys = []
+    for results in per_device.values():
+        keys.extend(key for key in results if key not in keys)
+    totals = {key: dict(Counter(results[key] for results in per_device.values() if key in results))
+              for key in keys}
+    summary = {"devices": per_device, "totals": totals}
+    if latency:
+        summary["latency"] = latency
+    return summary
 
 
 class TestManager:
-    def __init__(self, admin_wrapper=None, logger=None):
+    def __init__(self, admin_wrapper=None, logger=None, device=None, devices=None, events=None,
+                 results_db=None, run_id=None, smart_interval=None, results_dir=None):
         self.logger = logger or logging.getLogger(__name__)
+        # Per-test JSONL event stream (see Test/log_pipeline.py)
+        self.events = events or NullEventStream()
+        # Optional ResultsDB: one row per test execution under run `run_id`
+        self.results_db = results_db
+        self.run_id = run_id
+        # Seconds between background SMART samples during each test (None = off)
+        self.smart_interval = smart_interval
+        # Where the tests write their files (None: the current directory)
+        self.results_dir = results_dir
+        # Per test key: command latency / bytes / errors by device and opcode (see Test/latency.py)
+        self.latency = {}
         self.admin_wrapper = admin_wrapper
+        # Drives can be given by path (/dev/nvme0), controller name or serial number
+        self.device = resolve_device(device or getattr(admin_wrapper, "device_path", None) or "/dev/nvme0")
+        self.devices = [resolve_device(d) for d in devices] if devices else [self.device]
         self.tests = []
 
-    def add_test(self, name, test_class):
-        self.tests.append((name, test_class))
+    ## @brief Register a test: its class or a registry TestSpec (imported only
+    #  when it runs). `repeat` runs it several times in a row; any other keyword
+    #  (e.g. `reference` for Activitytest1) is passed to the test's constructor.
+    def add_test(self, name, test_class, repeat=1, **options):
+        self.tests.append((name, test_class, repeat, options))
+
+    ## @brief Result keys of the registered tests: the test name, or "name #i" when it runs more than once.
+    def result_keys(self):
+        runs = Counter()
+        for name, _, repeat, _ in self.tests:
+            runs[name] += repeat
+        keys, seen = [], Counter()
+        for name, _, repeat, _ in self.tests:
+            for _ in range(repeat):
+                seen[name] += 1
+                keys.append(name if runs[name] == 1 else f"{name} #{seen[name]}")
+        return keys
+
+    ## @brief Execution plan from the tests' metadata: `(entries, skipped)` where
+    #  entries are `(name, test, options, keys)` in run order (non-destructive
+    #  tests first) and skipped maps the keys of tests that cannot run to the reason.
+    def plan(self):
+        keys = iter(self.result_keys())
+        entries = [(name, test, options, [next(keys) for _ in range(repeat)])
+                   for name, test, repeat, options in self.tests]
+        features = None
+        if any(metadata_of(test)["features"] for _, test, _, _ in entries):
+            features = device_features(self.admin_wrapper)
+        ordered, skipped = plan_tests(entries, passthru_available=self.admin_wrapper is not None, features=features)
+        skipped_keys = {}
+        for name, test, options, entry_keys in entries:
+            if name in skipped:
+                skipped_keys.update((key, skipped[name]) for key in entry_keys)
+        estimate = sum(metadata_of(test)["estimated_duration"] * len(entry_keys)
+                       for _, test, _, entry_keys in ordered)
+        self.logger.info("Plan: %s (about %ds)", ", ".join(k for *_, entry_keys in ordered for k in entry_keys) or "-",
+                         estimate)
+        return ordered, skipped_keys
 
     def run_all(self):
+        """Run the registered tests one after another on `self.device`.
+
+        Returns a dict mapping test name to its verdict ("PASSED", "FAILED",
+        "NOT RUN", "SKIPPED" when the device or interface lacks what the test
+        requires, or "ERROR" when the test raised).
+        """
         self.logger.info("Starting Test Manager...")
-        for name, test_class in self.tests:
-            self.logger.info(f"Running test: {name}")
-            test_instance = test_class(self.admin_wrapper, logger=self.logger)
-            test_instance.run()
+        results = {}
+        events = self.events
+        if self.results_db is not None:
+            # Keep the mismatches / SMART snapshots each test emits for its database row
+            events = RecordingEventStream(self.events)
+            identity = device_identity(self.admin_wrapper, self.device)
+            if self.run_id is None:
+                self.run_id = self.results_db.start_run({"devices": [self.device], "tests": self.result_keys()})
+        ordered, skipped = self.plan()
+        for key, reason in skipped.items():
+            events.start_test(key)
+            self.logger.warning("Skipping test %s: %s", key, reason)
+            results[key] = "SKIPPED"
+            events.end_test(device=self.device, verdict="SKIPPED", reason=reason)
+            if self.results_db is not None:
+                self._record(key, "SKIPPED", identity, time.time(), events)
+        for name, test, options, entry_keys in ordered:
+            for key in entry_keys:
+                events.start_test(key)
+                self.logger.info("Running test: %s", key)
+                started = time.time()
+                before = metrics.snapshot()
+                sampler = self._start_sampler()
+                try:
+                    # Registry specs import their module only now
+                    test_class = test.load() if isinstance(test, TestSpec) else test
+                    test_instance = test_class(self.admin_wrapper, logger=self.logger, device=self.device,
+                                               events=events, **options)
+                    # Tests may read the SMART time series while they run
+                    test_instance.smart_sampler = sampler
+                    test_instance.results_dir = self.results_dir
+                    test_instance.run()
+                    results[key] = getattr(test_instance, "result", "NOT RUN")
+                except Exception as e:
+                    self.logger.exception("Test %s aborted: %s", key, e)
+                    results[key] = "ERROR"
+                finally:
+                    if sampler:
+                        sampler.stop()
+                        events.emit("smart_series", **sampler.buffer.summary())
+                self.latency[key] = metrics.since(before)
+                self._log_latency(key, self.latency[key])
+                events.end_test(device=self.device, verdict=results[key], latency=self.latency[key])
+                if self.results_db is not None:
+                    self._record(key, results[key], identity, started, events, self.latency[key])
+        self.logger.info("Test Manager finished.")
+        # Report in registration order, whatever order they ran in
+        return {key: results[key] for key in self.result_keys()}
+
+    def _start_sampler(self):
+        if not self.smart_interval:
+            return None
+        if not hasattr(self.admin_wrapper, "get_smart_log"):
+            self.logger.debug("SMART sampling needs Admin Passthru; not sampling")
+            return None
+        return SmartSampler(self.admin_wrapper, interval=self.smart_interval, logger=self.logger).start()
+
+    def _log_latency(self, key, latency):
+        for device, ops in latency.items():
+            for op, s in ops.items():
+                self.logger.info("%s %s %s: n=%d bytes=%d errors=%d p50=%.1fus p99=%.1fus p999=%.1fus",
+                                 key, device, op, s["count"], s["bytes"], s["errors"],
+                                 s["p50_us"], s["p99_us"], s["p999_us"])
+
+    def _record(self, key, verdict, identity, started, events, latency=None):
+        try:
+            self.results_db.record_test(self.run_id, key, verdict, device=self.device, identity=identity,
+                                        started=started, duration=time.time() - started,
+                                        mismatches=events.mismatches, smart=events.smart, latency=latency)
+        except sqlite3.Error as e:
+            # A results database problem must not change the verdict
+            self.logger.error("Could not store result of %s: %s", key, e)
+
+    def run_parallel(self, use_passthru=False, base_dir=None, max_workers=None, simulate=False, db_path=None):
+        """Run the registered tests on every controller in `self.devices` at once.
+
+        One worker process per drive; each gets its own logger, wrapper and
+        result (`simulate` runs every worker against a SimulatedController).
+        With `db_path` every worker stores its results in that database, under
+        `self.run_id`.
+        Returns a summary with the per-device verdicts and, per test,
+        how many devices ended with each verdict.
+        """
+        self.logger.info(f"Starting Test Manager on {len(self.devices)} devices...")
+        per_device, latency = {}, {}
+        with ProcessPoolExecutor(max_workers=max_workers or len(self.devices)) as pool:
+            futures = {
+                pool.submit(run_suite_on_device, device, self.tests, use_passthru, base_dir, simulate,
+                            db_path, self.run_id, self.smart_interval): device
+                for device in self.devices
+            }
+            for future, device in futures.items():
+                try:
+                    outcome = future.result()
+                    per_device[device] = outcome["results"]
+                    latency[device] = outcome["latency"]
+                except Exception as e:
+                    self.logger.error(f"Worker for {device} failed: {e}")
+                    per_device[device] = {key: "ERROR" for key in self.result_keys()}
+
+        summary = summarize(per_device, latency)
+        for device, results in per_device.items():
+            self.logger.info(f"{device}: " + ", ".join(f"{name}={verdict}" for name, verdict in results.items()))
+        for name, counts in summary["totals"].items():
+            self.logger.info(f"{name}: " + ", ".join(f"{verdict}={n}" for verdict, n in sorted(counts.items())))
         self.logger.info("Test Manager finished.")
+        return summary
@@ -1,54 +1,274 @@
 #!/bin/env python3.9
+import argparse
+import json
 import logging
 import os
+import sys
+import time
 from datetime import datetime
-from test_manager import TestManager
+from test_manager import TestManager, summarize
 from Test.admin_passthru_wrapper import AdminPassthruWrapper
-from Test.Activity_test1 import Activitytest1
-from Test.Activity_test2 import Activitytest2
-from Test.Activity_test3 import Activitytest3
+from Test.log_pipeline import LoggingPipeline, device_results_dir
+from Test.nvme_simulator import SimulatedController
+from Test.registry import default_registry
+from Test.results_db import ResultsDB, default_db_path
+
+## @file test_suite_runner.py
+#  Runs the test suite interactively (no arguments, on a terminal) or headless
+#  from command-line arguments and/or a YAML/JSON test plan, e.g.:
+#
+#      devices: [/dev/nvme0, /dev/nvme1]
+#      passthru: true
+#      jobs: 2
+#      summary: results.json
+#      tests:
+#        - test: 1
+#          reference: id-ctrl-main_good.json
+#          repeat: 3
+#        - "Activity test2"
+#
+#  Results are also stored in the results database (Test/results_db.py;
+#  `--db PATH`, `db:` in the plan, `--no-db` / `db: false` to skip it).
+#
+#  Tests come from the lazy registry (Test/registry.py): only the selected
+#  ones are imported, and tests the device or interface cannot run (no
+#  passthru, missing controller feature) are reported as SKIPPED.
+#
+#  Exit codes: 0 every test passed (or was skipped), 1 some test failed,
+#  2 bad arguments or plan, 3 some test raised or did not run.
+
+EXIT_PASSED = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+STATUS = {EXIT_PASSED: "PASSED", EXIT_FAILED: "FAILED", EXIT_ERROR: "ERROR"}
+
+
+## @brief Find a test by menu number, display name or class name ("1", "Activity test1", "Activitytest1").
+#  Returns `(name, spec)`; the test module is not imported yet.
+def resolve_test(selector):
+    try:
+        spec = default_registry().find(selector)
+    except KeyError as e:
+        raise ValueError(e.args[0]) from None
+    return spec.name, spec
+
+
+def list_tests():
+    for spec in default_registry():
+        flags = [flag for flag in ("destructive", "requires_passthru") if spec.metadata[flag]]
+        flags += [f"needs {feature}" for feature in spec.features]
+        print(f"{spec.key or '-'}) {spec.name} (~{spec.estimated_duration}s{'; ' if flags else ''}{', '.join(flags)})")
 
-if __name__ == "__main__":
-    # Logs config
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, f"test_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
 
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
-    logger = logging.getLogger(__name__)
+## @brief Load a test plan (.yaml/.yml needs PyYAML, anything else is read as JSON).
+def load_plan(path):
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required for YAML test plans (pip install pyyaml), or use JSON")
+            plan = yaml.safe_load(f)
+        else:
+            plan = json.load(f)
+    if not isinstance(plan, dict):
+        raise ValueError(f"{path}: a test plan must be a mapping")
+    return plan
 
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the NVMe test suite without prompts.")
+    parser.add_argument("--plan", help="YAML or JSON test plan; command-line options override it")
+    parser.add_argument("-d", "--device", action="append", dest="devices",
+                        help="controller path or serial number (repeatable; more than one runs in parallel)")
+    parser.add_argument("-t", "--test", action="append", dest="tests",
+                        help="test number, name or class (repeatable)")
+    parser.add_argument("--reference", help="reference id-ctrl JSON (or .bin golden image) for Activity test1")
+    parser.add_argument("--repeat", type=int, help="run every test this many times")
+    parser.add_argument("-j", "--jobs", type=int, help="parallel worker processes (default: one per device)")
+    parser.add_argument("--passthru", action="store_const", const=True, help="use Admin Passthru")
+    parser.add_argument("--no-passthru", action="store_const", const=False, dest="passthru", help="use nvme-cli")
+    parser.add_argument("--simulate", action="store_const", const=True,
+                        help="run against in-process simulated controllers")
+    parser.add_argument("--results-dir", help="base directory for per-device logs")
+    parser.add_argument("--summary", help="write the JSON summary to this file ('-' for stdout)")
+    parser.add_argument("--smart-interval", type=float,
+                        help="sample the SMART log every N seconds while each test runs (passthru/simulator)")
+    parser.add_argument("--db", help="results database (default: <results dir>/results.db)")
+    parser.add_argument("--no-db", action="store_true", help="do not store results in the database")
+    parser.add_argument("--list-tests", action="store_true", help="list the available tests and exit")
+    return parser.parse_args(argv)
+
+
+## @brief Merge the plan file and the command line into one run configuration.
+def build_config(args):
+    plan = load_plan(args.plan) if args.plan else {}
+    config = {
+        "devices": args.devices or plan.get("devices") or ["/dev/nvme0"],
+        "passthru": args.passthru if args.passthru is not None else bool(plan.get("passthru", False)),
+        "simulate": args.simulate or bool(plan.get("simulate", False)),
+        "jobs": args.jobs or plan.get("jobs"),
+        "results_dir": args.results_dir or plan.get("results_dir"),
+        "summary": args.summary or plan.get("summary"),
+        "smart_interval": args.smart_interval or plan.get("smart_interval"),
+    }
+    if isinstance(config["devices"], str):
+        config["devices"] = [config["devices"]]
+    if args.no_db or plan.get("db") is False:
+        config["db"] = None
+    else:
+        config["db"] = args.db or plan.get("db") or default_db_path(config["results_dir"])
+    repeat = args.repeat or plan.get("repeat", 1)
+
+    tests = []
+    for entry in args.tests or plan.get("tests") or []:
+        entry = dict(entry) if isinstance(entry, dict) else {"test": entry}
+        name, spec = resolve_test(entry.pop("test", entry.pop("name", "")))
+        options = {"repeat": int(entry.pop("repeat", repeat))}
+        reference = args.reference or entry.pop("reference", None) or plan.get("reference")
+        if reference and "reference" in spec.options:
+            options["reference"] = reference
+        options.update(entry)
+        if options["repeat"] < 1:
+            raise ValueError(f"{name}: repeat must be at least 1")
+        tests.append((name, spec, options))
+    if not tests:
+        raise ValueError("No tests selected (use --test or a 'tests' list in the plan)")
+    config["tests"] = tests
+    return config
+
+
+## @brief Interactive mode: the same configuration, asked on the terminal.
+def ask_config():
     # Question if to use Admin Passthru
     use_passthru = input("Do you want to use Admin Passthru? (y/n): ").strip().lower() == 'y'
-    admin_wrapper = AdminPassthruWrapper("/dev/nvme0") if use_passthru else None
-    
-    # Create an instance of the TestManager
-    tm = TestManager(admin_wrapper=admin_wrapper)
 
-    # Record all tests
-    available_tests = {
-        "1": ("Activity test1", Activitytest1),
-        "2": ("Activity test2", Activitytest2),
-        "3": ("Activity test3", Activitytest3)
-    }
+    # Controllers to test; more than one runs the suite on all of them in parallel
+    devices = [d.strip() for d in input("Devices to test, comma separated [/dev/nvme0]: ").split(",") if d.strip()]
 
     # Show selection menu
     print("\nAvailable tests:")
-    for key, (name, _) in available_tests.items():
-        print(f"{key}) {name}")
+    list_tests()
 
-    choice = input("Select the test to run (1-3): ").strip()
+    choice = input("Select the test to run: ").strip()
 
     # Validate selection
-    if choice in available_tests:
-        name, test_class = available_tests[choice]
-        tm.add_test(name, test_class)
-        tm.run_all()
-    else:
-        print("❌ Invalid selection. Exiting...")
+    if not choice:
+        raise ValueError("Invalid selection")
+    name, spec = resolve_test(choice)
+    return {"devices": devices or ["/dev/nvme0"], "passthru": use_passthru, "simulate": False, "jobs": None,
+            "results_dir": None, "summary": None, "db": default_db_path(), "smart_interval": None,
+            "tests": [(name, spec, {"repeat": 1})]}
+
+
+## @brief Run the configured suite; returns the summary dict (see TestManager.run_parallel).
+def run(config, logger, events=None):
+    devices = config["devices"]
+    results_db = ResultsDB(config["db"]) if config.get("db") else None
+    run_id = None
+    if results_db:
+        run_id = results_db.start_run({
+            "devices": devices, "tests": [[name, options] for name, _, options in config["tests"]],
+            "passthru": config["passthru"], "simulate": config["simulate"], "argv": sys.argv[1:]})
+    admin_wrapper = None
+    if len(devices) == 1:
+        if config["simulate"]:
+            admin_wrapper = SimulatedController(devices[0], logger=logger)
+        elif config["passthru"]:
+            admin_wrapper = AdminPassthruWrapper(devices[0], logger=logger)
+
+    # Create an instance of the TestManager
+    results_dir = None
+    if len(devices) == 1:
+        results_dir = device_results_dir(config["results_dir"], devices[0])
+        os.makedirs(results_dir, exist_ok=True)
+    tm = TestManager(admin_wrapper=admin_wrapper, logger=logger, device=devices[0], devices=devices, events=events,
+                     results_db=results_db, run_id=run_id, smart_interval=config.get("smart_interval"),
+                     results_dir=results_dir)
+    for name, spec, options in config["tests"]:
+        tm.add_test(name, spec, **options)
+    try:
+        if len(devices) > 1:
+            summary = tm.run_parallel(use_passthru=config["passthru"], base_dir=config["results_dir"],
+                                      max_workers=config["jobs"], simulate=config["simulate"], db_path=config.get("db"))
+        else:
+            summary = summarize({devices[0]: tm.run_all()}, {devices[0]: tm.latency})
+        if results_db:
+            results_db.finish_run(run_id, STATUS[exit_code(summary)])
+            summary.update({"db": config["db"], "run_id": run_id})
+        return summary
+    finally:
+        if admin_wrapper:
+            admin_wrapper.close()
+        if results_db:
+            results_db.close()
+
+
+def exit_code(summary):
+    verdicts = [verdict for results in summary["devices"].values() for verdict in results.values()]
+    if any(verdict not in ("PASSED", "FAILED", "SKIPPED") for verdict in verdicts):
+        return EXIT_ERROR
+    if "FAILED" in verdicts:
+        return EXIT_FAILED
+    return EXIT_PASSED
+
+
+def write_summary(summary, path):
+    text = json.dumps(summary, indent=2)
+    if path == "-":
+        print(text)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text + "\n")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Logs config
+    log_dir = "logs"
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"test_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+
+    # Records are formatted and written by a background listener thread
+    with LoggingPipeline(name="test_suite_runner", log_file=log_file,
+                         console=sys.stderr, console_level=logging.DEBUG) as pipeline:
+        return _main(argv, pipeline, log_file)
+
+
+def _main(argv, pipeline, log_file):
+    logger = pipeline.logger
+    try:
+        if not argv and sys.stdin.isatty():
+            config = ask_config()
+        else:
+            args = parse_args(argv)
+            if args.list_tests:
+                list_tests()
+                return EXIT_PASSED
+            config = build_config(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}. Exiting...", file=sys.stderr)
+        return EXIT_USAGE
+
+    started = time.time()
+    summary = run(config, logger, pipeline.events)
+    code = exit_code(summary)
+    summary.update({
+        "status": STATUS[code],
+        "exit_code": code,
+        "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "duration_s": round(time.time() - started, 3),
+        "passthru": config["passthru"],
+        "simulate": config["simulate"],
+        "log_file": log_file,
+    })
+    if config["summary"]:
+        write_summary(summary, config["summary"])
+    logger.info("Run %s (exit code %d)", summary["status"], code)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
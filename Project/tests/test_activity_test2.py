@@ -0,0 +1,16 @@
+import logging
+from Test.Activity_test2 import Activitytest2
+from Test.nvme_simulator import SimulatedController
+
+
+def test_engine_open_failure_fails_the_test(tmp_path, caplog):
+    ctrl = SimulatedController()
+
+    def no_engine(**kwargs):
+        raise OSError("io_uring unavailable")
+    ctrl.open_io_engine = no_engine
+    test = Activitytest2(ctrl, logger=logging.getLogger("test2"), seed=1, trace="")
+    with caplog.at_level(logging.ERROR):
+        test.run()
+    assert test.result == "FAILED"
+    assert "Failed executing NVMe read/write commands: io_uring unavailable" in caplog.text
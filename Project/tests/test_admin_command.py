@@ -0,0 +1,130 @@
+import ctypes
+import pytest
+from Test import admin_passthru_wrapper as apw
+from Test.admin_passthru_wrapper import (
+    AdminCommand, AdminCommandSet, AdminPassthruWrapper, NVME_ADMIN_GET_FEATURES, NVME_ADMIN_SET_FEATURES,
+    NVME_FEAT_TEMP_THRESH, NVME_FEATURES_SEL_SAVED, NVME_PASSTHRU_CMD, NVME_PASSTHRU_RESULT_OFFSET,
+    NVME_TEMP_THRESH_UNDER
+)
+from Test.nvme_log import NVME_ADMIN_GET_LOG_PAGE
+
+
+class _FakeController:
+    # Stands in for the NVMe driver: records each command struct, fills the
+    # data / metadata buffers and writes DW0 back into the struct
+    def __init__(self, status=0, result=0, data=b"", metadata=b""):
+        self.status, self.result, self.data, self.metadata = status, result, data, metadata
+        self.commands = []
+
+    def ioctl(self, fd, request, buf, mutate=False):
+        fields = NVME_PASSTHRU_CMD.unpack_from(buf)
+        self.commands.append(fields)
+        metadata_addr, addr = fields[6], fields[7]
+        if self.data:
+            ctypes.memmove(addr, self.data, len(self.data))
+        if self.metadata:
+            ctypes.memmove(metadata_addr, self.metadata, len(self.metadata))
+        buf[NVME_PASSTHRU_RESULT_OFFSET:NVME_PASSTHRU_RESULT_OFFSET + 4] = self.result.to_bytes(4, "little")
+        return self.status
+
+
+@pytest.fixture
+def wrapper(tmp_path, monkeypatch):
+    def attach(**kwargs):
+        fake = _FakeController(**kwargs)
+        monkeypatch.setattr(apw.fcntl, "ioctl", fake.ioctl)
+        return fake
+    device = tmp_path / "nvme0"
+    device.write_bytes(b"")
+    with AdminPassthruWrapper(str(device)) as w:
+        w.attach = attach
+        yield w
+
+
+def test_command_set_is_abstract():
+    with pytest.raises(TypeError):
+        AdminCommandSet()
+
+    class NoExecute(AdminCommandSet):
+        pass
+    with pytest.raises(TypeError):
+        NoExecute()
+
+
+def test_get_features_dwords():
+    command = AdminCommand.get_features(NVME_FEAT_TEMP_THRESH, sel=NVME_FEATURES_SEL_SAVED, cdw11=0x123456, nsid=2)
+    assert command.opcode == NVME_ADMIN_GET_FEATURES
+    assert (command.nsid, command.cdw10, command.cdw11, command.data_len) == (2, 0x204, 0x123456, 0)
+
+
+def test_set_features_save_bit():
+    assert AdminCommand.set_features(0x07, 0x00030003).cdw10 == 0x07
+    command = AdminCommand.set_features(0x07, 0x00030003, save=True)
+    assert command.opcode == NVME_ADMIN_SET_FEATURES
+    assert (command.cdw10, command.cdw11) == (0x80000007, 0x00030003)
+
+
+def test_get_log_page_dwords():
+    command = AdminCommand.get_log_page(0x02, 0x40004 * 4, nsid=1, offset=(7 << 32) | 512, lsp=0x7F, rae=True)
+    assert command.opcode == NVME_ADMIN_GET_LOG_PAGE
+    # NUMD = 0x40003 (0-based dwords): NUMDL in cdw10 31:16, NUMDU in cdw11 15:0
+    assert command.cdw10 == 0x02 | 0x7F << 8 | 1 << 15 | 0x0003 << 16
+    assert (command.cdw11, command.cdw12, command.cdw13) == (0x4, 512, 7)
+
+
+def test_identify_cntid():
+    command = AdminCommand.identify(0x13, cntid=5)
+    assert (command.cdw10, command.data_len) == (0x13 | 5 << 16, 4096)
+
+
+def test_lengths_follow_buffers():
+    command = AdminCommand(0xC1, data=b"\x01" * 12, metadata=b"\x02" * 8)
+    assert (command.data_len, command.metadata_len) == (12, 8)
+    assert AdminCommand(0xC1, data=b"\x01" * 12, data_len=64).data_len == 64
+
+
+def test_payload_longer_than_length():
+    with pytest.raises(ValueError):
+        AdminCommand(0xC1, data=b"\x01" * 12, data_len=8)
+    with pytest.raises(ValueError):
+        AdminCommand(0xC1, metadata=b"\x02" * 8, metadata_len=4)
+
+
+def test_execute_packs_every_field(wrapper):
+    fake = wrapper.attach(result=0xDEADBEEF, data=b"\xaa" * 16, metadata=b"\xbb" * 8)
+    command = AdminCommand(0xC2, nsid=3, cdw10=10, cdw11=11, cdw12=12, cdw13=13, cdw14=14, cdw15=15,
+                           data=b"\x11" * 4, data_len=16, cdw2=2, cdw3=3, metadata_len=8, timeout_ms=2500,
+                           flags=1)
+    completion = wrapper.execute(command)
+    (opcode, flags, _, nsid, cdw2, cdw3, metadata_addr, addr, metadata_len, data_len,
+     *cdws, timeout_ms, _) = fake.commands[0]
+    assert (opcode, flags, nsid, cdw2, cdw3) == (0xC2, 1, 3, 2, 3)
+    assert metadata_addr and addr and metadata_addr != addr
+    assert (metadata_len, data_len, cdws, timeout_ms) == (8, 16, [10, 11, 12, 13, 14, 15], 2500)
+    assert completion.ok and completion.result == 0xDEADBEEF
+    assert completion.data == b"\xaa" * 16 and completion.metadata == b"\xbb" * 8
+    assert (wrapper.last_status, wrapper.last_result) == (0, 0xDEADBEEF)
+
+
+def test_execute_without_buffers(wrapper):
+    fake = wrapper.attach(result=0x55)
+    completion = wrapper.execute(AdminCommand.get_features(NVME_FEAT_TEMP_THRESH))
+    assert fake.commands[0][6:10] == (0, 0, 0, 0)    # no metadata / data pointers or lengths
+    assert completion.result == 0x55 and completion.metadata is None
+
+
+def test_execute_status(wrapper):
+    wrapper.attach(status=0x4002, result=7)
+    completion = wrapper.execute(AdminCommand.set_features(NVME_FEAT_TEMP_THRESH, 1))
+    assert not completion.ok and (completion.status, completion.result) == (0x4002, 7)
+    assert wrapper.set_feature(NVME_FEAT_TEMP_THRESH, 1) is False
+
+
+def test_temperature_threshold_dword11(wrapper):
+    fake = wrapper.attach(result=0xABCD0000 | 353)
+    assert wrapper.get_temperature_threshold(tmpsel=2, thsel=NVME_TEMP_THRESH_UNDER) == 353
+    assert wrapper.set_temperature_threshold(0x1FFFF, tmpsel=1)
+    get_cmd, set_cmd = fake.commands
+    assert (get_cmd[0], get_cmd[10], get_cmd[11]) == (NVME_ADMIN_GET_FEATURES, NVME_FEAT_TEMP_THRESH, 2 << 16 | 1 << 20)
+    # TMPTH keeps its 16 bits only
+    assert (set_cmd[0], set_cmd[10], set_cmd[11]) == (NVME_ADMIN_SET_FEATURES, NVME_FEAT_TEMP_THRESH, 0xFFFF | 1 << 16)
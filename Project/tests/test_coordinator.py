@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+import os
+import pytest
+from coordinator import Agent, Coordinator, Job, plan_jobs
+
+TEST = "Activity test1"  # quick on a simulated drive; FAILED against the default reference
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("NVME_PROJECT_RESULT_DIR", str(tmp_path / "results"))
+    return tmp_path
+
+
+def _jobs(estimates):
+    return [Job(i, f"{TEST} #{i}", TEST, {}, float(estimate)) for i, estimate in enumerate(estimates, 1)]
+
+
+def _agent(name, devices, workdir):
+    return Agent(devices, name=name, simulate=True, base_dir=str(workdir / name),
+                 logger=logging.getLogger(f"agent.{name}"))
+
+
+async def _listening(coordinator, path):
+    serve = asyncio.ensure_future(coordinator.serve(f"unix://{path}"))
+    while not os.path.exists(path):
+        await asyncio.sleep(0.01)
+    return serve
+
+
+def test_plan_jobs_keys():
+    from Test.registry import default_registry
+    spec = default_registry().find(TEST)
+    jobs = plan_jobs([(spec.name, spec, {"repeat": 2}), ("Other", spec, {})])
+    assert [job.key for job in jobs] == [f"{TEST} #1", f"{TEST} #2", "Other"]
+    assert all(job.default_estimate == spec.estimated_duration for job in jobs)
+
+
+def test_deal_and_steal(workdir):
+    # The long job goes to one agent and every short one to the other, so the
+    # first agent runs out of work and steals
+    jobs = _jobs([100, 1, 1, 1, 1, 1, 1])
+    coordinator = Coordinator(jobs, min_agents=2, idle_timeout=30)
+    path = str(workdir / "c.sock")
+    address = f"unix://{path}"
+
+    async def run():
+        serve = await _listening(coordinator, path)
+        agents = [_agent("a", ["/dev/nvme0"], workdir), _agent("b", ["/dev/nvme1"], workdir)]
+        completed = await asyncio.gather(*(agent.run(address) for agent in agents))
+        return await serve, completed
+
+    summary, completed = asyncio.run(run())
+    assert sum(completed) == len(jobs)
+    assert jobs[0].agent == "a" and not jobs[0].stolen
+    stolen = [job for job in jobs if job.stolen]
+    assert stolen and all(job.agent == "a" for job in stolen)
+    assert summary["agents"]["a"]["stolen"] == len(stolen)
+    assert summary["agents"]["a"]["jobs"] + summary["agents"]["b"]["jobs"] == len(jobs)
+    assert summary["totals"] == {job.key: {"FAILED": 1} for job in jobs}
+    assert all(job.attempts == 1 and job.duration > 0 for job in jobs)
+    assert set(summary["devices"]) <= {"a:/dev/nvme0", "b:/dev/nvme1"}
+
+
+def test_job_retried_after_agent_disconnects(workdir):
+    jobs = _jobs([2, 1, 1])
+    coordinator = Coordinator(jobs, min_agents=1, idle_timeout=30)
+    path = str(workdir / "c.sock")
+    address = f"unix://{path}"
+
+    async def run():
+        serve = await _listening(coordinator, path)
+        # An agent that takes a job and hangs up without a result
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(json.dumps({"type": "hello", "agent": "flaky", "devices": ["/dev/nvme9"]}).encode() + b"\n")
+        taken = json.loads(await reader.readline())
+        writer.close()
+        while coordinator.agents:
+            await asyncio.sleep(0.01)
+        await _agent("steady", ["/dev/nvme0", "/dev/nvme1"], workdir).run(address)
+        return await serve, taken
+
+    summary, taken = asyncio.run(run())
+    retried = next(job for job in jobs if job.id == taken["job"])
+    assert retried.attempts == 2 and retried.agent == "steady" and retried.verdict == "FAILED"
+    assert all(job.attempts == 1 for job in jobs if job is not retried)
+    assert summary["agents"] == {"steady": {"jobs": 3, "stolen": 0, "busy_s": summary["agents"]["steady"]["busy_s"]}}
+    assert summary["totals"] == {job.key: {"FAILED": 1} for job in jobs}
+
+
+def test_no_agent_left_ends_with_error(workdir):
+    jobs = _jobs([1, 1])
+    coordinator = Coordinator(jobs, min_agents=1, idle_timeout=0.2)
+    path = str(workdir / "c.sock")
+    address = f"unix://{path}"
+
+    async def run():
+        serve = await _listening(coordinator, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(json.dumps({"type": "hello", "agent": "gone", "devices": ["/dev/nvme0"]}).encode() + b"\n")
+        await reader.readline()
+        writer.close()
+        return await asyncio.wait_for(serve, 10)
+
+    summary = asyncio.run(run())
+    assert summary["totals"] == {job.key: {"ERROR": 1} for job in jobs}
+    assert all(job.error.startswith("no agent connected") for job in jobs)
@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import pytest
+from Test.golden_reference import GoldenReference, load_reference
+from Test.nvme_identify import ID_CTRL_LAYOUT
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Test")
+GOOD_REFERENCE = os.path.join(TEST_DIR, "id-ctrl-main_good.json")
+BAD_REFERENCE = os.path.join(TEST_DIR, "id-ctrl-main_bad.json")
+
+
+@pytest.fixture
+def good():
+    with open(GOOD_REFERENCE, 'r') as f:
+        return json.load(f)
+
+
+def test_good_reference_matches_own_image(good):
+    reference = GoldenReference.from_json(GOOD_REFERENCE)
+    image = ID_CTRL_LAYOUT.pack(good)
+    assert reference.matches(image)
+    assert reference.compare(image) == []
+    assert reference.diff(image) == []
+
+
+def test_bad_reference_reports_null_field(good):
+    reference = GoldenReference.from_json(BAD_REFERENCE)
+    assert reference.compare(ID_CTRL_LAYOUT.pack(good)) == [('megcap', None, 0)]
+
+
+def test_diff_reports_changed_fields(good):
+    reference = GoldenReference.from_json(GOOD_REFERENCE)
+    image = ID_CTRL_LAYOUT.pack(dict(good, mdts=6, psds=[dict(good["psds"][0], entry_lat=1)] + good["psds"][1:]))
+    assert not reference.matches(image)
+    diff = {name: (exp, cur) for name, exp, cur in reference.compare(image)}
+    assert sorted(diff) == ["mdts", "psds"]
+    assert diff["mdts"] == (5, 6)
+
+
+def test_ignored_field_not_reported(good):
+    image = ID_CTRL_LAYOUT.pack(dict(good, fr="6CV10200", mdts=6))
+    assert [d[0] for d in GoldenReference.from_json(GOOD_REFERENCE).compare(image)] == ["fr", "mdts"]
+    reference = GoldenReference.from_json(GOOD_REFERENCE, ignore_fields={"fr"})
+    assert reference.compare(image) == [("mdts", 5, 6)]
+    assert GoldenReference.from_json(GOOD_REFERENCE, ignore_fields={"fr", "mdts"}).compare(image) == []
+
+
+def test_load_reference_cache(tmp_path, good):
+    path = str(tmp_path / "ref.json")
+    shutil.copy(GOOD_REFERENCE, path)
+    first = load_reference(path)
+    assert load_reference(path) is first
+    assert load_reference(path, ignore_fields=("sn",)) is not first
+
+    with open(path, 'w') as f:
+        json.dump(dict(good, mdts=6), f)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    reloaded = load_reference(path)
+    assert reloaded is not first
+    assert reloaded.compare(ID_CTRL_LAYOUT.pack(good)) == [("mdts", 6, 5)]
@@ -0,0 +1,213 @@
+import asyncio
+import mmap
+import struct
+import threading
+import time
+import pytest
+from Test.admin_passthru_wrapper import buffer_address
+from Test.io_engine import (
+    IO_URING_CQE, IO_URING_CQE_SIZE, IO_URING_PARAMS, IO_URING_SQE_HDR, IO_URING_SQE_SIZE, IORING_OP_URING_CMD,
+    NVME_URING_CMD_IO, ThreadPoolIOEngine, UringIOEngine, _IoUring, generic_char_device
+)
+from Test.io_passthru_wrapper import NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_simulator import NVME_SC_LBA_RANGE, SimulatedController
+
+QD = 8
+
+
+class _CountingIO:
+    # Simulated namespace I/O that records how many commands overlap
+    inflight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, io):
+        self.io = io
+
+    def _enter(self):
+        with self.lock:
+            _CountingIO.inflight += 1
+            _CountingIO.peak = max(_CountingIO.peak, _CountingIO.inflight)
+        time.sleep(0.002)
+
+    def _leave(self):
+        with self.lock:
+            _CountingIO.inflight -= 1
+
+    def read(self, slba, nlb=1):
+        self._enter()
+        try:
+            return self.io.read(slba, nlb)
+        finally:
+            self._leave()
+
+    def write(self, slba, nlb=1, data=None):
+        self._enter()
+        try:
+            return self.io.write(slba, nlb, data)
+        finally:
+            self._leave()
+
+    def close(self):
+        self.io.close()
+
+
+class _RawIO:
+    # Wrapper with raw commands: records the buffer address each command points at
+    def __init__(self):
+        self.commands = []
+
+    def send_io_cmd(self, opcode, slba, nlb, addr, data_len):
+        self.commands.append((opcode, slba, nlb, addr, data_len))
+        return 0
+
+    def close(self):
+        pass
+
+
+def _stamp(lba, bs=4096):
+    return struct.pack("<Q", lba) * (bs // 8)
+
+
+def test_threadpool_queue_depth_round_trip():
+    ctrl = SimulatedController()
+    _CountingIO.peak = 0
+    engine = ThreadPoolIOEngine("/dev/nvme0n1", QD, 4096, 2, io_factory=lambda: _CountingIO(ctrl.io(1, 2)))
+
+    async def run():
+        writes = [engine.submit(NVME_CMD_WRITE, lba, 2, data=_stamp(lba) * 2) for lba in range(0, 128, 2)]
+        assert all(status == 0 for status, _ in await asyncio.gather(*writes))
+        outs = [bytearray(8192) for _ in range(64)]
+        reads = [engine.submit(NVME_CMD_READ, 2 * i, 2, out=out) for i, out in enumerate(outs)]
+        assert all(status == 0 for status, _ in await asyncio.gather(*reads))
+        return outs
+
+    with engine:
+        outs = asyncio.run(run())
+    assert all(out == _stamp(2 * i) * 2 for i, out in enumerate(outs))
+    assert 1 < _CountingIO.peak <= QD
+    assert ctrl.smart["host_write_commands"] == ctrl.smart["host_read_commands"] == 64
+
+
+def test_threadpool_status_instead_of_exception():
+    ctrl = SimulatedController(capacity_blocks=1 << 10)
+    with ctrl.open_io_engine(queue_depth=QD) as engine:
+        statuses = asyncio.run(engine.submit_batch([(NVME_CMD_READ, lba, 1) for lba in (0, 1 << 20, 5)]))
+    assert statuses == [0, NVME_SC_LBA_RANGE, 0]
+
+
+def test_threadpool_buf_on_simulator():
+    ctrl = SimulatedController()
+    buf = mmap.mmap(-1, QD * 4 * 4096)
+    view = memoryview(buf)
+    slots = [view[i * 16384:(i + 1) * 16384] for i in range(QD)]
+    # max_blocks=1: buf= commands are not limited by the engine's own buffers
+    with ctrl.open_io_engine(queue_depth=QD, max_blocks=1) as engine:
+        async def run():
+            for i, slot in enumerate(slots):
+                slot[:] = _stamp(100 + i) * 4
+            await asyncio.gather(*(engine.submit(NVME_CMD_WRITE, 4 * i, 4, buf=slot) for i, slot in enumerate(slots)))
+            buf[:] = bytes(len(buf))
+            return await asyncio.gather(*(engine.submit(NVME_CMD_READ, 4 * i, 4, buf=slot)
+                                          for i, slot in enumerate(slots)))
+        assert all(status == 0 for status, _ in asyncio.run(run()))
+    assert all(bytes(slot) == _stamp(100 + i) * 4 for i, slot in enumerate(slots))
+    slots = view = None
+    buf.close()
+
+
+def test_threadpool_buf_is_zero_copy():
+    raw = [_RawIO() for _ in range(QD)]
+    wrappers = iter(raw)
+    buf = mmap.mmap(-1, QD * 8192)
+    view = memoryview(buf)
+    slots = [view[i * 8192:(i + 1) * 8192] for i in range(QD)]
+    with ThreadPoolIOEngine("/dev/nvme0n1", QD, 4096, 1, io_factory=lambda: next(wrappers)) as engine:
+        async def run():
+            return await asyncio.gather(*(engine.submit(NVME_CMD_READ, 2 * i, 2, buf=slot)
+                                          for i, slot in enumerate(slots)))
+        assert all(status == 0 for status, _ in asyncio.run(run()))
+    commands = sorted(c for w in raw for c in w.commands)
+    assert commands == [(NVME_CMD_READ, 2 * i, 2, buffer_address(slot), 8192) for i, slot in enumerate(slots)]
+    slots = view = None
+    buf.close()
+
+
+def test_uring_struct_sizes():
+    # struct io_uring_params is 120 bytes; an SQE128 is a 48-byte header plus
+    # the 80-byte command area, which holds the 72-byte struct nvme_uring_cmd
+    assert IO_URING_PARAMS.size == 120
+    assert IO_URING_SQE_HDR.size == 48 and IO_URING_SQE_SIZE == 128
+    assert IO_URING_CQE.size == 24 and IO_URING_CQE_SIZE == 32
+    # _IOWR('N', 0x80, struct nvme_uring_cmd)
+    assert NVME_URING_CMD_IO == (3 << 30) | (72 << 16) | (ord('N') << 8) | 0x80
+
+
+class _FakeRing:
+    def __init__(self, entries):
+        self.sqes = bytearray(entries * IO_URING_SQE_SIZE)
+        self.tail = 0
+
+    def next_sqe_offset(self):
+        return self.tail * IO_URING_SQE_SIZE
+
+    def advance(self):
+        self.tail += 1
+
+
+def test_uring_sqe_layout():
+    engine = UringIOEngine.__new__(UringIOEngine)
+    engine.ring = _FakeRing(4)
+    engine.fd, engine.nsid, engine.block_size, engine.xfer_len = 7, 3, 4096, 8192
+    engine._data_addr, engine._pending = 0x10000, 1
+    engine._queue(1, NVME_CMD_READ, (5 << 32) | 9, 2)
+    engine._queue(2, NVME_CMD_WRITE, 11, 1, addr=0xABC000)
+    sqe = engine.ring.sqes
+
+    def u8(off):
+        return sqe[off]
+
+    def u32(off):
+        return struct.unpack_from("<I", sqe, off)[0]
+
+    def u64(off):
+        return struct.unpack_from("<Q", sqe, off)[0]
+    # io_uring_sqe: opcode 0, fd 4, cmd_op 8, user_data 32; the command starts at 48
+    assert (u8(0), u32(4), u32(8), u64(32)) == (IORING_OP_URING_CMD, 7, NVME_URING_CMD_IO, 1)
+    cmd = 48
+    # nvme_uring_cmd: opcode 0, nsid 4, addr 24, data_len 36, cdw10 40, cdw11 44, cdw12 48
+    assert (u8(cmd), u32(cmd + 4), u64(cmd + 24), u32(cmd + 36)) == (NVME_CMD_READ, 3, 0x10000 + 8192, 8192)
+    assert (u32(cmd + 40), u32(cmd + 44), u32(cmd + 48)) == (9, 5, 1)
+    second = IO_URING_SQE_SIZE
+    assert (u64(second + 32), u8(second + cmd), u64(second + cmd + 24), u32(second + cmd + 36)) == \
+        (2, NVME_CMD_WRITE, 0xABC000, 4096)
+    assert engine._pending == 3
+
+
+def test_uring_cqe32_reap():
+    ring = _IoUring.__new__(_IoUring)
+    ring.cq_ring = bytearray(64 + 4 * IO_URING_CQE_SIZE)
+    ring.cq_head_off, ring.cq_tail_off, ring.cqes_off, ring.cq_mask = 0, 4, 64, 3
+    # Two completions, the second past the ring end; big_cqe[0] holds DW0 in its low 32 bits
+    struct.pack_into("<II", ring.cq_ring, 0, 3, 5)
+    IO_URING_CQE.pack_into(ring.cq_ring, 64 + 3 * 32, 6, 0, 0, (1 << 40) | 0x1234)
+    IO_URING_CQE.pack_into(ring.cq_ring, 64, 2, -5, 0, 0)
+    assert list(ring.reap()) == [(6, 0, 0x1234), (2, -5, 0)]
+    assert struct.unpack_from("<I", ring.cq_ring, 0)[0] == 5
+
+
+def test_generic_char_device():
+    assert generic_char_device("/dev/nvme0n1") == "/dev/ng0n1"
+    assert generic_char_device("/dev/nvme12n3") == "/dev/ng12n3"
+    assert generic_char_device("/dev/sda") is None
+
+
+def test_threadpool_buf_too_small():
+    raw = _RawIO()
+    small, big = bytearray(4096), bytearray(8 * 4096)
+    with ThreadPoolIOEngine("/dev/nvme0n1", 1, 4096, 8, io_factory=lambda: raw) as engine:
+        with pytest.raises(ValueError):
+            asyncio.run(engine.submit(NVME_CMD_READ, 0, 8, buf=small))
+        # Only the blocks of the command are transferred, not the whole buffer
+        assert asyncio.run(engine.submit(NVME_CMD_READ, 0, 2, buf=big)) == (0, 0)
+    assert raw.commands == [(NVME_CMD_READ, 0, 2, buffer_address(big), 8192)]
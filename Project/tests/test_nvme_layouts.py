@@ -0,0 +1,61 @@
+import json
+import os
+from Test.nvme_identify import ID_CTRL_LAYOUT, ID_NS_LAYOUT, IdentifyController, IdentifyNamespace
+from Test.nvme_log import SMART_LOG_LAYOUT, SmartLog
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Test")
+GOOD_REFERENCE = os.path.join(TEST_DIR, "id-ctrl-main_good.json")
+
+# Anonymized placeholders that do not fit their field: sn is 21 characters
+# for 20 bytes, fguid is one hex digit short
+PLACEHOLDERS = {"sn", "fguid"}
+
+
+def test_id_ctrl_roundtrip():
+    with open(GOOD_REFERENCE, 'r') as f:
+        reference = json.load(f)
+    idc = IdentifyController(ID_CTRL_LAYOUT.pack(reference))
+    assert list(idc.keys()) == list(reference)
+    for name, value in reference.items():
+        if name == "psds":
+            assert [psd.to_dict() for psd in idc.psds] == value
+        elif name not in PLACEHOLDERS:
+            assert idc[name] == value, name
+    assert idc.sn == reference["sn"][:20]
+    assert idc.fguid == "00000000-0000-0000-0000-000000000000"
+    assert len(idc.psds) == reference["npss"] + 1
+    assert idc.tnvmcap == 15362991415296
+
+
+def test_id_ns_roundtrip():
+    values = {
+        "nsze": 0x1D1C0BEB0, "ncap": 0x1D1C0BEB0, "nuse": 0x1000, "nsfeat": 0x1A, "nlbaf": 1, "flbas": 0x11,
+        "mc": 3, "dpc": 0x1F, "dps": 0x09, "nmic": 0x01, "rescap": 0xFF, "nvmcap": (1 << 100) + 12345,
+        "anagrpid": 7, "endgid": 1, "nguid": "0123456789abcdef0011223344556677", "eui64": "a1b2c3d4e5f60708",
+        "lbafs": [{"ms": 0, "ds": 9, "rp": 2}, {"ms": 8, "ds": 12, "rp": 0}],
+    }
+    buf = ID_NS_LAYOUT.pack(values)
+    assert (buf[29], buf[30]) == (0x09, 0x01)
+    assert ID_NS_LAYOUT.span("dps") == (29, 1) and ID_NS_LAYOUT.span("nmic") == (30, 1)
+    ns = IdentifyNamespace(buf)
+    decoded = ns.to_dict()
+    for name, value in values.items():
+        assert decoded[name] == value, name
+    assert ns.lbaf == 1  # flbas bits 3:0
+
+
+def test_smart_log_roundtrip():
+    values = {
+        "critical_warning": 0x04, "temperature": 310, "avail_spare": 100, "spare_thresh": 10, "percent_used": 3,
+        "data_units_read": (1 << 64) + 1, "data_units_written": (1 << 127) | 0xFFFF,
+        "host_read_commands": (1 << 128) - 1, "host_write_commands": 1 << 64, "power_on_hours": 12345,
+        "media_errors": 0, "num_err_log_entries": (1 << 80) + 3, "warning_temp_time": 7,
+        "temperature_sensor_1": 305, "temperature_sensor_8": 330, "thm_temp2_total_time": 0xFFFFFFFF,
+    }
+    buf = SMART_LOG_LAYOUT.pack(values)
+    assert bytes(buf[32:48]) == ((1 << 64) + 1).to_bytes(16, 'little')
+    log = SmartLog(buf)
+    decoded = log.to_dict()
+    for name, value in values.items():
+        assert decoded[name] == value, name
+    assert log.controller_busy_time == 0
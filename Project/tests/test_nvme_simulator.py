@@ -0,0 +1,125 @@
+import pytest
+from Test.admin_passthru_wrapper import AdminCommand, NVME_NSID_ALL
+from Test.io_passthru_wrapper import NvmeIOError, NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_log import NVME_LOG_ERROR, NVME_LOG_FW_SLOT, NVME_LOG_SMART, SMART_LOG_LAYOUT
+from Test.nvme_simulator import (
+    SIMULATED_MDTS, NVME_SC_INVALID_FIELD, NVME_SC_INVALID_FORMAT, NVME_SC_INVALID_NS, NVME_SC_INVALID_OPCODE,
+    NVME_SC_LBA_RANGE, NVME_SC_NS_ALREADY_ATTACHED, NVME_SC_NS_INSUFFICIENT_CAP, NVME_SC_NS_NOT_ATTACHED,
+    NVME_SC_SUCCESS, SimulatedController
+)
+
+
+@pytest.fixture
+def ctrl():
+    return SimulatedController("/dev/nvme7", capacity_blocks=1 << 16)
+
+
+def test_identify_controller(ctrl):
+    idc = ctrl.identify_controller()
+    assert idc.mn.strip() == "NVME SIMULATOR"
+    assert idc.sn.strip() == "SIMNVME7"
+    assert idc.fr.strip() == "SIM10100"
+    assert idc.mdts == SIMULATED_MDTS
+    assert idc.tnvmcap == (1 << 16) << 12
+
+
+def test_identify_controller_overrides():
+    idc = SimulatedController(id_ctrl={"mdts": 3, "vid": 0x1234}).identify_controller()
+    assert (idc.mdts, idc.vid) == (3, 0x1234)
+
+
+def test_identify_namespace(ctrl):
+    ns = ctrl.identify_namespace(1)
+    assert (ns.nsze, ns.ncap, ns.nuse, ns.lbaf) == (1 << 16, 1 << 16, 0, 0)
+    assert [f.ds for f in ns.lbafs] == [12, 9]
+    # Allocated but not attached, or never allocated: all zero
+    assert ctrl.identify_namespace(2).nsze == 0
+    assert ctrl.execute(AdminCommand.identify(0x00, nsid=0)).status == NVME_SC_INVALID_NS
+
+
+def test_get_log_page(ctrl):
+    smart = ctrl.get_smart_log()
+    assert smart.power_cycles == 1
+    assert smart.avail_spare == 100
+    assert smart.critical_warning == 0
+    # Offset and length are honoured
+    full = ctrl.get_log_page(NVME_LOG_SMART, SMART_LOG_LAYOUT.size)
+    part = ctrl.get_log_page(NVME_LOG_SMART, 8, offset=4)
+    assert part == full[4:12]
+    assert ctrl.get_log_page(NVME_LOG_ERROR, 64) == bytes(64)
+    assert ctrl.get_log_page(NVME_LOG_FW_SLOT, 512)[8:16] == b"SIM10100"
+    assert ctrl.execute(AdminCommand.get_log_page(0x7F, 512)).status == NVME_SC_INVALID_FIELD
+
+
+def test_smart_counts_io(ctrl):
+    io = ctrl.io(1, max_blocks=4)
+    io.write(0, 4, b"\x5a" * 4 * 4096)
+    io.read(0, 4)
+    smart = ctrl.get_smart_log()
+    assert (smart.host_write_commands, smart.host_read_commands) == (1, 1)
+    assert (smart.data_units_written, smart.data_units_read) == (1, 1)
+
+
+def test_namespace_management(ctrl):
+    assert ctrl.delete_namespace(1)
+    nsid = ctrl.create_namespace(1 << 10, flbas=1)
+    assert nsid == 1
+    assert ctrl.identify_namespace(nsid).nsze == 0           # not attached yet
+    assert ctrl.attach_namespace(nsid)
+    assert ctrl.execute(AdminCommand(0x15, nsid=nsid, cdw10=0)).status == NVME_SC_NS_ALREADY_ATTACHED
+    ns = ctrl.identify_namespace(nsid)
+    assert (ns.nsze, ns.lbaf) == (1 << 10, 1)
+    assert ctrl.block_size(nsid) == 512
+    assert ctrl.detach_namespace(nsid)
+    assert ctrl.execute(AdminCommand(0x15, nsid=nsid, cdw10=1)).status == NVME_SC_NS_NOT_ATTACHED
+    assert ctrl.execute(AdminCommand(0x15, nsid=9, cdw10=0)).status == NVME_SC_INVALID_NS
+
+
+def test_namespace_create_errors(ctrl):
+    assert ctrl.create_namespace(1) is None                   # ns 1 holds all the capacity
+    assert ctrl.last_status == NVME_SC_NS_INSUFFICIENT_CAP
+    assert ctrl.delete_namespace(NVME_NSID_ALL)
+    assert ctrl.create_namespace(16, flbas=5) is None
+    assert ctrl.last_status == NVME_SC_INVALID_FORMAT
+    assert ctrl.create_namespace(16, ncap=32) is None
+    assert ctrl.last_status == NVME_SC_NS_INSUFFICIENT_CAP
+    assert not ctrl.delete_namespace(3)
+    assert ctrl.last_status == NVME_SC_INVALID_NS
+
+
+def test_format_nvm(ctrl):
+    ctrl.io(1).write(0, 1, b"\x01" * 4096)
+    assert ctrl.identify_namespace(1).nuse == 1
+    assert ctrl.format_nvm(1, lbaf=1, pi=1)
+    ns = ctrl.identify_namespace(1)
+    assert (ns.lbaf, ns.dps, ns.nuse) == (1, 1, 0)
+    assert not ctrl.format_nvm(1, lbaf=2)
+    assert ctrl.last_status == NVME_SC_INVALID_FORMAT
+    assert not ctrl.format_nvm(4)
+    assert ctrl.last_status == NVME_SC_INVALID_NS
+
+
+def test_unknown_admin_opcode(ctrl):
+    completion = ctrl.execute(AdminCommand(0xC0))
+    assert completion.status == NVME_SC_INVALID_OPCODE and not completion.ok
+
+
+def test_io_status_codes(ctrl):
+    assert ctrl.submit_io(NVME_CMD_WRITE, 1, 0, 1, b"\xab" * 4096)[0] == NVME_SC_SUCCESS
+    status, data = ctrl.submit_io(NVME_CMD_READ, 1, 0, 2)
+    assert status == NVME_SC_SUCCESS and data == b"\xab" * 4096 + bytes(4096)
+    assert ctrl.submit_io(NVME_CMD_READ, 1, (1 << 16) - 1, 2)[0] == NVME_SC_LBA_RANGE
+    assert ctrl.submit_io(NVME_CMD_READ, 2, 0, 1)[0] == NVME_SC_INVALID_NS
+    assert ctrl.submit_io(0x7F, 1, 0, 1)[0] == NVME_SC_INVALID_OPCODE
+    ctrl.detach_namespace(1)
+    assert ctrl.submit_io(NVME_CMD_READ, 1, 0, 1)[0] == NVME_SC_INVALID_NS
+
+
+def test_mdts_rejection(ctrl):
+    limit = (4096 << SIMULATED_MDTS) // 4096
+    assert ctrl.submit_io(NVME_CMD_READ, 1, 0, limit)[0] == NVME_SC_SUCCESS
+    assert ctrl.submit_io(NVME_CMD_READ, 1, 0, limit + 1)[0] == NVME_SC_INVALID_FIELD
+    small = SimulatedController(id_ctrl={"mdts": 1})
+    assert small.submit_io(NVME_CMD_WRITE, 1, 0, 3)[0] == NVME_SC_INVALID_FIELD
+    with pytest.raises(NvmeIOError):
+        small.io(1, max_blocks=3).read(0, 3)
@@ -0,0 +1,17 @@
+from Test import registry
+
+
+def _write_test(path, class_name, key):
+    metadata = {"name": class_name} if key is None else {"key": key, "name": class_name}
+    path.write_text(f"class {class_name}:\n    TEST_METADATA = {metadata!r}\n")
+
+
+def test_numeric_keys_sort_by_value(tmp_path):
+    for class_name, key in (("Ten", "10"), ("Two", "2"), ("Extra", "x"), ("NoKey", None), ("One", 1)):
+        _write_test(tmp_path / f"{class_name.lower()}.py", class_name, key)
+    tests = registry.TestRegistry.scan(str(tmp_path), package="pkg", entry_points=False)
+    assert [spec.name for spec in tests] == ["One", "Two", "Ten", "Extra", "NoKey"]
+
+
+def test_default_registry_order():
+    assert [spec.key for spec in registry.default_registry()][:3] == ["1", "2", "3"]
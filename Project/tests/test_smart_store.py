@@ -0,0 +1,94 @@
+import pytest
+from Test.smart_columns import join_columns, series_deltas, series_rates, split_u128
+from Test.smart_sampler import SmartRingBuffer
+from Test.smart_store import SmartSnapshotStore
+
+FIELDS = ("temperature", "host_read_commands", "data_units_written", "media_errors")
+TOP = (1 << 64) - 1
+
+
+def _store(rows, drive="nvme0"):
+    store = SmartSnapshotStore(FIELDS)
+    for t, row in enumerate(rows):
+        store.append(drive, row, timestamp=float(t))
+    return store
+
+
+def test_split_join():
+    for value in (0, 1, TOP, TOP + 1, (1 << 127) + 5):
+        low, high = split_u128(value)
+        assert join_columns([low], [high]) == [value]
+    assert series_deltas([1, 4, 4, 10]) == [3, 0, 6]
+    assert series_rates([0, 10, 10], [0.0, 2.0, 2.0]) == [5.0, 0.0]
+
+
+def test_u128_counter_past_64_bits():
+    store = _store([{"host_read_commands": TOP - 1}, {"host_read_commands": TOP + 2},
+                    {"host_read_commands": (1 << 100) + 7}])
+    assert store.column("nvme0", "host_read_commands") == [TOP - 1, TOP + 2, (1 << 100) + 7]
+    assert store.delta("nvme0", "host_read_commands") == (1 << 100) + 7 - (TOP - 1)
+    assert store.deltas("nvme0", "host_read_commands") == [3, (1 << 100) + 7 - (TOP + 2)]
+    assert store.latest("nvme0")["host_read_commands"] == (1 << 100) + 7
+    # The high column only exists once a value needed it
+    assert store.memory_bytes() == 3 * 8 + 3 * (2 + 8 + 8 + 8) + 3 * 8
+
+
+def test_narrow_columns_stay_narrow():
+    store = _store([{"temperature": 300, "host_read_commands": 5}] * 10)
+    assert store.memory_bytes() == 10 * (8 + 2 + 8 + 8 + 8)
+    assert store.column("nvme0", "temperature") == [300] * 10
+    assert store.delta("nvme0", "host_read_commands") == 0
+
+
+def test_rates_and_thresholds():
+    store = _store([{"temperature": 300, "media_errors": 0}, {"temperature": 350, "media_errors": 0},
+                    {"temperature": 320, "media_errors": 2}])
+    assert store.rate("nvme0", "temperature") == 10.0
+    assert store.rates("nvme0", "temperature") == [50.0, -30.0]
+    assert store.exceeds("temperature", ">", 343) == {"nvme0": [(1.0, 350)]}
+    assert store.exceeds("media_errors", ">", 0, of="delta") == {"nvme0": [(2.0, 2)]}
+    (violation,) = store.check({"temperature": (">", 310), "media_errors": (">", 5)})
+    assert violation["count"] == 2 and violation["first"] == (1.0, 350) and violation["worst"] == (1.0, 350)
+    with pytest.raises(ValueError):
+        store.exceeds("temperature", ">", 0, of="sum")
+
+
+def test_aggregate():
+    store = SmartSnapshotStore(FIELDS)
+    for t, (a, b) in enumerate([(0, 100), (60, 100), (TOP + 40, 400)]):
+        store.append("a", {"host_read_commands": a, "data_units_written": 2 * a}, timestamp=float(t))
+        store.append("b", {"host_read_commands": b, "data_units_written": b}, timestamp=float(t))
+    out = store.aggregate(counters=("host_read_commands", "data_units_written", "not_stored"))
+    assert set(out["fleet"]) == {"host_read_commands", "data_units_written"}
+    assert out["drives"]["a"]["host_read_commands"] == {"last": TOP + 40, "delta": TOP + 40,
+                                                         "rate": round((TOP + 40) / 2, 3)}
+    assert out["drives"]["b"]["data_units_written"] == {"last": 400, "delta": 300, "rate": 150.0}
+    fleet = out["fleet"]["host_read_commands"]
+    assert fleet["delta"] == TOP + 40 + 300 and fleet["max_delta_drive"] == "a"
+    assert store.aggregate(drives=["b"])["fleet"]["host_read_commands"]["max_delta_drive"] == "b"
+
+
+def test_unknown_drive_and_field():
+    store = _store([{}])
+    with pytest.raises(KeyError):
+        store.column("nvme9", "temperature")
+    with pytest.raises(KeyError):
+        SmartSnapshotStore(("no_such_field",))
+
+
+def test_ring_buffer_wraps_and_matches_store():
+    ring = SmartRingBuffer(capacity=4, fields=FIELDS)
+    for t in range(7):
+        ring.append({"host_read_commands": TOP - 3 + t, "temperature": 300 + t}, timestamp=float(t))
+    assert len(ring) == 4
+    assert ring.times() == [3.0, 4.0, 5.0, 6.0]
+    assert ring.column("host_read_commands") == [TOP, TOP + 1, TOP + 2, TOP + 3]
+    assert ring.delta("host_read_commands") == 3
+    assert ring.latest()["host_read_commands"] == TOP + 3
+    store = SmartSnapshotStore(FIELDS)
+    store.extend("nvme0", ring)
+    for name in ("host_read_commands", "temperature"):
+        assert store.column("nvme0", name) == ring.column(name)
+        assert store.deltas("nvme0", name) == ring.deltas(name)
+        assert store.rates("nvme0", name) == ring.rates(name)
+        assert store.rate("nvme0", name) == ring.rate(name)
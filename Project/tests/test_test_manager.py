@@ -0,0 +1,18 @@
+import logging
+import os
+import test_manager
+from Test.registry import default_registry
+
+
+def test_parallel_workers_write_to_their_own_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spec = default_registry().find("Activity test3")
+    tm = test_manager.TestManager(logger=logging.getLogger("tm"), devices=["/dev/nvme0", "/dev/nvme1"])
+    tm.add_test(spec.name, spec)
+    summary = tm.run_parallel(base_dir=str(tmp_path / "results"), simulate=True)
+    assert summary["totals"] == {spec.name: {"PASSED": 2}}
+    (day,) = os.listdir(tmp_path / "results")
+    for name in ("nvme0", "nvme1"):
+        assert sorted(os.listdir(tmp_path / "results" / day / name)) == [
+            "id_ns_after.bin", "id_ns_before.bin", "statusAntes.json", "statusDespues.json"]
+    assert sorted(os.listdir(tmp_path)) == ["results"]
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import pytest
+from Test.io_passthru_wrapper import NVME_CMD_READ, NVME_CMD_WRITE
+from Test.nvme_simulator import NVME_SC_LBA_RANGE, SimulatedController
+from Test.trace import CommandTrace, replay
+from Test.workload import IntegrityWorkload
+
+
+def _columns(trace):
+    return (list(trace.opcodes), list(trace.slbas), list(trace.nlbs), list(trace.statuses),
+            list(trace.latencies), trace.fences, trace.seed)
+
+
+def test_generate_is_seeded():
+    a = CommandTrace.generate(42, 500, 0, 10000, read_ratio=0.3, nlb=2)
+    b = CommandTrace.generate(42, 500, 0, 10000, read_ratio=0.3, nlb=2)
+    assert _columns(a) == _columns(b)
+    assert _columns(a) != _columns(CommandTrace.generate(43, 500, 0, 10000, read_ratio=0.3, nlb=2))
+    assert all(0 <= slba <= 10000 - 2 and slba % 2 == 0 for slba in a.slbas)
+    assert set(a.nlbs) == {2}
+    assert a.phases() == [(0, 500)]
+
+
+def test_generate_verify_writes():
+    trace = CommandTrace.generate(7, 100, 10, 1000, verify_writes=True, meta={"test": "t"})
+    assert len(trace) == 200 and trace.fences == [100]
+    assert trace.phases() == [(0, 100), (100, 200)]
+    assert set(trace.opcodes[:100]) == {NVME_CMD_WRITE} and set(trace.opcodes[100:]) == {NVME_CMD_READ}
+    assert len(set(trace.slbas[:100])) == 100 and trace.slbas[:100] == trace.slbas[100:]
+    assert trace.meta["test"] == "t" and trace.meta["verify_writes"]
+    with pytest.raises(ValueError):
+        CommandTrace.generate(7, 1, 0, 1, nlb=2)
+
+
+def test_save_load_round_trip(tmp_path):
+    trace = CommandTrace.generate(1234, 300, 0, 1 << 40, verify_writes=True, meta={"device": "/dev/nvme0"})
+    trace.statuses[5] = NVME_SC_LBA_RANGE
+    trace.latencies[7] = (1 << 40) + 3
+    path = tmp_path / "run.nvtr"
+    trace.save(str(path))
+    loaded = CommandTrace.load(str(path))
+    assert _columns(loaded) == _columns(trace)
+    assert loaded.meta == trace.meta
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "other.nvtr"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        CommandTrace.load(str(path))
+
+
+def test_replay_records_outcome_and_reproduces(tmp_path):
+    trace = CommandTrace.generate(99, 64, 0, 4096, verify_writes=True)
+    ctrl = SimulatedController()
+    with ctrl.open_io_engine(queue_depth=8) as engine, \
+            IntegrityWorkload(engine, seed=99, logger=logging.getLogger("trace")) as workload:
+        asyncio.run(replay(engine, trace, workload))
+        assert workload.report()["corrupted_blocks"] == 0
+    assert not any(trace.statuses) and all(trace.latencies)
+    path = tmp_path / "replayed.nvtr"
+    trace.save(str(path))
+
+    # Replaying the saved file on another drive issues the same commands with the same outcome
+    again = CommandTrace.load(str(path))
+    with SimulatedController().open_io_engine(queue_depth=4) as engine:
+        asyncio.run(replay(engine, again))
+    assert list(again.commands()) == list(trace.commands())
+    assert trace.diverging(again) == []
+    assert again.summary()["ops"]["write"]["count"] == 64
+
+
+def test_replay_statuses_diverge_out_of_range():
+    trace = CommandTrace([NVME_CMD_READ, NVME_CMD_READ], [0, 1 << 30], [1, 1])
+    with SimulatedController(capacity_blocks=1 << 16).open_io_engine(queue_depth=2) as engine:
+        asyncio.run(replay(engine, trace))
+    assert list(trace.statuses) == [0, NVME_SC_LBA_RANGE]
+    assert CommandTrace([NVME_CMD_READ, NVME_CMD_READ], [0, 1 << 30], [1, 1]).diverging(trace) == [1]
+    assert trace.summary()["ops"]["read"]["failed"] == 1
+
+
+def test_activity_test2_saves_trace_in_results_dir(tmp_path, monkeypatch):
+    from Test.Activity_test2 import Activitytest2
+    monkeypatch.chdir(tmp_path)
+    ctrl = SimulatedController("/dev/nvme3")
+    test = Activitytest2(ctrl, logger=logging.getLogger("test2"), seed=5)
+    test.results_dir = str(tmp_path / "nvme3")
+    (tmp_path / "nvme3").mkdir()
+    test.run()
+    path = tmp_path / "nvme3" / "io_trace_nvme3_5.nvtr"
+    assert test.result == "PASSED" and path.exists()
+    assert CommandTrace.load(str(path)).seed == 5
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["nvme3"]
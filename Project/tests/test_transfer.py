@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from Test.io_passthru_wrapper import NvmeIOError
+from Test.nvme_simulator import NVME_SC_INVALID_FIELD, SimulatedController
+from Test.transfer import SequentialTransfer, TransferLimits, open_sequential, split_extent, transfer_limits
+
+BS = 4096
+
+
+@pytest.fixture
+def ctrl():
+    # MDTS 2: 16 KiB, 4 blocks per command
+    ctrl = SimulatedController("/dev/nvme8", capacity_blocks=1 << 12, id_ctrl={"mdts": 2})
+    yield ctrl
+    ctrl.close()
+
+
+def test_split_extent():
+    assert list(split_extent(0, 8, 4)) == [(0, 4), (4, 4)]
+    assert list(split_extent(3, 10, 4)) == [(3, 4), (7, 4), (11, 2)]
+    assert list(split_extent(5, 3, 4)) == [(5, 3)]
+    assert list(split_extent(5, 0, 4)) == []
+
+
+def test_transfer_limits(ctrl):
+    limits = transfer_limits(ctrl, 1)
+    assert (limits.lba_size, limits.max_bytes, limits.max_blocks, limits.mdts) == (BS, 4 * BS, 4, 2)
+    # Whole blocks only, at least one
+    assert TransferLimits(BS, 3 * BS + 100).max_blocks == 3
+    assert TransferLimits(BS, 100).max_blocks == 1
+
+
+def test_roundtrip_unaligned(ctrl):
+    # 11 blocks from LBA 3: neither end on a command boundary
+    data = bytes((i * 7) & 0xFF for i in range(11 * BS))
+    engine, transfer = open_sequential(ctrl, 1, queue_depth=4, buffer_size=2 * 4 * BS)
+    with engine, transfer:
+        assert transfer.slots == 2
+        stats = asyncio.run(transfer.write_from(3, data))
+        assert (stats.bytes, stats.commands) == (11 * BS, 3)
+        out = bytearray(11 * BS)
+        stats = asyncio.run(transfer.read_into(3, out))
+        assert stats.commands == 3
+    assert out == data
+    blocks = ctrl.namespaces[1].blocks
+    assert 2 not in blocks and 14 not in blocks
+    assert blocks[13] == data[10 * BS:]
+
+
+def test_partial_blocks_rejected(ctrl):
+    engine, transfer = open_sequential(ctrl, 1, queue_depth=2, buffer_size=4 * BS)
+    with engine, transfer:
+        with pytest.raises(ValueError):
+            asyncio.run(transfer.write_from(0, bytes(BS + 1)))
+        with pytest.raises(ValueError):
+            asyncio.run(transfer.read_into(0, bytearray(BS - 1)))
+
+
+def test_oversize_command_fails(ctrl):
+    # Limits claiming 8 blocks per command: the controller (MDTS 2) refuses them
+    engine = ctrl.open_io_engine(1, queue_depth=2, block_size=BS)
+    with engine, SequentialTransfer(engine, TransferLimits(BS, 8 * BS, 2), 8 * BS) as transfer:
+        with pytest.raises(NvmeIOError) as err:
+            asyncio.run(transfer.write(0, 8))
+        assert err.value.status == NVME_SC_INVALID_FIELD
+
+
+def test_block_size_mismatch(ctrl):
+    engine = ctrl.open_io_engine(1, queue_depth=2, block_size=512)
+    with engine, pytest.raises(ValueError):
+        SequentialTransfer(engine, TransferLimits(BS, 4 * BS), 4 * BS)
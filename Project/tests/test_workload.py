@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import pytest
+from Test.nvme_simulator import SimulatedController
+from Test.workload import IntegrityWorkload, SlotBuffers
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_slot_buffers_equals(use_mmap):
+    buffers = SlotBuffers(4, 4096, use_mmap=use_mmap)
+    buffers.view(2)[:] = b"\x07" * 4096
+    assert buffers.equals(2, b"\x07" * 4096, 4096)
+    assert buffers.equals(2, memoryview(b"\x07" * 8192), 4096)     # only the first nbytes count
+    assert buffers.equals(2, b"\x07" * 100, 100)
+    assert not buffers.equals(2, b"\x07" * 4095 + b"\x08", 4096)
+    assert not buffers.equals(1, b"\x07" * 16, 16)
+    assert not buffers.equals(3, b"\x07" * 16, 16)
+    buffers.close()
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_integrity_workload_finds_corruption(use_mmap):
+    ctrl = SimulatedController()
+    with ctrl.open_io_engine(queue_depth=4, max_blocks=4) as engine, \
+            IntegrityWorkload(engine, seed=3, use_mmap=use_mmap, logger=logging.getLogger("workload")) as workload:
+        extents = [(lba, 4) for lba in range(0, 64, 4)]
+        assert not any(asyncio.run(workload.write_batch(extents)))
+        # One byte of LBA 9 changes, LBA 20 gets the content of LBA 21
+        ns = ctrl.namespaces[1]
+        block = bytearray(ns.blocks[9])
+        block[100] ^= 0xFF
+        ns.blocks[9] = bytes(block)
+        ns.blocks[20] = ns.blocks[21]
+        assert not any(asyncio.run(workload.verify_batch(extents)))
+        report = workload.report()
+    assert report["verified_blocks"] == 64
+    assert report["corrupted_lbas"] == [9, 20]
+    assert {(c["lba"], c["kind"]) for c in report["corruptions"]} == {(9, "data"), (20, "misdirected")}